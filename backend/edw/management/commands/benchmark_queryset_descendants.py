@@ -0,0 +1,128 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+``benchmark_queryset_descendants``
+---------------------
+
+``benchmark_queryset_descendants`` compares descendants queries built by ``get_queryset_descendants``:
+legacy OR chain (one predicate per node), coalesced intervals and VALUES join.
+
+Without ``--database`` nodes are taken from a synthetic forest, query build time and SQL size are measured,
+the database is not queried. With ``--database`` random terms are taken from the configured database
+and execution time and result count are reported.
+"""
+from __future__ import unicode_literals
+
+import operator
+import random
+import timeit
+from functools import reduce
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Q
+
+from edw import settings as edw_settings
+from edw.models.mptt_info import get_descendants_ranges, get_queryset_descendants
+from edw.models.term import TermModel
+
+STRATEGIES = ('legacy', 'ranges', 'join')
+
+
+def legacy_queryset_descendants(nodes, include_self=False):
+    """
+    One OR predicate per node, as before the intervals coalescing.
+    """
+    filters = []
+    for n in nodes:
+        if n.get_descendant_count():
+            if include_self:
+                filters.append(Q(tree_id=n.tree_id, lft__gt=n.lft - 1, rght__lt=n.rght + 1))
+            else:
+                filters.append(Q(tree_id=n.tree_id, lft__gt=n.lft, rght__lt=n.rght))
+        elif include_self:
+            filters.append(Q(pk=n.pk))
+    if not filters:
+        return nodes[0].__class__.objects.filter(id__isnull=True)
+    return nodes[0].__class__.objects.filter(reduce(operator.or_, filters))
+
+
+def make_nodes(width, depth):
+    """
+    Synthetic forest: `width` trees, every node has `width` children up to `depth` levels.
+    """
+    nodes = []
+    counter = [0]
+
+    def node(tree_id, lft, level):
+        counter[0] += 1
+        term = TermModel(id=counter[0], tree_id=tree_id, lft=lft, rght=0, level=level, active=True)
+        nodes.append(term)
+        rght = lft + 1
+        if level < depth:
+            for i in range(width):
+                rght = node(tree_id, rght, level + 1) + 1
+        term.rght = rght
+        return rght
+
+    for tree_id in range(1, width + 1):
+        node(tree_id, 1, 0)
+    return nodes
+
+
+def measure(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat)) * 1000
+
+
+class Command(BaseCommand):
+    help = "Compare descendants queries: legacy OR chain, coalesced intervals and VALUES join."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nodes', default='10,100,300,600', help="Comma separated numbers of nodes")
+        parser.add_argument('--width', type=int, default=5, help="Number of children of every synthetic node")
+        parser.add_argument('--depth', type=int, default=5, help="Depth of the synthetic forest")
+        parser.add_argument('--include-self', action='store_true', default=False, help="Include nodes in result")
+        parser.add_argument('--database', action='store_true', default=False,
+                            help="Take nodes from the database and run the queries")
+        parser.add_argument('--repeat', type=int, default=5, help="Number of timing repeats")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed")
+
+    def handle(self, **options):
+        rnd = random.Random(options['seed'])
+        include_self, repeat = options['include_self'], options['repeat']
+        if options['database']:
+            population = list(TermModel.objects.all())
+            self.stdout.write("vendor: {}, terms: {}".format(connections[TermModel.objects.db].vendor,
+                                                             len(population)))
+        else:
+            population = make_nodes(options['width'], options['depth'])
+            self.stdout.write("synthetic terms: {}".format(len(population)))
+
+        header = "{:>8} {:>8}".format('nodes', 'ranges')
+        for strategy in STRATEGIES:
+            header += " | {:>10} {:>10}".format(strategy + ' ms', 'count' if options['database'] else 'sql')
+        self.stdout.write(header)
+
+        config = edw_settings.MPTT_DESCENDANTS
+        threshold = config['ranges_join_threshold']
+        try:
+            for count in [int(x) for x in options['nodes'].split(',') if x]:
+                nodes = rnd.sample(population, min(count, len(population)))
+                row = "{:>8} {:>8}".format(len(nodes), len(get_descendants_ranges(nodes, include_self)))
+                for strategy in STRATEGIES:
+                    if strategy == 'legacy':
+                        fn = lambda: legacy_queryset_descendants(nodes, include_self)
+                    else:
+                        # 'ranges' - всегда цепочка OR по интервалам, 'join' - всегда соединение со списком VALUES
+                        config['ranges_join_threshold'] = 0 if strategy == 'ranges' else -1
+                        fn = lambda: get_queryset_descendants(nodes, include_self)
+                    if options['database']:
+                        qs = fn()
+                        row += " | {:>10.2f} {:>10}".format(measure(lambda: qs.all().count(), repeat), qs.count())
+                    else:
+                        row += " | {:>10.2f} {:>10}".format(measure(lambda: str(fn().query), repeat),
+                                                            len(str(fn().query)))
+                self.stdout.write(row)
+        finally:
+            config['ranges_join_threshold'] = threshold
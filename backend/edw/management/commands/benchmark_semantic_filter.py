@@ -0,0 +1,120 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+``benchmark_semantic_filter``
+---------------------
+
+``benchmark_semantic_filter`` compares semantic filter strategies.
+
+Without ``--terms``/``--data-mart`` it measures query build time and SQL size on a synthetic
+terms tree, the database is not queried. Legacy CNF expansion size is reported for reference.
+
+With ``--terms`` or ``--data-mart`` it runs every strategy against the configured database
+(SQLite, PostgreSQL, ...) and reports execution time and result count.
+"""
+from __future__ import unicode_literals
+
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from edw.models.data_mart import DataMartModel
+from edw.models.entity import EntityModel
+from edw.models.mptt_info import TermInfo, TermTreeInfo
+from edw.models.term import TermModel
+
+STRATEGIES = ('in', 'intersect', 'group_by', 'exists')
+
+
+def make_tree(branches, width):
+    """
+    Synthetic tree: ROOT(AND) -> OR -> `branches` x AND -> `width` x OR -> selected leaf.
+    Legacy CNF expansion produces `width ** branches` filters.
+    """
+    counter = [0]
+
+    def node(parent, rule, is_leaf=False):
+        counter[0] += 1
+        term = TermModel(id=counter[0], parent_id=parent.term.id if parent.term.id else None, semantic_rule=rule,
+                         active=True, tree_id=1, lft=1, rght=2, level=0)
+        info = tree[term.id] = TermInfo(term=term, is_leaf=is_leaf)
+        parent.is_leaf = False
+        parent.append(info)
+        return info
+
+    root = TermInfo(term=TermModel(semantic_rule=TermModel.ROOT_RULE, active=True))
+    tree = TermTreeInfo(root)
+    or_node = node(root, TermModel.OR_RULE)
+    for i in range(branches):
+        and_node = node(or_node, TermModel.AND_RULE)
+        for j in range(width):
+            node(node(and_node, TermModel.OR_RULE), TermModel.OR_RULE, is_leaf=True)
+    return tree
+
+
+def measure(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat)) * 1000
+
+
+class Command(BaseCommand):
+    help = "Compare semantic filter strategies: query build time, SQL size and execution time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--branches', type=int, default=8, help="Maximum number of OR branches")
+        parser.add_argument('--width', type=int, default=3, help="Number of AND sub-branches per OR branch")
+        parser.add_argument('--repeat', type=int, default=5, help="Number of timing repeats")
+        parser.add_argument('--legacy-limit', type=int, default=5000,
+                            help="Skip legacy CNF expansion when filters count exceeds this limit")
+        parser.add_argument('--terms', default='', help="Comma separated terms ids, run strategies on database")
+        parser.add_argument('--data-mart', type=int, default=None, help="Data mart id, run strategies on database")
+        parser.add_argument('--fix-it', action='store_true', default=False, help="Fix terms tree on decompress")
+        parser.add_argument('--strategies', default=','.join(STRATEGIES),
+                            help="Comma separated strategies: {}".format(', '.join(STRATEGIES)))
+
+    def handle(self, **options):
+        strategies = [x for x in options['strategies'].split(',') if x]
+        if options['terms'] or options['data_mart'] is not None:
+            self.run_database(strategies, **options)
+        else:
+            self.run_synthetic(strategies, **options)
+
+    def run_synthetic(self, strategies, **options):
+        width, repeat = options['width'], options['repeat']
+        queryset = EntityModel.objects.all()
+
+        header = "{:>8} {:>8} {:>12}".format('branches', 'selected', 'cnf filters')
+        for strategy in strategies:
+            header += " | {:>10} {:>10}".format(strategy + ' ms', 'sql')
+        self.stdout.write(header)
+
+        for branches in range(1, options['branches'] + 1):
+            tree = make_tree(branches, width)
+            selected = len([x for x in tree.values() if x.is_leaf])
+
+            cnf_size = width ** branches
+            if cnf_size <= options['legacy_limit']:
+                cnf_size = len(tree.root.term.make_filters(term_info=tree.root, field_name='terms'))
+            row = "{:>8} {:>8} {:>12}".format(branches, selected, cnf_size)
+
+            for strategy in strategies:
+                fn = lambda: str(queryset._semantic_predicate_filter(tree, 'terms', strategy).query)
+                row += " | {:>10.2f} {:>10}".format(measure(fn, repeat), len(fn()))
+            self.stdout.write(row)
+
+    def run_database(self, strategies, **options):
+        value = [int(x) for x in options['terms'].split(',') if x]
+        if options['data_mart'] is not None:
+            value.extend(DataMartModel.objects.get(pk=options['data_mart']).active_terms_ids)
+        tree = TermModel.decompress(value, options['fix_it'])
+        queryset = EntityModel.objects.active()
+
+        self.stdout.write("vendor: {}, selected terms: {}".format(connections[queryset.db].vendor, len(value)))
+        self.stdout.write("{:>10} {:>10} {:>10} {:>10}".format('strategy', 'count', 'ms', 'sql'))
+        for strategy in strategies:
+            qs = queryset._semantic_predicate_filter(tree, 'terms', strategy)
+            count = qs.count()
+            ms = measure(lambda: queryset._semantic_predicate_filter(tree, 'terms', strategy).count(),
+                         options['repeat'])
+            self.stdout.write("{:>10} {:>10} {:>10.2f} {:>10}".format(strategy, count, ms, len(str(qs.query))))
@@ -0,0 +1,105 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+``benchmark_term_tree``
+---------------------
+
+``benchmark_term_tree`` measures decompress -> trim -> get_hash of terms trees on a large synthetic forest.
+
+The synthetic forest is loaded into the in-process snapshot, the database is not queried.
+Full copy expanding (``expand()``) is reported for reference against copy-on-write trimming.
+"""
+from __future__ import unicode_literals
+
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from edw import settings as edw_settings
+from edw.models.mptt_info import TermInfo
+from edw.models.mptt_snapshot import MPTTForestSnapshot
+from edw.models.term import TermModel
+
+FIELD_NAMES = ('id', 'parent_id', 'tree_id', 'lft', 'rght', 'level', 'active', 'semantic_rule')
+
+
+def make_rows(width, depth):
+    """
+    Synthetic forest: `width` trees, every node has `width` children up to `depth` levels,
+    rows are in (tree_id, lft) order.
+    """
+    rows = []
+    counter = [0]
+
+    def node(parent_id, tree_id, lft, level):
+        counter[0] += 1
+        row = [counter[0], parent_id, tree_id, lft, 0, level, True, TermModel.OR_RULE]
+        rows.append(row)
+        rght = lft + 1
+        if level < depth:
+            for i in range(width):
+                rght = node(row[0], tree_id, rght, level + 1) + 1
+        row[4] = rght
+        return rght
+
+    for tree_id in range(1, width + 1):
+        node(None, tree_id, 1, 0)
+    return [tuple(x) for x in rows]
+
+
+def measure(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat)) * 1000
+
+
+class Command(BaseCommand):
+    help = "Measure decompress, trim and get_hash of terms trees on a large synthetic forest."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=6, help="Number of children of every node")
+        parser.add_argument('--depth', type=int, default=5, help="Depth of the synthetic forest")
+        parser.add_argument('--selected', type=int, default=200, help="Number of selected terms")
+        parser.add_argument('--trim', type=int, default=1000, help="Number of ids passed to trim")
+        parser.add_argument('--repeat', type=int, default=5, help="Number of timing repeats")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed")
+
+    def handle(self, **options):
+        rnd = random.Random(options['seed'])
+        rows = make_rows(options['width'], options['depth'])
+        snapshot = MPTTForestSnapshot(TermModel, 0, FIELD_NAMES, rows)
+        # снимок не сверяется с версией в глобальном кэше
+        snapshot.checked_at = float('inf')
+
+        ids = [row[0] for row in rows]
+        selected = rnd.sample(ids, min(options['selected'], len(ids)))
+        trim_ids = rnd.sample(ids, min(options['trim'], len(ids)))
+        root_term = TermModel(semantic_rule=TermModel.ROOT_RULE, active=True)
+
+        registry, enabled = MPTTForestSnapshot._registry.get(TermModel, None), edw_settings.TERM_SNAPSHOT['enabled']
+        MPTTForestSnapshot._registry[TermModel] = snapshot
+        edw_settings.TERM_SNAPSHOT['enabled'] = True
+        try:
+            tree = TermInfo.decompress(root_term, selected)
+            expanded = tree.expand()
+            self.stdout.write("terms: {}, selected: {}, tree: {}, expanded: {}".format(
+                len(rows), len(selected), len(tree), len(expanded)))
+
+            repeat = options['repeat']
+            timings = (
+                ('decompress', lambda: TermInfo.decompress(root_term, selected)),
+                ('expand', lambda: tree.expand()),
+                ('expand cow', lambda: tree.expand(copy_on_write=True)),
+                ('trim', lambda: tree.trim(trim_ids)),
+                ('get_hash', lambda: tree.get_hash()),
+                ('pipeline', lambda: TermInfo.decompress(root_term, selected).trim(trim_ids).get_hash()),
+            )
+            self.stdout.write("{:>12} {:>10}".format('stage', 'ms'))
+            for name, fn in timings:
+                self.stdout.write("{:>12} {:>10.2f}".format(name, measure(fn, repeat)))
+        finally:
+            edw_settings.TERM_SNAPSHOT['enabled'] = enabled
+            if registry is not None:
+                MPTTForestSnapshot._registry[TermModel] = registry
+            else:
+                MPTTForestSnapshot._registry.pop(TermModel, None)
@@ -0,0 +1,87 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+``benchmark_terms_cache``
+---------------------
+
+``benchmark_terms_cache`` compares entities terms ids cache hit rate under a write-heavy workload
+for the global buffer wipe and for the targeted invalidation journal.
+
+Cached entries depend on contiguous ranges of a synthetic terms set, every write touches
+a few random terms, like an entity save does. Uses the configured cache backend, the database
+is not queried.
+"""
+from __future__ import unicode_literals
+
+import random
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from edw.models.cache import InvalidationJournal, QuerySetCachedResultMixin
+
+
+class CachedResult(QuerySetCachedResultMixin, list):
+
+    misses = 0
+
+    def prepare_for_cache(self, data):
+        CachedResult.misses += 1
+        return super(CachedResult, self).prepare_for_cache(data)
+
+
+class Command(BaseCommand):
+    help = "Compare terms ids cache hit rate for global buffer wipe and targeted invalidation journal."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--terms', type=int, default=2000, help="Number of synthetic terms")
+        parser.add_argument('--entries', type=int, default=200, help="Number of distinct cached entries")
+        parser.add_argument('--dependencies', type=int, default=50, help="Number of terms every entry depends on")
+        parser.add_argument('--write-terms', type=int, default=3, help="Number of terms touched by every write")
+        parser.add_argument('--operations', type=int, default=20000, help="Number of operations")
+        parser.add_argument('--write-ratio', type=float, default=0.2, help="Share of write operations")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed")
+
+    def handle(self, **options):
+        self.stdout.write("{:>8} {:>10} {:>10} {:>10}".format('mode', 'reads', 'hit rate', 'ms'))
+        for mode in ('wipe', 'journal'):
+            reads, hit_rate, ms = self.run(mode, **options)
+            self.stdout.write("{:>8} {:>10} {:>10.2%} {:>10.2f}".format(mode, reads, hit_rate, ms))
+
+    def run(self, mode, **options):
+        rnd = random.Random(options['seed'])
+        prefix = 'bnch_t_c:{}:{}'.format(mode, int(time.time() * 1000))
+        journal = InvalidationJournal.factory('{}:jrnl'.format(prefix), max_lag=options['operations'])
+
+        entries = []
+        for i in range(options['entries']):
+            start = rnd.randint(0, options['terms'] - options['dependencies'])
+            entries.append(('{}:{}'.format(prefix, i), range(start, start + options['dependencies'])))
+
+        cached_keys = set()
+        CachedResult.misses = reads = 0
+        start_time = time.time()
+        for _ in range(options['operations']):
+            if rnd.random() < options['write_ratio']:
+                terms_ids = rnd.sample(range(options['terms']), options['write_terms'])
+                if mode == 'journal':
+                    journal.record(terms_ids)
+                else:
+                    cache.delete_many(list(cached_keys))
+                    cached_keys.clear()
+            else:
+                key, dependencies = rnd.choice(entries)
+                result = CachedResult([key])
+                result._cache_key = key
+                if mode == 'journal':
+                    result.cache(journal=journal, dependencies=dependencies)
+                else:
+                    result.cache(on_cache_set=cached_keys.add)
+                reads += 1
+        ms = (time.time() - start_time) * 1000
+
+        cache.delete_many([key for key, dependencies in entries])
+        hit_rate = 1 - CachedResult.misses / float(reads) if reads else 0
+        return reads, hit_rate, ms
@@ -0,0 +1,30 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+``build_entity_attributes``
+---------------------
+
+``build_entity_attributes`` computes and saves materialized characteristics and marks of all entities
+(``EntityAttributesModel``). Run it once after the model is materialized, later the attributes
+are refreshed by ``update_entities_attributes`` task on changes.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from edw.models.entity import EntityModel
+from edw.models.related.entity_attributes import EntityAttributesModel, is_entity_attributes_enabled
+
+
+class Command(BaseCommand):
+    help = "Compute and save materialized characteristics and marks of all entities"
+
+    def handle(self, **options):
+        if not is_entity_attributes_enabled():
+            raise CommandError("EntityAttributesModel is not materialized "
+                               "or EDW_ENTITY_ATTRIBUTES_PROJECTION['enabled'] is False")
+        start = time.time()
+        count = EntityAttributesModel.refresh(EntityModel.objects.order_by().values_list('id', flat=True))
+        self.stdout.write("Entity attributes built: {} entities, {:.2f}s".format(count, time.time() - start))
@@ -0,0 +1,34 @@
+# ------------------------------------------------------------------------
+# coding=utf-8
+# ------------------------------------------------------------------------
+"""
+``build_entity_terms_index``
+---------------------
+
+``build_entity_terms_index`` builds inverted index term id -> entities ids bitmap
+and saves it to ``EDW_ENTITY_TERMS_INDEX['path']``. Run it periodically, processes reload
+the index file when the changes journal in cache is lost.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from edw import settings as edw_settings
+from edw.models.terms_index import EntityTermsIndex
+
+
+class Command(BaseCommand):
+    help = "Build inverted entity terms index and save it to EDW_ENTITY_TERMS_INDEX['path']"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None, help="Index file path")
+
+    def handle(self, **options):
+        path = options['path'] or edw_settings.ENTITY_TERMS_INDEX['path']
+        if not path:
+            raise CommandError("Index file path is not set, use --path or EDW_ENTITY_TERMS_INDEX['path']")
+        start = time.time()
+        index = EntityTermsIndex.build()
+        index.save(path)
+        self.stdout.write("Entity terms index built: {} terms, {:.2f}s".format(len(index.terms), time.time() - start))
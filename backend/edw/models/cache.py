@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import time
+from collections import namedtuple
 from functools import wraps
 
 from django.core.cache import cache
+from django.db import transaction
 
+from edw import settings as edw_settings
 from edw.utils.hash_helpers import create_hash
 
 DEFAULT_CACHE_KEY_ATTR = '_cache_key'
@@ -21,6 +25,86 @@ class empty:
     pass
 
 
+class SingleFlightEntry(object):
+    """
+    RUS: Значение в глобальном кэше с временем актуальности. После него значение считается устаревшим,
+    но еще `stale_timeout` секунд отдается, пока один из процессов вычисляет новое.
+    """
+    def __init__(self, value, fresh_until):
+        self.value = value
+        self.fresh_until = fresh_until
+
+    def is_fresh(self):
+        return self.fresh_until is None or self.fresh_until > time.time()
+
+
+SINGLE_FLIGHT_LOCK_KEY_PATTERN = '{key}:lck'
+
+
+def _set_single_flight_entry(key, value, timeout, on_cache_set):
+    options = edw_settings.CACHE_SINGLE_FLIGHT
+    if timeout is None:
+        entry, hard_timeout = SingleFlightEntry(value, None), None
+    else:
+        entry, hard_timeout = SingleFlightEntry(value, time.time() + timeout), timeout + options['stale_timeout']
+    cache.set(key, entry, hard_timeout)
+    if on_cache_set is not None:
+        on_cache_set(key)
+
+
+def get_or_set_single_flight(key, compute, timeout=DEFAULT_CACHE_TIMEOUT, on_cache_set=None):
+    """
+    ENG: Get value from global cache, compute it in a single worker on miss.
+    RUS: Возвращает значение из глобального кэша. При отсутствии значение вычисляет только процесс,
+    захвативший блокировку (cache.add), остальные ждут его не дольше 'wait_timeout' секунд,
+    после чего вычисляют значение сами. Устаревшее значение отдается, пока вычисляется новое.
+    :param compute: функция вычисления значения
+    :param on_cache_set: функция, вызываемая с ключом после записи значения в кэш
+    """
+    options = edw_settings.CACHE_SINGLE_FLIGHT
+    if not options['enabled']:
+        result = cache.get(key, empty)
+        if result is empty:
+            result = compute()
+            cache.set(key, result, timeout)
+            if on_cache_set is not None:
+                on_cache_set(key)
+        return result
+
+    lock_key = SINGLE_FLIGHT_LOCK_KEY_PATTERN.format(key=key)
+    deadline = None
+    while True:
+        entry = cache.get(key, empty)
+        if entry is not empty:
+            if not isinstance(entry, SingleFlightEntry):
+                # значение записано без single flight
+                return entry
+            if entry.is_fresh():
+                return entry.value
+        if cache.add(lock_key, 1, options['lock_timeout']):
+            try:
+                # значение могло быть записано процессом, освободившим блокировку перед нами
+                fresh_entry = cache.get(key, empty)
+                if isinstance(fresh_entry, SingleFlightEntry) and fresh_entry.is_fresh():
+                    return fresh_entry.value
+                value = compute()
+                _set_single_flight_entry(key, value, timeout, on_cache_set)
+                return value
+            finally:
+                cache.delete(lock_key)
+        if entry is not empty:
+            # значение вычисляется другим процессом, отдаем устаревшее
+            return entry.value
+        now = time.time()
+        if deadline is None:
+            deadline = now + options['wait_timeout']
+        elif now >= deadline:
+            value = compute()
+            _set_single_flight_entry(key, value, timeout, on_cache_set)
+            return value
+        time.sleep(options['wait_interval'])
+
+
 def _parse_cache_key(self, cache_key, *args, **kwargs):
     """
     RUS: Возвращает ключ кэша, если в ключе содержится метод '__call__', то ключ кэша может быть переопределен.
@@ -73,6 +157,74 @@ def add_cache_key(cache_key,
     return add_cache_key_decorator
 
 
+class InvalidationJournal(object):
+    """
+    ENG: Sequence of invalidation records (sets of tags) in global cache.
+    RUS: Журнал инвалидации в глобальном кэше - последовательность записей с множествами тегов
+    (например, id терминов), затронутых изменением данных.
+    Кэшированное значение хранится вместе с тегами, от которых оно зависит, и номером последней записи
+    журнала на момент вычисления. Значение актуально, если ни одна из последующих записей
+    не пересекается с его зависимостями.
+    """
+    SEQUENCE_CACHE_KEY_PATTERN = '{key}:seq'
+    RECORD_CACHE_KEY_PATTERN = '{key}:{seq}'
+
+    _registry = {}
+
+    @staticmethod
+    def factory(key, timeout=DEFAULT_CACHE_TIMEOUT, max_lag=1000):
+        result = InvalidationJournal._registry.get(key, None)
+        if result is None:
+            result = InvalidationJournal._registry[key] = InvalidationJournal(key, timeout, max_lag)
+        return result
+
+    def __init__(self, key, timeout, max_lag):
+        self.key = key
+        self.timeout = timeout
+        self.max_lag = max_lag
+        self.sequence_cache_key = self.SEQUENCE_CACHE_KEY_PATTERN.format(key=key)
+
+    def get_sequence(self):
+        seq = cache.get(self.sequence_cache_key, None)
+        if seq is None:
+            cache.add(self.sequence_cache_key, 0, None)
+            seq = cache.get(self.sequence_cache_key, 0)
+        return seq
+
+    def _record(self, tags):
+        try:
+            seq = cache.incr(self.sequence_cache_key)
+        except ValueError:
+            # счетчик потерян, записи с прежними номерами будут считаться неполными
+            cache.add(self.sequence_cache_key, 0, None)
+            seq = cache.incr(self.sequence_cache_key)
+        cache.set(self.RECORD_CACHE_KEY_PATTERN.format(key=self.key, seq=seq), tags, self.timeout)
+
+    def record(self, tags):
+        """
+        RUS: Добавляет запись в журнал после фиксации транзакции (вне транзакции - сразу).
+        Значение, вычисленное до фиксации по прежним данным, получает меньший номер записи и сбрасывается.
+        """
+        tags = list(tags)
+        if tags:
+            transaction.on_commit(lambda: self._record(tags))
+
+    def get_changed_tags(self, seq, current_seq):
+        """
+        RUS: Возвращает множество тегов записей журнала с номерами (seq, current_seq] или None, если журнал неполон.
+        """
+        if seq > current_seq or current_seq - seq > self.max_lag:
+            return None
+        keys = [self.RECORD_CACHE_KEY_PATTERN.format(key=self.key, seq=i) for i in range(seq + 1, current_seq + 1)]
+        records = cache.get_many(keys)
+        if len(records) != len(keys):
+            return None
+        result = set()
+        for tags in records.values():
+            result.update(tags)
+        return result
+
+
 class QuerySetCachedResultMixin(object):
     """
     ENG: Try find result in cache, otherwise calculate it.
@@ -83,40 +235,115 @@ class QuerySetCachedResultMixin(object):
     def prepare_for_cache(data):
         return _ReadyForCache(data)
 
-    def _get_from_global_cache(self, key, on_cache_set, timeout):
+    def _prepare(self, fields=None):
+        return self.prepare_for_cache(self) if fields is None else _CompactReadyForCache(self, fields)
+
+    def _get_from_global_cache(self, key, on_cache_set, timeout, fields=None):
         """
         RUS: Получает результат кэширования по ключу из глобального кэша.
         """
-        result = cache.get(key, empty)
+        return get_or_set_single_flight(key, lambda: self._prepare(fields), timeout, on_cache_set)
+
+    def _get_from_tiered_cache(self, key, on_cache_set, timeout, tier, fields=None):
+        """
+        RUS: Получает результат из локального LRU кэша процесса, при отсутствии - из глобального кэша.
+        """
+        result = tier.get(key, empty)
         if result == empty:
-            result = self.prepare_for_cache(self)
-            cache.set(key, result, timeout)
-            if on_cache_set is not None:
-                on_cache_set(key)
+            result = self._get_from_global_cache(key, on_cache_set, timeout, fields)
+            tier.set(key, result)
+        return result
+
+    @staticmethod
+    def _chain_on_cache_set(*callbacks):
+        callbacks = [x for x in callbacks if x is not None]
+
+        def on_cache_set(key):
+            for callback in callbacks:
+                callback(key)
+        return on_cache_set
+
+    def _get_from_journaled_cache(self, key, on_cache_set, timeout, journal, dependencies, fields=None):
+        """
+        RUS: Получает результат из глобального кэша с проверкой зависимостей по журналу инвалидации.
+        Теги зависимостей не хранятся в кэше, они однозначно определяются ключом и вычисляются
+        функцией `dependencies` только при проверке журнала.
+        """
+        # номер записи журнала получаем до вычисления результата
+        current_seq = journal.get_sequence()
+        entry = cache.get(key, empty)
+        if isinstance(entry, tuple):
+            seq, result = entry
+            if seq == current_seq:
+                return result
+            changed_tags = journal.get_changed_tags(seq, current_seq)
+            if changed_tags is not None and changed_tags.isdisjoint(
+                    dependencies() if callable(dependencies) else dependencies):
+                # результат актуален, сохраняем его с текущим номером, чтобы не проверять журнал повторно
+                cache.set(key, (current_seq, result), timeout)
+                return result
+
+        result = self._prepare(fields)
+        cache.set(key, (current_seq, result), timeout)
+        if on_cache_set is not None:
+            on_cache_set(key)
 
         return result
 
     def cache(self,
               on_cache_set=None,
               timeout=DEFAULT_CACHE_TIMEOUT,
-              local_cache=None):
+              local_cache=None,
+              journal=None,
+              dependencies=None,
+              generation=None,
+              fields=None):
         """
         RUS: Возвращает результат кэширования по ключу из локального кэша, если пустой результат,
         то ключ локального кэша создаетсяиз глобального.
+        Если задано поколение семейства ключей `generation` (CacheGeneration), номер поколения добавляется к ключу.
+        Если задан журнал инвалидации, результат сохраняется с номером записи журнала и сбрасывается только
+        при изменении зависимостей `dependencies` (список тегов или функция, возвращающая его),
+        зависимости должны однозначно определяться ключом кэша.
+        Если заданы поля `fields`, в кэше хранятся кортежи их значений вместо экземпляров моделей,
+        результат - список легковесных строк (CompactRow) с доступом к полям как к атрибутам,
+        поля связанных моделей задаются через '__' (например, 'parent__name' доступно как `row.parent.name`).
+        Набор полей для одного ключа кэша должен быть постоянным.
         Если ключ пустой, возбуждается исключение.
         """
         cache_key_attr = getattr(self, '_cache_key_attr', DEFAULT_CACHE_KEY_ATTR)
         key = getattr(self, cache_key_attr, empty)
         if key != empty:
+            tier = None
+            if generation is not None:
+                key = generation.make_key(key)
+                on_cache_set = self._chain_on_cache_set(generation.record, on_cache_set)
+                # значения с журналом инвалидации проверяются по глобальному кэшу при каждом чтении
+                if journal is None:
+                    tier = generation.local_cache
+            if journal is not None:
+                get_from_global_cache = lambda: self._get_from_journaled_cache(
+                    key, on_cache_set, timeout, journal, dependencies, fields)
+            elif tier is not None:
+                get_from_global_cache = lambda: self._get_from_tiered_cache(
+                    key, on_cache_set, timeout, tier, fields)
+            else:
+                get_from_global_cache = lambda: self._get_from_global_cache(key, on_cache_set, timeout, fields)
+            if fields is not None:
+                get_compact_result = get_from_global_cache
+                get_from_global_cache = lambda: _as_compact_rows(get_compact_result())
             if local_cache is not None:
                 result = local_cache.get(key, empty)
                 if result == empty:
-                    result = self._get_from_global_cache(key, on_cache_set, timeout)
+                    result = get_from_global_cache()
                     local_cache[key] = result
                 # создаем поверхностную копию чтобы минимизировать возможность "затереть" кеш
                 result = result[:]
+            elif tier is not None:
+                # результат из локального кэша процесса разделяется между запросами, возвращаем копию
+                result = get_from_global_cache()[:]
             else:
-                result = self._get_from_global_cache(key, on_cache_set, timeout)
+                result = get_from_global_cache()
         else:
             raise AttributeError(
                 '{cls}.{attr} not found.'.format(
@@ -140,3 +367,54 @@ class _ReadyForCache(QuerySetCachedResultMixin, list):
             if cache_key != empty:
                 setattr(self, cache_key_attr, cache_key)
         super(_ReadyForCache, self).__init__(data)
+
+
+_compact_row_classes = {}
+
+
+def get_compact_row_class(fields):
+    """
+    RUS: Возвращает класс легковесной строки (namedtuple) для набора полей.
+    Поля связанных моделей вида 'parent__name' группируются в свойство `parent`, которое возвращает
+    строку связанной модели или None, если все ее поля пусты. Свойство `pk` возвращает `id`.
+    """
+    fields = tuple(fields)
+    row_class = _compact_row_classes.get(fields, None)
+    if row_class is None:
+        attrs = {'__slots__': ()}
+        related = {}
+        for i, field in enumerate(fields):
+            if '__' in field:
+                prefix, name = field.split('__', 1)
+                related.setdefault(prefix, []).append((name, i))
+        for prefix, items in related.items():
+            related_class = get_compact_row_class([name for name, i in items])
+            indexes = tuple(i for name, i in items)
+
+            def getter(self, related_class=related_class, indexes=indexes):
+                values = [self[i] for i in indexes]
+                return related_class._make(values) if any(x is not None for x in values) else None
+            attrs[str(prefix)] = property(getter)
+        if 'id' in fields and 'pk' not in fields:
+            attrs[str('pk')] = property(lambda self: self.id)
+        base = namedtuple(str('CompactRowBase'), [str(x) for x in fields])
+        row_class = _compact_row_classes[fields] = type(str('CompactRow'), (base, ), attrs)
+    return row_class
+
+
+class _CompactReadyForCache(list):
+    """
+    RUS: Компактный формат кэширования - список кортежей значений полей `fields`.
+    """
+    def __init__(self, data, fields):
+        self.fields = tuple(fields)
+        super(_CompactReadyForCache, self).__init__(data.values_list(*self.fields))
+
+    def as_rows(self):
+        row_class = get_compact_row_class(self.fields)
+        return [row_class._make(x) for x in self]
+
+
+def _as_compact_rows(result):
+    # результат мог быть сохранен в полном формате до перехода на компактный
+    return result.as_rows() if isinstance(result, _CompactReadyForCache) else result
@@ -22,7 +22,7 @@ from polymorphic.query import PolymorphicQuerySet
 from rest_framework.reverse import reverse
 from six import with_metaclass
 
-from .cache import add_cache_key, QuerySetCachedResultMixin
+from .cache import add_cache_key, get_or_set_single_flight, QuerySetCachedResultMixin
 from .fields.tree import TreeForeignKey
 from .mixins.rebuild_tree import RebuildTreeMixin
 from .related import DataMartRelationModel, DataMartPermissionModel
@@ -31,7 +31,7 @@ from .term import TermModel, make_path
 from .. import deferred
 from .. import settings as edw_settings
 from ..signals.mptt import MPTTModelSignalSenderMixin
-from ..utils.circular_buffer_in_cache import RingBuffer
+from ..utils.cache_generation import CacheGeneration, warn_deprecated_buffer
 from ..utils.hash_helpers import get_unique_slug
 
 
@@ -132,6 +132,8 @@ class BaseDataMart(with_metaclass(BaseDataMartMetaclass, MPTTModelSignalSenderMi
     CHILDREN_CACHE_KEY_PATTERN = '{parent_id}:chld'
     CHILDREN_CACHE_TIMEOUT = edw_settings.CACHE_DURATIONS['data_mart_children']
 
+    TREE_GENERATION_CACHE_KEY = 'dm_tr'
+
     # таймаут для кеширования при валидации, необходим при оптимазации старта сервера в несколько потоков
     VALIDATE_TERM_MODEL_CACHE_TIMEOUT = edw_settings.CACHE_DURATIONS['data_mart_validate_term_model']
 
@@ -415,37 +417,49 @@ class BaseDataMart(with_metaclass(BaseDataMartMetaclass, MPTTModelSignalSenderMi
         """
         return super(BaseDataMart, self).get_children()
 
+    @staticmethod
+    def get_children_generation():
+        """
+        RUS: Возвращает поколение ключей кэша запросов, содержащих дочерние элементы.
+        """
+        return CacheGeneration.factory(BaseDataMart.CHILDREN_BUFFER_CACHE_KEY,
+                                       max_size=BaseDataMart.CHILDREN_BUFFER_CACHE_SIZE)
+
     @staticmethod
     def get_children_buffer():
         """
-        RUS: Помещает в буффер результат запроса, содержащий дочерние элементы.
+        RUS: Устаревший синоним `get_children_generation`, возвращает поколение, совместимое с кольцевым буфером.
         """
-        return RingBuffer.factory(BaseDataMart.CHILDREN_BUFFER_CACHE_KEY,
-                                  max_size=BaseDataMart.CHILDREN_BUFFER_CACHE_SIZE)
+        warn_deprecated_buffer('get_children_buffer', 'get_children_generation')
+        return BaseDataMart.get_children_generation()
 
     @staticmethod
     def clear_children_buffer():
         """
-        RUS: Очищает из буффера результат запроса, содержащий дочерние элементы.
+        RUS: Очищает кэш запросов, содержащих дочерние элементы, сменой поколения ключей.
+        """
+        BaseDataMart.get_children_generation().incr()
+
+    @staticmethod
+    def get_tree_generation():
+        """
+        RUS: Возвращает поколение дерева витрин данных, меняется при любом изменении витрин данных и их терминов.
+        Используется для формирования ETag ответов REST интерфейса.
         """
-        buf = BaseDataMart.get_children_buffer()
-        keys = buf.get_all()
-        buf.clear()
-        cache.delete_many(keys)
+        return CacheGeneration.factory(BaseDataMart.TREE_GENERATION_CACHE_KEY)
 
     @staticmethod
     def get_all_active_terms_ids():
         """
         RUS: Возвращает id всех активных терминов из кэша и добавляет в кэш, если их там нет.
         """
-        key = BaseDataMart.ALL_ACTIVE_TERMS_IDS_CACHE_KEY
-        result = cache.get(key, None)
-        if result is None:
+        def compute():
             active_terms_ids = DataMartModel.terms.through.objects.distinct().filter(term__active=True).values_list(
                 'term__id', flat=True)
-            result = list(TermModel.decompress(active_terms_ids, fix_it=False).keys())
-            cache.set(key, result, BaseDataMart.ALL_ACTIVE_TERMS_CACHE_TIMEOUT)
-        return result
+            return list(TermModel.decompress(active_terms_ids, fix_it=False).keys())
+
+        return get_or_set_single_flight(BaseDataMart.ALL_ACTIVE_TERMS_IDS_CACHE_KEY, compute,
+                                        BaseDataMart.ALL_ACTIVE_TERMS_CACHE_TIMEOUT)
 
     @staticmethod
     def get_all_active_terms_count():
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+
+from edw.models.related.entity_attributes import BaseEntityAttributes
+
+
+class EntityAttributes(BaseEntityAttributes):
+    """
+    ENG: Materialize characteristics and marks of entities.
+    RUS: Материализованные характеристики и метки сущностей.
+    """
+    class Meta(BaseEntityAttributes.Meta):
+        """
+        RUS: Метаданные класса EntityAttributes.
+        """
+        abstract = False
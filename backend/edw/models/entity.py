@@ -2,19 +2,20 @@
 from __future__ import unicode_literals, division
 
 import re
+import threading
 from functools import reduce
 from operator import __or__ as OR
-from math import ceil
 
 from django.core.cache import cache
 from django.core.exceptions import (
+    EmptyResultSet,
     FieldDoesNotExist,
+    FieldError,
     ObjectDoesNotExist,
     MultipleObjectsReturned
 )
 from django.db import models, transaction, connections
-from django.db.models import Q, Count
-from django.db.models.sql.datastructures import EmptyResultSet
+from django.db.models import Q, Count, Case, When, F
 from django.utils import six
 from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible, force_text
@@ -31,8 +32,9 @@ from polymorphic.models import PolymorphicModel
 from polymorphic.query import PolymorphicQuerySet
 from rest_framework.reverse import reverse
 
-from .cache import add_cache_key, QuerySetCachedResultMixin
+from .cache import add_cache_key, QuerySetCachedResultMixin, InvalidationJournal, DEFAULT_CACHE_KEY_ATTR
 from .data_mart import DataMartModel
+from .mptt_info import get_forest_snapshot, _set_cached_parent
 from .mixins.query import (
     CustomGroupByQuerySetMixin,
     CustomCountQuerySetMixin,
@@ -44,23 +46,26 @@ from .related import (
     EntityRelationModel,
     EntityRelatedDataMartModel
 )
+from .related.entity_attributes import EntityAttributesModel, is_entity_attributes_enabled
 from .rest import RESTModelBase
+from .sql.semantic import (
+    make_semantic_predicate,
+    get_m2m_through_fields,
+    SemanticFilterPlan,
+    SemanticSQLBuilder
+)
 from .term import TermModel
+from .terms_index import EntityTermsIndex
 from .. import deferred
 from .. import settings as edw_settings
 from ..signals.entity import post_save as entity_post_save
-from ..utils.circular_buffer_in_cache import RingBuffer, empty
-from ..utils.hash_helpers import hash_unsorted_list
+from ..utils.cache_generation import CacheGeneration, warn_deprecated_buffer
+from ..utils.circular_buffer_in_cache import empty
+from ..utils.hash_helpers import hash_unsorted_list, create_hash
 from ..utils.monkey_patching import patch_class_method
 from ..utils.set_helpers import uniq
 
 
-# округление в стиле python 3
-if six.PY2:
-    _round = round
-    round = lambda x: int(_round(x))
-
-
 # ==============================================================================
 # get_polymorphic_ancestors_models
 # ==============================================================================
@@ -87,7 +92,61 @@ def _get_terms_ids(entities_qs, tree):
     """
     result = getattr(entities_qs, '_terms_ids_cache', None)
     if result is None:
-        result = entities_qs._terms_ids_cache = list(tree.trim(entities_qs.get_related_terms_ids()).keys())
+        # дерево расширяется один раз, узлы разделяются с исходным деревом (только чтение)
+        tree = tree.expand(copy_on_write=True)
+        index = EntityTermsIndex.get()
+        entities_ids = EntityTermsIndex.get_entities_ids(
+            entities_qs, EntityTermsIndex.get_max_ids(connections[entities_qs.db])) if index is not None else None
+        if entities_ids is not None:
+            # пересечения битовых карт вместо DISTINCT выборки из промежуточной таблицы
+            related_terms_ids = index.get_related_terms_ids(entities_ids, tree.keys())
+        else:
+            related_terms_ids = entities_qs.get_related_terms_ids()
+        result = entities_qs._terms_ids_cache = list(tree.soft_trim(related_terms_ids).keys())
+    return result
+
+
+def _get_terms_counts(initial_qs, initial_tree, filter_qs, filter_tree):
+    """
+    RUS: Возвращает список строк (id термина, количество объектов начальной выборки,
+    количество объектов отфильтрованной выборки) за один проход по промежуточной таблице.
+    Выборки считаются независимо, отфильтрованная выборка не обязана быть подмножеством начальной.
+    Количество равно None, если термин отсутствует в актуализированном дереве соответствующей выборки,
+    и 0 для узлов, добавленных в дерево только как предки.
+    """
+    initial_tree, filter_tree = initial_tree.expand(copy_on_write=True), filter_tree.expand(copy_on_write=True)
+    index = EntityTermsIndex.get()
+    initial_ids = filter_ids = None
+    if index is not None:
+        # объекты выбираются из базы только для небольших выборок
+        max_ids = EntityTermsIndex.get_max_ids(connections[initial_qs.db])
+        initial_ids = EntityTermsIndex.get_entities_ids(initial_qs, max_ids)
+        if initial_ids is not None:
+            filter_ids = EntityTermsIndex.get_entities_ids(filter_qs, max_ids)
+    if filter_ids is not None:
+        counts = index.get_terms_counts(set(initial_tree.keys()) | set(filter_tree.keys()), initial_ids, filter_ids)
+    else:
+        through, entity_field, term_field = get_m2m_through_fields(initial_qs.model, EntityTermsIndex.FIELD_NAME)
+        entity_attr, term_attr = '{}_id'.format(entity_field), '{}_id'.format(term_field)
+        in_initial = Q(**{'{}__in'.format(entity_attr): initial_qs.order_by().values('pk')})
+        in_filter = Q(**{'{}__in'.format(entity_attr): filter_qs.order_by().values('pk')})
+        rows = through.objects.filter(in_initial | in_filter).order_by().values_list(term_attr).annotate(
+            total=Count(Case(When(in_initial, then=F(entity_attr))), distinct=True),
+            filtered=Count(Case(When(in_filter, then=F(entity_attr))), distinct=True)
+        )
+        counts = dict((pk, (total, filtered)) for pk, total, filtered in rows)
+
+    potential_ids = list(initial_tree.soft_trim([pk for pk, (total, filtered) in counts.items() if total]).keys())
+    real_ids = list(filter_tree.soft_trim([pk for pk, (total, filtered) in counts.items() if filtered]).keys())
+    real_ids_set = set(real_ids)
+    result = []
+    for pk in potential_ids:
+        total, filtered = counts.get(pk, (0, 0))
+        result.append((pk, total, filtered if pk in real_ids_set else None))
+    potential_ids_set = set(potential_ids)
+    for pk in real_ids:
+        if pk not in potential_ids_set:
+            result.append((pk, None, counts.get(pk, (0, 0))[1]))
     return result
 
 
@@ -96,9 +155,12 @@ class BaseEntityQuerySet(JoinQuerySetMixin, CustomCountQuerySetMixin, CustomGrou
     """
     RUS: Запрос к базовой сущности базы данных.
     """
-    SEMANTIC_FILTERS_CHUNK_LIMIT = edw_settings.SEMANTIC_FILTER['filters_chunk_limit']
+    SEMANTIC_FILTER_STRATEGY = edw_settings.SEMANTIC_FILTER['strategy']
+    SEMANTIC_FILTER_MAX_PREDICATES = edw_settings.SEMANTIC_FILTER['max_predicates']
     GROUP_SIZE_ALIAS = 'group_size'
     _JOIN_INDEX_KEY = '_join_idx'
+    _SEMANTIC_FILTER_ALIAS = 'sk'
+    SEMANTIC_FILTER_INDEX_MAX_IDS = edw_settings.ENTITY_TERMS_INDEX['max_ids']
 
     def group_by(self, *fields):
         """
@@ -120,6 +182,72 @@ class BaseEntityQuerySet(JoinQuerySetMixin, CustomCountQuerySetMixin, CustomGrou
             return self.none()
         return self.filter(**alike)
 
+    def cached_count(self):
+        """
+        RUS: Возвращает точное количество объектов, кэшированное по хэшу SQL запроса в текущем поколении
+        ключей кэша количества. Поколение меняется при изменении объектов, их терминов и дерева терминов.
+        """
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        try:
+            sql, params = self.order_by().values(*self._get_count_values()).query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        generation = self.model.get_count_generation()
+        key = generation.make_key(self.model.COUNT_CACHE_KEY_PATTERN.format(
+            query_hash=create_hash('{}:{}'.format(sql, params))))
+        result = cache.get(key, None)
+        if result is None:
+            result = self.count()
+            cache.set(key, result, self.model.COUNT_CACHE_TIMEOUT)
+            generation.record(key)
+        return result
+
+    def alike_groups(self, pks, *fields):
+        """
+        RUS: Возвращает словарь "id -> запрос alike" для набора id двумя запросами вместо запросов по каждому id:
+        значения полей группировки и id объектов всех групп. Id объектов группы сохраняются в запросе (свойство ids),
+        значения полей группировки - в атрибуте alike_values.
+        """
+        alikes = {}
+        for row in self.filter(pk__in=pks).order_by().values_list('pk', *fields):
+            alikes.setdefault(row[0], row[1:])
+        if not alikes:
+            return {}
+        keys = set(alikes.values())
+        members = {}
+        for row in self.filter(reduce(OR, [Q(**dict(zip(fields, key))) for key in keys])).order_by().values_list(
+                'pk', *fields).distinct():
+            members.setdefault(row[1:], set()).add(row[0])
+        result = {}
+        for pk, key in alikes.items():
+            alike = dict(zip(fields, key))
+            group = result[pk] = self.filter(**alike)
+            group.alike_values = alike
+            group.__dict__['ids'] = sorted(members.get(key, ()))
+        return result
+
+    def aggregate_alike(self, alikes, **kwargs):
+        """
+        RUS: Возвращает список агрегаций по каждому словарю значений полей группировки из alikes
+        одним запросом с группировкой. Для запросов с DISTINCT, а также если имена агрегаций совпадают
+        с полями модели, агрегация вычисляется отдельным запросом для каждой группы.
+        """
+        if not alikes:
+            return []
+        if not self.query.distinct:
+            fields = list(alikes[0].keys())
+            try:
+                rows = list(self.filter(reduce(OR, [Q(**x) for x in alikes])).order_by().values(*fields).annotate(
+                    **kwargs))
+            except (ValueError, FieldError):
+                pass
+            else:
+                result = dict((tuple(row[x] for x in fields), dict((key, row[key]) for key in kwargs)) for row in rows)
+                empty_aggregation = dict((key, None) for key in kwargs)
+                return [result.get(tuple(x[y] for y in fields), empty_aggregation) for x in alikes]
+        return [self.filter(**x).aggregate(**kwargs) for x in alikes]
+
     @add_cache_key('actv')
     def active(self):
         """
@@ -146,99 +274,101 @@ class BaseEntityQuerySet(JoinQuerySetMixin, CustomCountQuerySetMixin, CustomGrou
             # "обрезаем" дерево в случаи необходимости
             tree = tree.soft_trim(trim_ids)
 
-        # формируем фильтры
-        filters = tree.root.term.make_filters(term_info=tree.root, field_name=field_name)
-
-        result = self
-        filters_cnt = len(filters)
-        if filters_cnt:
-            """
-            # Pythonic, but working to slow, try refactor queryset
-            """
-            # result = self.filter(filters[0])
-            # for x in filters[1:]:
-            #     result = result.filter(x)
-            # result = result.distinct()
-
-            base_model = next(get_polymorphic_ancestors_models(self.model))
-            pk_alias = self.model._meta.pk.get_attname_column()[1]
-
-            # формируем пачки из фильтров, это позволяет СУБД формировать более оптимальный план запроса
-            j = i = filters_cnt / ceil(filters_cnt / self.SEMANTIC_FILTERS_CHUNK_LIMIT)
-            chunked_filters = []
-            start = 0
-            while j < filters_cnt:
-                stop = round(j)
-                chunked_filters.append(filters[start:stop])
-                j += i
-                start = stop
-            chunked_filters.append(filters[start:])
-
-            # формируем запрос
-            for filters_chunk in chunked_filters:
-                base_qs = base_model.objects.all().filter(filters_chunk[0])
-                for x in filters_chunk[1:]:
-                    base_qs = base_qs.filter(x)
-
-                base_qs = base_qs.distinct().values_list('id', flat=True)
-
-                try:
-                    base_raw_sql, sql_params = base_qs.query.get_compiler(self.db).as_sql()
-                except EmptyResultSet:
-                    result = []
-                else:
-                    idx = result.query.get_context(self._JOIN_INDEX_KEY, 1)
-
-                    inner_model = getattr(base_qs.model, field_name).through
-                    outer_table = base_qs.query.get_initial_alias()
-                    inner_table = inner_model.objects.all().query.get_initial_alias()
-
-                    entity_alias = "{}_id".format(base_model._meta.object_name.lower())
-
-                    # Make safe names
-                    db_ops = connections[self.db].ops
-                    qn = db_ops.quote_name
-                    safe_inner_table, safe_outer_table, safe_entity_alias = [
-                        qn(x) for x in (inner_table, outer_table, entity_alias)
-                    ]
-
-                    # Aliases for inner subquery and nested first table
-                    sk_alias = qn("sk{}".format(idx))
-                    s = inner_model._meta.object_name.upper()
-                    inner_table_alias = "{}{}".format(s, idx)
-                    join_alias = "{}_IJ{}".format(s, idx)
-
-                    # Black magic, transform queryset
-                    regex = re.compile("{}.+?(\s+FROM\s+){}(.+?)INNER\s+JOIN\s+{}\s+ON.+?\)\s*".format(
-                        safe_outer_table, safe_outer_table, safe_inner_table), re.IGNORECASE)
-                    raw_sql = regex.sub(r'{}.{} AS {}\1{} AS {}\2'.format(
-                        inner_table_alias, safe_entity_alias, sk_alias, safe_inner_table, inner_table_alias
-                    ), base_raw_sql, 1).replace(
-                        '{}.{}'.format(safe_outer_table, qn("id")), '{}.{}'.format(inner_table_alias, safe_entity_alias)
-                    ).replace('{}.'.format(safe_inner_table), '{}.'.format(inner_table_alias))
-
-                    # Make inner queryset
-                    inner_qs = inner_model.objects.raw(raw_sql, sql_params)
-
-                    # TODO: оптимизировать запрос за счёт получения списка id объектов
-                    # cursor = connection.cursor()
-                    # cursor.execute("{} LIMIT {}".format(raw_sql, self.SEMANTIC_FILTER_FAST_SUBQUERY_RESULTS_LIMIT),
-                    #                sql_params)
-                    # ids = [item[0] for item in cursor.fetchall()]
-                    # ids_cnt = len(ids)
-                    # if ids_cnt < self.SEMANTIC_FILTER_FAST_SUBQUERY_RESULTS_LIMIT:
-                    #     result = result.filter(id__in=ids) if ids_cnt else self.filter(id=None)
-                    # else:
-                    #     result = result.inner_join(inner_qs, pk_alias, sk_alias, join_alias)
-
-                    # Make queryset
-                    result = result.inner_join(inner_qs, pk_alias, sk_alias, join_alias)
-
-                    result.query.add_context(self._JOIN_INDEX_KEY, idx + 1)
+        if use_cached_decompress:
+            plan = self._get_cached_semantic_filter_plan(tree, field_name, self.SEMANTIC_FILTER_STRATEGY)
+        else:
+            plan = self._make_semantic_filter_plan(tree, field_name, self.SEMANTIC_FILTER_STRATEGY)
+        result = self._apply_semantic_filter_plan(plan, field_name)
 
         result.semantic_filter_meta = tree
         return result
 
+    def _semantic_predicate_filter(self, tree, field_name, strategy):
+        """
+        RUS: Фильтрует объекты по факторизованному предикату дерева терминов согласно стратегии strategy.
+        """
+        return self._apply_semantic_filter_plan(self._make_semantic_filter_plan(tree, field_name, strategy),
+                                                field_name)
+
+    def _make_semantic_filter_plan(self, tree, field_name, strategy):
+        """
+        RUS: Компилирует дерево терминов в план семантического фильтра,
+        каждой ветке дерева соответствует один подзапрос к промежуточной таблице связи с терминами.
+        """
+        predicate = make_semantic_predicate(tree, self.SEMANTIC_FILTER_MAX_PREDICATES)
+        if predicate is None:
+            return SemanticFilterPlan()
+
+        if strategy == 'auto':
+            strategy = SemanticSQLBuilder.choose_strategy(predicate, connections[self.db].vendor)
+        if strategy == 'in':
+            return SemanticFilterPlan(strategy, predicate=predicate)
+
+        base_model = next(get_polymorphic_ancestors_models(self.model))
+        through, entity_field, term_field = get_m2m_through_fields(base_model, field_name)
+        builder = SemanticSQLBuilder(connections[self.db], base_model, through, entity_field, term_field,
+                                     alias=self._SEMANTIC_FILTER_ALIAS)
+        sql, params = builder.build(predicate, strategy)
+        return SemanticFilterPlan(strategy, sql, params, predicate)
+
+    def _get_semantic_filter_plan_cache_key(self, tree, field_name, strategy):
+        """
+        RUS: Возвращает ключ кэша плана семантического фильтра.
+        """
+        return self.model.SEMANTIC_FILTER_PLAN_CACHE_KEY_PATTERN.format(
+            tree_hash=tree.get_hash(),
+            field_name=field_name,
+            vendor=connections[self.db].vendor,
+            strategy=strategy
+        )
+
+    def _get_cached_semantic_filter_plan(self, tree, field_name, strategy):
+        """
+        RUS: Возвращает план семантического фильтра из кэша, при отсутствии компилирует и кэширует его.
+        """
+        generation = self.model.get_semantic_filter_plan_generation()
+        key = generation.make_key(self._get_semantic_filter_plan_cache_key(tree, field_name, strategy))
+        plan = cache.get(key, None)
+        if plan is None:
+            BaseEntity.count_semantic_filter_plan_cache('misses')
+            plan = self._make_semantic_filter_plan(tree, field_name, strategy)
+            cache.set(key, plan, self.model.SEMANTIC_FILTER_PLAN_CACHE_TIMEOUT)
+            generation.record(key)
+        else:
+            BaseEntity.count_semantic_filter_plan_cache('hits')
+        return plan
+
+    def _apply_semantic_filter_plan(self, plan, field_name):
+        """
+        RUS: Применяет план семантического фильтра к запросу.
+        Если доступен инвертированный индекс терминов, id объектов вычисляются по нему.
+        """
+        if plan.strategy is None:
+            return self
+
+        if field_name == EntityTermsIndex.FIELD_NAME:
+            index = EntityTermsIndex.get()
+            if index is not None:
+                ids = plan.predicate.resolve(index)
+                max_ids = EntityTermsIndex.get_max_ids(connections[self.db], self.SEMANTIC_FILTER_INDEX_MAX_IDS)
+                if len(ids) <= max_ids:
+                    return self.filter(id__in=list(ids))
+
+        base_model = next(get_polymorphic_ancestors_models(self.model))
+        through, entity_field, term_field = get_m2m_through_fields(base_model, field_name)
+        if plan.strategy == 'in':
+            return self.filter(plan.predicate.as_q(through, entity_field, term_field))
+
+        idx = self.query.get_context(self._JOIN_INDEX_KEY, 1)
+        join_alias = "{}_IJ{}".format(through._meta.object_name.upper(), idx)
+        pk_alias = self.model._meta.pk.get_attname_column()[1]
+
+        # Make queryset
+        result = self.all().inner_join(through.objects.raw(plan.sql, plan.params), pk_alias,
+                                       self._SEMANTIC_FILTER_ALIAS, join_alias)
+        result.query.add_context(self._JOIN_INDEX_KEY, idx + 1)
+        return result
+
     def get_related_terms_ids(self):
         """
         # Pythonic, but working to slow, try improve speed by using INNER JOIN
@@ -280,6 +410,27 @@ class BaseEntityQuerySet(JoinQuerySetMixin, CustomCountQuerySetMixin, CustomGrou
         result.__class__ = type(str('LazyQuerySetCachedResult'), (QuerySetCachedResultMixin, result.__class__), {})
         return result
 
+    def _get_terms_counts_cache_key(self, tree, filter_queryset, filter_tree):
+        """
+        RUS: Создает ключ кэширования количеств объектов по терминам для пары выборок.
+        """
+        cache_key_attr = getattr(filter_queryset, '_cache_key_attr', DEFAULT_CACHE_KEY_ATTR)
+        filter_hash = create_hash('{}:{}'.format(getattr(filter_queryset, cache_key_attr, ''), filter_tree.get_hash()))
+        return self.model.TERMS_COUNTS_CACHE_KEY_PATTERN.format(tree_hash=tree.get_hash(), filter_hash=filter_hash)
+
+    @add_cache_key(_get_terms_counts_cache_key)
+    def get_terms_counts(self, tree, filter_queryset, filter_tree):
+        """
+        ENG: Faceted terms counts for queryset and its filtered subset.
+        RUS: Возвращает список строк (id термина, количество объектов выборки, количество объектов
+        отфильтрованной выборки), вычисляемый одним сгруппированным запросом или по инвертированному индексу.
+        """
+        # отложенное вычисление
+        result = lazy(_get_terms_counts, list)(self, tree, filter_queryset, filter_tree)
+        # примиксовываем вычислитель кэша
+        result.__class__ = type(str('LazyQuerySetCachedResult'), (QuerySetCachedResultMixin, result.__class__), {})
+        return result
+
     def get_similar(self, value, use_cached_decompress=False, fix_it=False, many=False):
         """
         ENG: Return similar entity from queryset, semantics isn't considered
@@ -664,10 +815,14 @@ class EntityCharacteristicOrMarkGetter(object):
     ENG: Represents a lazy database lookup for a set of attributes.
     RUS: Представляет ленивый поиск в базе данных для набора атрибутов.
     """
+    _attribute_ancestors_cache_fields = None
+
     def __init__(self, terms, additional_characteristics_or_marks, attribute_mode, tree_opts,
-                 attributes_ancestors_local_cache=None):
+                 attributes_ancestors_local_cache=None, ancestors_resolver=None):
         """
         RUS: Конструктор класса.
+        additional_characteristics_or_marks - запрос (QuerySet) или список уже загруженных дополнительных атрибутов,
+        ancestors_resolver - объект вычисления предков-атрибутов без обращения к кэшу (см. EntityAttributeAncestorsResolver).
         """
         self.terms = terms
         self.additional_characteristics_or_marks = additional_characteristics_or_marks
@@ -675,13 +830,18 @@ class EntityCharacteristicOrMarkGetter(object):
         self.tree_opts = tree_opts
         self._result_cache = {}
         self.attributes_ancestors_local_cache = attributes_ancestors_local_cache
+        self.ancestors_resolver = ancestors_resolver
 
     def all(self, limit=None):
         """
         RUS: Устанавливает границу размеров результата кэша.
         """
         if limit not in self._result_cache:
-            self._result_cache[limit] = result = self._get_attributes(limit)
+            if None in self._result_cache:
+                result = self._result_cache[None][:limit]
+            else:
+                result = self._get_attributes(limit)
+            self._result_cache[limit] = result
         else:
             result = self._result_cache[limit]
         return result
@@ -703,15 +863,35 @@ class EntityCharacteristicOrMarkGetter(object):
                 limit = int(k.stop)
         return self.all(limit)[k]
 
+    @classmethod
+    def from_result(cls, attrs, attribute_mode, tree_opts):
+        """
+        RUS: Возвращает объект с заранее вычисленным списком атрибутов, например материализованным.
+        """
+        getter = cls([], [], attribute_mode, tree_opts)
+        getter._result_cache[None] = attrs
+        return getter
+
+    @staticmethod
+    def get_attribute_ancestors_cache_fields():
+        """
+        RUS: Возвращает поля предков-атрибутов, хранящиеся в кэше в компактном формате вместо экземпляров терминов.
+        """
+        fields = EntityCharacteristicOrMarkGetter._attribute_ancestors_cache_fields
+        if fields is None:
+            tree_opts = TermModel._mptt_meta
+            fields = EntityCharacteristicOrMarkGetter._attribute_ancestors_cache_fields = (
+                'id', 'parent_id', 'name', 'path', 'view_class', tree_opts.tree_id_attr, tree_opts.left_attr,
+                'parent__name', 'parent__view_class')
+        return fields
+
     @staticmethod
     def on_attribute_ancestors_cache_set(key):
         """
-        RUS: Удаляет старый ключ кэша из буфера атрибутов предков.
+        RUS: Устаревший обработчик записи в кэш предков-атрибутов, записывает ключ в поколение ключей.
         """
-        buf = TermModel.get_attribute_ancestors_buffer()
-        old_key = buf.record(key)
-        if old_key != buf.empty:
-            cache.delete(old_key)
+        warn_deprecated_buffer('on_attribute_ancestors_cache_set', 'TermModel.get_attribute_ancestors_generation().record')
+        TermModel.get_attribute_ancestors_generation().record(key)
 
     @staticmethod
     def _get_attribute_ancestors(term, attribute_mode, local_cache):
@@ -720,9 +900,10 @@ class EntityCharacteristicOrMarkGetter(object):
         """
         ancestors = term.get_ancestors(ascending=True, include_self=False).attribute_filter(
             attribute_mode=attribute_mode).select_related('parent').cache(
-            on_cache_set=EntityCharacteristicOrMarkGetter.on_attribute_ancestors_cache_set,
+            generation=TermModel.get_attribute_ancestors_generation(),
             timeout=TermModel.ATTRIBUTE_ANCESTORS_CACHE_TIMEOUT,
-            local_cache=local_cache
+            local_cache=local_cache,
+            fields=EntityCharacteristicOrMarkGetter.get_attribute_ancestors_cache_fields()
         )
         return ancestors
 
@@ -734,9 +915,10 @@ class EntityCharacteristicOrMarkGetter(object):
         try:
             term = term.get_ancestors(ascending=True, include_self=False).attribute_exclude(
                 attribute_mode=attribute_mode).slice_first().cache(
-                on_cache_set=EntityCharacteristicOrMarkGetter.on_attribute_ancestors_cache_set,
+                generation=TermModel.get_attribute_ancestors_generation(),
                 timeout=TermModel.ATTRIBUTE_ANCESTORS_CACHE_TIMEOUT,
-                local_cache=local_cache
+                local_cache=local_cache,
+                fields=EntityCharacteristicOrMarkGetter.get_attribute_ancestors_cache_fields()
             )[0]
         except IndexError:
             term = None
@@ -749,14 +931,18 @@ class EntityCharacteristicOrMarkGetter(object):
         Самые старые объекты перемещаются в буфер.
         Очищает неуникальные значения атрибутов.
         """
+        resolver = self.ancestors_resolver
         attrs0 = []
         cnt = 0
         seen_attrs = {}
         for term in self.terms:
             if limit and cnt > limit:
                 break
-            ancestors = EntityCharacteristicOrMarkGetter._get_attribute_ancestors(term, self.attribute_mode,
-                                                                                  self.attributes_ancestors_local_cache)
+            if resolver is not None:
+                ancestors = resolver.get_attribute_ancestors(term, self.attribute_mode)
+            else:
+                ancestors = EntityCharacteristicOrMarkGetter._get_attribute_ancestors(
+                    term, self.attribute_mode, self.attributes_ancestors_local_cache)
             if ancestors:
                 attr0 = ancestors.pop(0)
                 prev_attr = attr0
@@ -789,8 +975,11 @@ class EntityCharacteristicOrMarkGetter(object):
                                                                   getattr(attr, self.tree_opts.left_attr)))
                     cnt += 1
                 if term.attributes & self.attribute_mode:
-                    term = EntityCharacteristicOrMarkGetter._get_no_attribute_ancestor(term, self.attribute_mode,
-                                                                                  self.attributes_ancestors_local_cache)
+                    if resolver is not None:
+                        term = resolver.get_no_attribute_ancestor(term, self.attribute_mode)
+                    else:
+                        term = EntityCharacteristicOrMarkGetter._get_no_attribute_ancestor(
+                            term, self.attribute_mode, self.attributes_ancestors_local_cache)
                 if term is not None:
                     index = seen_attrs.get(attr0.id)
                     if index is None:
@@ -811,7 +1000,10 @@ class EntityCharacteristicOrMarkGetter(object):
         attrs1 = []
         prev_id = None
         cnt = 0
-        for additional_attribute in self.additional_characteristics_or_marks.select_related('term'):
+        additional_characteristics_or_marks = self.additional_characteristics_or_marks
+        if isinstance(additional_characteristics_or_marks, models.QuerySet):
+            additional_characteristics_or_marks = additional_characteristics_or_marks.select_related('term')
+        for additional_attribute in additional_characteristics_or_marks:
             if limit and cnt > limit:
                 break
             attribute = additional_attribute.term
@@ -861,6 +1053,183 @@ class EntityCharacteristicOrMarkGetter(object):
         return attrs if limit is None else attrs[:limit]
 
 
+class EntityAttributeAncestorsResolver(object):
+    """
+    RUS: Вычисляет предков-атрибутов терминов по снимку леса терминов в памяти процесса,
+    без обращения к базе данных и кэшу. Экземпляры терминов создаются один раз на весь набор сущностей,
+    родители запоминаются в экземплярах, аналогично select_related('parent').
+    """
+
+    def __init__(self, snapshot):
+        """
+        RUS: Конструктор класса.
+        """
+        self.snapshot = snapshot
+        self._instances = {}
+
+    def __contains__(self, pk):
+        return pk in self.snapshot
+
+    def get_instance(self, pk):
+        """
+        RUS: Возвращает экземпляр термина по данным снимка.
+        """
+        instance = self._instances.get(pk, None)
+        if instance is None:
+            instance = self._instances[pk] = self.snapshot.make_instance(pk)
+            parent_id = self.snapshot.get_parent_id(pk)
+            _set_cached_parent(instance, self.get_instance(parent_id) if parent_id is not None else None)
+        return instance
+
+    def get_attribute_ancestors(self, term, attribute_mode):
+        """
+        RUS: Возвращает родительские термины содержащие заданный режим атрибута, от ближайшего к корню.
+        """
+        snapshot, mask = self.snapshot, int(attribute_mode)
+        return [self.get_instance(x) for x in snapshot.get_ancestors_ids(term.id, ascending=True)
+                if snapshot.get_value(x, 'attributes') & mask]
+
+    def get_no_attribute_ancestor(self, term, attribute_mode):
+        """
+        RUS: Возвращает ближайший родительский термин у которого отсутствует заданный режим атрибута.
+        """
+        snapshot, mask = self.snapshot, int(attribute_mode)
+        for x in snapshot.get_ancestors_ids(term.id, ascending=True):
+            if not snapshot.get_value(x, 'attributes') & mask:
+                return self.get_instance(x)
+        return None
+
+
+# ==============================================================================
+# prefetch_characteristics_and_marks
+# ==============================================================================
+def _get_prefetch_modes(characteristics, marks, use_cache=True):
+    modes = []
+    if characteristics:
+        modes.append((TermModel.attributes.is_characteristic,
+                      lambda: TermModel.get_all_active_characteristics_descendants_ids(use_cache),
+                      '_active_terms_for_characteristics', 'characteristics_getter', 0))
+    if marks:
+        modes.append((TermModel.attributes.is_mark, lambda: TermModel.get_all_active_marks_descendants_ids(use_cache),
+                      '_active_terms_for_marks', 'marks_getter', 1))
+    return modes
+
+
+def prefetch_characteristics_and_marks(entities, characteristics=True, marks=True, use_projection=True,
+                                       use_cache=True):
+    """
+    RUS: Подготавливает вычисление характеристик и меток для набора сущностей (например, страницы списка)
+    двумя запросами: связи сущностей с терминами-атрибутами и дополнительные атрибуты сущностей.
+    Предки-атрибуты терминов вычисляются по снимку леса терминов, объекты получения атрибутов
+    сохраняются в сущностях вместо ленивых свойств 'characteristics_getter' и 'marks_getter'.
+    Если снимок отключен настройками, сущности вычисляют атрибуты по отдельности, как прежде.
+    При use_projection материализованные атрибуты (EntityAttributesModel) загружаются одним запросом,
+    вычисляются только атрибуты сущностей без материализованных записей.
+    Без use_cache термины-атрибуты выбираются из базы данных, минуя глобальный кэш.
+    """
+    modes = _get_prefetch_modes(characteristics, marks, use_cache)
+    getters_names = [getter_name for mode, get_descendants_ids, terms_name, getter_name, index in modes]
+    entities = [x for x in entities if x.id is not None and any(name not in x.__dict__ for name in getters_names)]
+    if not entities:
+        return
+
+    if use_projection and is_entity_attributes_enabled():
+        # материализованные атрибуты, одним запросом
+        tree_opts = TermModel._mptt_meta
+        projections = EntityAttributesModel.get_attributes(set(x.id for x in entities))
+        rest = []
+        for entity in entities:
+            projection = entity.__dict__['attributes_projection'] = projections.get(entity.id, None)
+            if projection is None:
+                rest.append(entity)
+                continue
+            for mode, get_descendants_ids, terms_name, getter_name, index in modes:
+                if getter_name not in entity.__dict__:
+                    entity.__dict__[getter_name] = EntityCharacteristicOrMarkGetter.from_result(
+                        projection[index], mode, tree_opts)
+        entities = rest
+
+    _prefetch_attributes_getters([(x, [x.id]) for x in entities], modes)
+
+
+def prefetch_groups_characteristics_and_marks(groups, characteristics=True, marks=True):
+    """
+    RUS: Подготавливает вычисление характеристик и меток для набора групп сущностей (запросов, например alike)
+    аналогично prefetch_characteristics_and_marks, атрибуты группы объединяют атрибуты всех ее сущностей.
+    """
+    modes = _get_prefetch_modes(characteristics, marks)
+    getters_names = [getter_name for mode, get_descendants_ids, terms_name, getter_name, index in modes]
+    groups = [x for x in groups if any(name not in x.__dict__ for name in getters_names)]
+    _prefetch_attributes_getters([(x, x.ids) for x in groups], modes)
+
+
+def _prefetch_attributes_getters(objects, modes):
+    """
+    RUS: Вычисляет объекты получения атрибутов для списка пар (объект, id сущностей объекта).
+    """
+    objects = [(obj, entities_ids) for obj, entities_ids in objects if entities_ids]
+    if not objects:
+        return
+    snapshot = get_forest_snapshot(TermModel)
+    if snapshot is None:
+        return
+
+    entities_ids = set()
+    for obj, ids in objects:
+        entities_ids.update(ids)
+    modes = [(mode, set(get_descendants_ids()), terms_name, getter_name)
+             for mode, get_descendants_ids, terms_name, getter_name, index in modes]
+    descendants_ids = set()
+    for mode, mode_ids, terms_name, getter_name in modes:
+        descendants_ids.update(mode_ids)
+
+    # связи сущностей с терминами-атрибутами, одним запросом
+    terms_ids = {}
+    if descendants_ids:
+        through, entity_field, term_field = get_m2m_through_fields(EntityModel, 'terms')
+        for entity_id, term_id in through.objects.filter(**{
+            '{}__in'.format(entity_field): entities_ids,
+            '{}__in'.format(term_field): descendants_ids
+        }).values_list(entity_field, term_field):
+            terms_ids.setdefault(entity_id, []).append(term_id)
+
+    # дополнительные атрибуты сущностей, одним запросом
+    tree_opts = TermModel._mptt_meta
+    additional = {}
+    for obj in AdditionalEntityCharacteristicOrMarkModel.objects.filter(
+            reduce(OR, [Q(term__attributes=mode) for mode, mode_ids, terms_name, getter_name in modes]),
+            entity_id__in=entities_ids).select_related('term').order_by(
+            'term__{}'.format(tree_opts.tree_id_attr), 'term__{}'.format(tree_opts.left_attr)):
+        additional.setdefault(obj.entity_id, []).append(obj)
+
+    resolver = EntityAttributeAncestorsResolver(snapshot)
+    for obj, ids in objects:
+        obj_terms_ids = set()
+        for x in ids:
+            obj_terms_ids.update(terms_ids.get(x, ()))
+        if not all(x in resolver for x in obj_terms_ids):
+            # снимок не содержит новых терминов, атрибуты объекта вычисляются по отдельности
+            continue
+        if len(ids) == 1:
+            obj_additional = additional.get(ids[0], [])
+        else:
+            obj_additional = sorted([y for x in ids for y in additional.get(x, ())], key=lambda x: (
+                getattr(x.term, tree_opts.tree_id_attr), getattr(x.term, tree_opts.left_attr)))
+        for mode, mode_ids, terms_name, getter_name in modes:
+            if getter_name in obj.__dict__:
+                continue
+            mask = int(mode)
+            terms = [resolver.get_instance(x) for x in snapshot.sort_ids([x for x in obj_terms_ids if x in mode_ids])]
+            obj.__dict__[terms_name] = terms
+            obj.__dict__[getter_name] = EntityCharacteristicOrMarkGetter(
+                terms,
+                [x for x in obj_additional if int(x.term.attributes) & mask],
+                mode,
+                tree_opts,
+                ancestors_resolver=resolver
+            )
+
+
 # ==============================================================================
 # BaseEntity terms ManyRelatedManager patched methods
 # ==============================================================================
@@ -912,9 +1281,30 @@ class BaseEntity(six.with_metaclass(PolymorphicEntityMetaclass, PolymorphicModel
     VALIDATE_DATA_MART_MODEL_CACHE_TIMEOUT = edw_settings.CACHE_DURATIONS['entity_validate_data_mart_model']
 
     TERMS_BUFFER_CACHE_KEY = 'e_t_bf'
+    # поколение ключей кэша id терминов, проверяемых по журналу инвалидации
+    TERMS_JOURNALED_BUFFER_CACHE_KEY = 'e_t_jbf'
     TERMS_BUFFER_CACHE_SIZE = edw_settings.CACHE_BUFFERS_SIZES['entity_terms_ids']
     TERMS_IDS_CACHE_KEY_PATTERN = 'e_t_ids:{tree_hash}'
     TERMS_IDS_CACHE_TIMEOUT = edw_settings.CACHE_DURATIONS['entity_terms_ids']
+    TERMS_COUNTS_CACHE_KEY_PATTERN = 'e_t_cnt:{tree_hash}:{filter_hash}'
+    # журнал инвалидации кэша id терминов, теги - id терминов и витрин данных
+    TERMS_CACHE_JOURNAL_KEY = 'e_t_jrnl'
+    TERMS_CACHE_JOURNAL_MAX_LAG = edw_settings.CACHE_BUFFERS_SIZES['entity_terms_ids_journal']
+    TERMS_CACHE_DATA_MART_TAG_PATTERN = 'dm:{id}'
+
+    SEMANTIC_FILTER_PLAN_BUFFER_CACHE_KEY = 'e_sfp_bf'
+    SEMANTIC_FILTER_PLAN_BUFFER_CACHE_SIZE = edw_settings.CACHE_BUFFERS_SIZES['entity_semantic_filter_plan']
+    SEMANTIC_FILTER_PLAN_CACHE_KEY_PATTERN = 'e_sfp:{tree_hash}:{field_name}:{vendor}:{strategy}'
+    SEMANTIC_FILTER_PLAN_CACHE_TIMEOUT = edw_settings.CACHE_DURATIONS['entity_semantic_filter_plan']
+    # счетчики попаданий и промахов кэша планов семантического фильтра в текущем процессе,
+    # изменяются только под блокировкой (см. count_semantic_filter_plan_cache)
+    SEMANTIC_FILTER_PLAN_CACHE_STATS = {'hits': 0, 'misses': 0}
+    _semantic_filter_plan_cache_stats_lock = threading.Lock()
+
+    COUNT_BUFFER_CACHE_KEY = 'e_cnt_bf'
+    COUNT_BUFFER_CACHE_SIZE = edw_settings.CACHE_BUFFERS_SIZES['entity_count']
+    COUNT_CACHE_KEY_PATTERN = 'e_cnt:{query_hash}'
+    COUNT_CACHE_TIMEOUT = edw_settings.CACHE_DURATIONS['entity_count']
 
     DATA_MART_BUFFER_CACHE_KEY = 'e_dm_bf'
     DATA_MART_BUFFER_CACHE_SIZE = edw_settings.CACHE_BUFFERS_SIZES['entity_data_mart']
@@ -1211,12 +1601,26 @@ class BaseEntity(six.with_metaclass(PolymorphicEntityMetaclass, PolymorphicModel
         descendants_ids = TermModel.get_all_active_marks_descendants_ids()
         return list(self.terms.filter(id__in=descendants_ids).order_by(tree_opts.tree_id_attr, tree_opts.left_attr))
 
+    @cached_property
+    def attributes_projection(self):
+        """
+        RUS: Возвращает материализованные характеристики и метки текущей сущности (характеристики, метки),
+        либо None, если материализация отключена или атрибуты еще не пересчитаны.
+        """
+        if self.id is None or not is_entity_attributes_enabled():
+            return None
+        return EntityAttributesModel.get_attributes([self.id]).get(self.id, None)
+
     @cached_property
     def characteristics_getter(self):
         """
         RUS: Получает характеристики объекта текущей сущности.
         """
         tree_opts = TermModel._mptt_meta
+        projection = self.attributes_projection
+        if projection is not None:
+            return EntityCharacteristicOrMarkGetter.from_result(
+                projection[0], TermModel.attributes.is_characteristic, tree_opts)
         return EntityCharacteristicOrMarkGetter(
             self._active_terms_for_characteristics,
             self.additional_characteristics,
@@ -1246,6 +1650,9 @@ class BaseEntity(six.with_metaclass(PolymorphicEntityMetaclass, PolymorphicModel
         RUS: Получает все метки объектов текущей сущности.
         """
         tree_opts = TermModel._mptt_meta
+        projection = self.attributes_projection
+        if projection is not None:
+            return EntityCharacteristicOrMarkGetter.from_result(projection[1], TermModel.attributes.is_mark, tree_opts)
         return EntityCharacteristicOrMarkGetter(
             self._active_terms_for_marks,
             self.additional_marks,
@@ -1308,31 +1715,36 @@ class BaseEntity(six.with_metaclass(PolymorphicEntityMetaclass, PolymorphicModel
             result = None
         return result
 
+    @staticmethod
+    def get_data_mart_cache_generation():
+        """
+        RUS: Возвращает поколение ключей кэша витрин данных объектов.
+        """
+        return CacheGeneration.factory(BaseEntity.DATA_MART_BUFFER_CACHE_KEY,
+                                       max_size=BaseEntity.DATA_MART_BUFFER_CACHE_SIZE)
+
     @staticmethod
     def get_data_mart_cache_buffer():
         """
-        RUS: Помещает ключ кэша витрины данных в кольцевой буфер.
+        RUS: Устаревший синоним `get_data_mart_cache_generation`, возвращает поколение, совместимое с кольцевым буфером.
         """
-        return RingBuffer.factory(BaseEntity.DATA_MART_BUFFER_CACHE_KEY,
-                                  max_size=BaseEntity.DATA_MART_BUFFER_CACHE_SIZE)
+        warn_deprecated_buffer('get_data_mart_cache_buffer', 'get_data_mart_cache_generation')
+        return BaseEntity.get_data_mart_cache_generation()
 
     @staticmethod
     def clear_data_mart_cache_buffer():
         """
-        RUS: Очищает ключ кэша витрины данных из буфера.
+        RUS: Очищает кэш витрин данных объектов сменой поколения ключей.
         """
-        buf = BaseEntity.get_data_mart_cache_buffer()
-        keys = buf.get_all()
-        buf.clear()
-        cache.delete_many(keys)
+        BaseEntity.get_data_mart_cache_generation().incr()
 
     def get_data_mart_cache_key(self):
         """
-        RUS: Возвращает шаблон ключа кэша витрины данных.
+        RUS: Возвращает ключ кэша витрины данных текущего поколения.
         """
-        return self.DATA_MART_CACHE_KEY_PATTERN.format(
+        return self.get_data_mart_cache_generation().make_key(self.DATA_MART_CACHE_KEY_PATTERN.format(
             id=self.id
-        )
+        ))
 
     def get_cached_data_mart(self):
         """
@@ -1343,10 +1755,7 @@ class BaseEntity(six.with_metaclass(PolymorphicEntityMetaclass, PolymorphicModel
         if data_mart == empty:
             data_mart = self.get_data_mart()
             cache.set(key, data_mart, self.DATA_MART_CACHE_TIMEOUT)
-            buf = self.get_data_mart_cache_buffer()
-            old_key = buf.record(key)
-            if old_key != buf.empty:
-                cache.delete(old_key)
+            self.get_data_mart_cache_generation().record(key)
         return data_mart
 
     @cached_property
@@ -1356,23 +1765,131 @@ class BaseEntity(six.with_metaclass(PolymorphicEntityMetaclass, PolymorphicModel
         """
         return self.get_cached_data_mart()
 
+    @staticmethod
+    def get_count_generation():
+        """
+        RUS: Возвращает поколение ключей кэша количества объектов запросов.
+        """
+        return CacheGeneration.factory(BaseEntity.COUNT_BUFFER_CACHE_KEY, max_size=BaseEntity.COUNT_BUFFER_CACHE_SIZE)
+
+    @staticmethod
+    def clear_count_cache_buffer():
+        """
+        RUS: Очищает кэш количества объектов запросов сменой поколения ключей.
+        """
+        BaseEntity.get_count_generation().incr()
+
+    @staticmethod
+    def get_terms_cache_generation():
+        """
+        RUS: Возвращает поколение ключей кэша id терминов. Поколение меняется при любом изменении объектов.
+        """
+        return CacheGeneration.factory(BaseEntity.TERMS_BUFFER_CACHE_KEY,
+                                       max_size=BaseEntity.TERMS_BUFFER_CACHE_SIZE)
+
     @staticmethod
     def get_terms_cache_buffer():
         """
-        RUS: Помещает ключ кэша терминов базовой сущности в кольцевой буфер.
+        RUS: Устаревший синоним `get_terms_cache_generation`, возвращает поколение, совместимое с кольцевым буфером.
+        """
+        warn_deprecated_buffer('get_terms_cache_buffer', 'get_terms_cache_generation')
+        return BaseEntity.get_terms_cache_generation()
+
+    @staticmethod
+    def get_terms_cache_journaled_generation():
+        """
+        RUS: Возвращает поколение ключей кэша id терминов, проверяемых по журналу инвалидации.
+        Поколение меняется только при изменении дерева терминов, изменения объектов записываются в журнал.
         """
-        return RingBuffer.factory(BaseEntity.TERMS_BUFFER_CACHE_KEY,
-                                  max_size=BaseEntity.TERMS_BUFFER_CACHE_SIZE)
+        return CacheGeneration.factory(BaseEntity.TERMS_JOURNALED_BUFFER_CACHE_KEY,
+                                       max_size=BaseEntity.TERMS_BUFFER_CACHE_SIZE)
 
     @staticmethod
     def clear_terms_cache_buffer():
         """
-        RUS: Очищает ключ кэша терминов из буфера.
+        RUS: Очищает весь кэш id терминов, в том числе проверяемый по журналу, сменой поколений ключей.
         """
-        buf = BaseEntity.get_terms_cache_buffer()
-        keys = buf.get_all()
-        buf.clear()
-        cache.delete_many(keys)
+        BaseEntity.get_terms_cache_generation().incr()
+        BaseEntity.get_terms_cache_journaled_generation().incr()
+
+    @staticmethod
+    def get_terms_cache_journal():
+        """
+        RUS: Возвращает журнал инвалидации кэша id терминов.
+        """
+        return InvalidationJournal.factory(BaseEntity.TERMS_CACHE_JOURNAL_KEY,
+                                           timeout=BaseEntity.TERMS_IDS_CACHE_TIMEOUT,
+                                           max_lag=BaseEntity.TERMS_CACHE_JOURNAL_MAX_LAG)
+
+    @staticmethod
+    def get_terms_cache_dependencies(trees, data_mart=None):
+        """
+        RUS: Возвращает теги, от которых зависит кэшированный результат вычисления id терминов по деревьям:
+        id всех терминов расширенных деревьев и id витрины данных.
+        """
+        result = set()
+        for tree in trees:
+            result.update(tree.expand(copy_on_write=True).keys())
+        if data_mart is not None:
+            result.add(BaseEntity.TERMS_CACHE_DATA_MART_TAG_PATTERN.format(id=data_mart.id))
+        return result
+
+    @staticmethod
+    def record_terms_cache_changes(terms_ids=(), data_marts_ids=()):
+        """
+        RUS: Записывает в журнал инвалидации кэша id терминов изменение связей объектов с терминами
+        или витрин данных. Сбрасываются только результаты, зависящие от перечисленных терминов и витрин.
+        """
+        tags = list(terms_ids)
+        tags.extend([BaseEntity.TERMS_CACHE_DATA_MART_TAG_PATTERN.format(id=pk) for pk in data_marts_ids])
+        BaseEntity.get_terms_cache_journal().record(tags)
+
+    @staticmethod
+    def get_semantic_filter_plan_generation():
+        """
+        RUS: Возвращает поколение ключей кэша планов семантического фильтра.
+        """
+        return CacheGeneration.factory(BaseEntity.SEMANTIC_FILTER_PLAN_BUFFER_CACHE_KEY,
+                                       max_size=BaseEntity.SEMANTIC_FILTER_PLAN_BUFFER_CACHE_SIZE)
+
+    @staticmethod
+    def get_semantic_filter_plan_buffer():
+        """
+        RUS: Устаревший синоним `get_semantic_filter_plan_generation`, возвращает поколение, совместимое с кольцевым буфером.
+        """
+        warn_deprecated_buffer('get_semantic_filter_plan_buffer', 'get_semantic_filter_plan_generation')
+        return BaseEntity.get_semantic_filter_plan_generation()
+
+    @staticmethod
+    def clear_semantic_filter_plan_buffer():
+        """
+        RUS: Очищает кэш планов семантического фильтра сменой поколения ключей.
+        """
+        BaseEntity.get_semantic_filter_plan_generation().incr()
+
+    @staticmethod
+    def count_semantic_filter_plan_cache(name):
+        """
+        RUS: Увеличивает счетчик 'hits' или 'misses' кэша планов семантического фильтра,
+        счетчики изменяются из потоков обработки запросов, поэтому под блокировкой.
+        """
+        with BaseEntity._semantic_filter_plan_cache_stats_lock:
+            BaseEntity.SEMANTIC_FILTER_PLAN_CACHE_STATS[name] += 1
+
+    @staticmethod
+    def get_semantic_filter_plan_cache_stats():
+        """
+        RUS: Возвращает счетчики попаданий и промахов кэша планов семантического фильтра в текущем процессе.
+        """
+        with BaseEntity._semantic_filter_plan_cache_stats_lock:
+            stats = dict(BaseEntity.SEMANTIC_FILTER_PLAN_CACHE_STATS)
+        total = stats['hits'] + stats['misses']
+        return dict(stats, hit_ratio=stats['hits'] / total if total else 0)
+
+    @staticmethod
+    def reset_semantic_filter_plan_cache_stats():
+        with BaseEntity._semantic_filter_plan_cache_stats_lock:
+            BaseEntity.SEMANTIC_FILTER_PLAN_CACHE_STATS.update(hits=0, misses=0)
 
     @classmethod
     def get_related_data_marts_ids_from_attributes(cls, *attrs):
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import json
+
+from django.db import connections
 from django.db.models import Count
 from django.db.models.fields.related import ForeignObject
 from django.db.models.options import Options
@@ -8,6 +11,7 @@ from django.db.models.sql.where import ExtraWhere
 from django.db.models import DO_NOTHING
 from django.db.models.sql.query import RawQuery
 from django.core.exceptions import EmptyResultSet
+from django.utils import six
 
 from edw.models.sql.datastructures import CustomJoin
 
@@ -55,15 +59,44 @@ class CustomCountQuerySetMixin(object):
         if self._result_cache is not None:
             return len(self._result_cache)
 
+        result = self.values(*self._get_count_values()).aggregate(__count=Count('id'))['__count']
+        return 0 if result is None else result
+
+    def _get_count_values(self):
         if self.query.group_by is None:
             values = ['id']
         else:
             values = list(self.query.group_by)
             if 'id' not in set(values):
                 values.insert(0, 'id')
+        return values
 
-        result = self.values(*values).aggregate(__count=Count('id'))['__count']
-        return 0 if result is None else result
+    def bounded_count(self, bound):
+        """
+        Returns the number of records, but not more than `bound`, only first `bound` rows are fetched.
+        """
+        if self._result_cache is not None:
+            return min(len(self._result_cache), bound)
+        return len(self.order_by().values_list(*self._get_count_values())[:bound])
+
+    def estimated_count(self):
+        """
+        Returns the number of records estimated by the database planner or None,
+        if the database does not provide estimates (supported for PostgreSQL).
+        """
+        connection = connections[self.db]
+        if connection.vendor != 'postgresql':
+            return None
+        try:
+            sql, params = self.order_by().values(*self._get_count_values()).query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, six.string_types):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
 
 
 #==============================================================================
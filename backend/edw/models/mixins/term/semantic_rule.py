@@ -3,6 +3,8 @@ from __future__ import unicode_literals
 
 from django.db import models
 
+from ...sql.semantic import TermsPredicate, AndPredicate, OrPredicate
+
 
 # ==============================================================================
 # SemanticRuleFilterMixin
@@ -23,14 +25,38 @@ class SemanticRuleFilterMixin(object):
             )
         )
 
-    def make_leaf_filters(self, field_name):
+    def make_predicate(self, *args, **kwargs):
+        '''
+        :return: semantic predicate
+        RUS: Возбуждает исключение, метод make_predicate должен быть переопределен в дочерних классах.
+        '''
+        raise NotImplementedError(
+            '{cls}.make_predicate must be implemented.'.format(
+                cls=self.__class__.__name__
+            )
+        )
+
+    def get_leaf_ids(self):
+        '''
+        RUS: Возвращает список id активных терминов поддерева, включая сам термин.
+        '''
         if self.active and self.pk is not None:
-            ids = [self.pk] if self.is_leaf_node() else list(
+            return [self.pk] if self.is_leaf_node() else list(
                 self.get_descendants(include_self=True).active().values_list('id', flat=True))
+        else:
+            return []
+
+    def make_leaf_filters(self, field_name):
+        ids = self.get_leaf_ids()
+        if ids:
             return [models.Q(**{field_name + '__in': ids})] if len(ids) > 1 else [models.Q(**{field_name: ids[0]})]
         else:
             return []
 
+    def make_leaf_predicate(self):
+        ids = self.get_leaf_ids()
+        return TermsPredicate(ids) if ids else None
+
 
 # ==============================================================================
 # OrRuleFilterMixin
@@ -55,6 +81,18 @@ class OrRuleFilterMixin(SemanticRuleFilterMixin):
                 result = [models.Q(**{field_name: self.pk}) | x for x in result]
         return result
 
+    def make_predicate(self, *args, **kwargs):
+        '''
+        RUS: Строит предикат "ИЛИ" без раскрытия декартова произведения фильтров дочерних терминов.
+        '''
+        term_info = kwargs.pop('term_info')
+        predicates = list(filter(None, (x.term.make_predicate(term_info=x, *args, **kwargs) for x in term_info)))
+        if term_info.is_leaf or not predicates:
+            return self.make_leaf_predicate()
+        if self.pk is not None:
+            predicates.insert(0, TermsPredicate([self.pk]))
+        return OrPredicate.make(predicates)
+
 
 # ==============================================================================
 # AndRuleFilterMixin
@@ -74,3 +112,14 @@ class AndRuleFilterMixin(SemanticRuleFilterMixin):
                 for y in x:
                     result.append(y)
         return result
+
+    def make_predicate(self, *args, **kwargs):
+        '''
+        RUS: Строит предикат "И" по нелистовым дочерним терминам.
+        '''
+        term_info = kwargs.pop('term_info')
+        predicates = list(filter(None, (
+            x.term.make_predicate(term_info=x, *args, **kwargs) for x in term_info if not x.is_leaf)))
+        if term_info.is_leaf or not predicates:
+            return self.make_leaf_predicate()
+        return AndPredicate.make(predicates)
@@ -6,46 +6,107 @@ from functools import reduce
 
 from django.db.models import Q
 from django.db.models.query import EmptyQuerySet
+from django.db.models.sql.where import AND
 from mptt.models import MPTTModel
 
+from .mptt_snapshot import MPTTForestSnapshot
+from .sql.where import RangesWhere
+from .. import settings as edw_settings
 from ..utils.hash_helpers import hash_unsorted_list
 from ..utils.set_helpers import uniq
 
 
 # ==============================================================================
-# get_queryset_descendants
+# get_forest_snapshot
 # ==============================================================================
-def get_queryset_descendants(nodes, include_self=False, add_to_result=None):
+def get_forest_snapshot(model_class):
     """
-    RUS: Запрос к базе данных потомков. Если нет узлов,
-    то возвращается пустой запрос.
-    :param nodes: список узлов дерева, по которым необходимо отыскать потомков
-    :param include_self: признак включения в результ исходного спичка узлов
+    RUS: Возвращает снимок леса модели, если использование снимка разрешено настройками, иначе None.
+    """
+    return MPTTForestSnapshot.get(model_class) if edw_settings.TERM_SNAPSHOT['enabled'] else None
+
+
+def _set_cached_parent(node, parent):
+    """
+    RUS: Запоминает родителя узла, аналогично select_related('parent').
+    """
+    field = node._meta.get_field('parent')
+    if hasattr(field, 'set_cached_value'):
+        field.set_cached_value(node, parent)
+    else:
+        setattr(node, field.get_cache_name(), parent)
+
+
+# ==============================================================================
+# get_descendants_ranges
+# ==============================================================================
+def merge_ranges(ranges):
+    """
+    RUS: Объединяет интервалы (tree_id, lo, hi) значений lft в минимальный набор непересекающихся интервалов.
+    Вложенные и пересекающиеся интервалы поглощаются, смежные - объединяются.
+    """
+    result = []
+    for tree_id, lo, hi in sorted(ranges):
+        if result:
+            last_tree_id, last_lo, last_hi = result[-1]
+            if last_tree_id == tree_id and lo <= last_hi + 1:
+                if hi > last_hi:
+                    result[-1] = (tree_id, last_lo, hi)
+                continue
+        result.append((tree_id, lo, hi))
+    return result
+
+
+def get_descendants_ranges(nodes, include_self=False):
+    """
+    RUS: Приводит узлы к минимальному набору непересекающихся интервалов (tree_id, lo, hi) значений lft потомков.
+    Значения rght не совпадают с lft других узлов дерева, поэтому интервал [lft, rght] узла
+    и [lft + 1, rght - 1] его потомков можно расширять до границ соседей.
+    """
+    ranges = []
+    for n in nodes:
+        opts = n._mptt_meta
+        tree_id, lft, rght = getattr(n, opts.tree_id_attr), getattr(n, opts.left_attr), getattr(n, opts.right_attr)
+        if include_self:
+            ranges.append((tree_id, lft, rght))
+        elif rght - lft > 1:
+            ranges.append((tree_id, lft + 1, rght - 1))
+    return merge_ranges(ranges)
+
+
+def _filter_by_ranges_join(model_class, ranges, add_to_result=None):
+    """
+    RUS: Запрос узлов, значения lft которых попадают в интервалы, через соединение со списком VALUES.
+    """
+    opts, mptt_opts = model_class._meta, model_class._mptt_meta
+    queryset = model_class.objects.all()
+    alias = queryset.query.get_initial_alias()
+    queryset.query.where.add(RangesWhere(
+        alias, opts.get_field(mptt_opts.tree_id_attr).column, opts.get_field(mptt_opts.left_attr).column, ranges,
+        opts.pk.column, add_to_result), AND)
+    return queryset
+
+
+def get_queryset_by_ranges(model_class, ranges, add_to_result=None):
+    """
+    RUS: Запрос к базе данных узлов, значения lft которых попадают в интервалы (tree_id, lo, hi).
+    При большом количестве интервалов запрос строится соединением со списком VALUES вместо цепочки OR.
     :param add_to_result: список ключей узлов которые необходимо дополнительно включить в результат
     :return: список узлов (QuerySet), отсортированный в порядке обхода дерева
     """
-    if not nodes:
-        # HACK: Emulate MPTTModel.objects.none(), because MPTTModel is abstract
-        return EmptyQuerySet(MPTTModel)
-    filters = []
-    model_class = nodes[0].__class__
-
-    if include_self:
-        for n in nodes:
-            if n.get_descendant_count():
-                lft, rght = n.lft - 1, n.rght + 1
-                filters.append(Q(tree_id=n.tree_id, lft__gt=lft, rght__lt=rght))
-            else:
-                filters.append(Q(pk=n.pk))
-    else:
-        for n in nodes:
-            if n.get_descendant_count():
-                lft, rght = n.lft, n.rght
-                filters.append(Q(tree_id=n.tree_id, lft__gt=lft, rght__lt=rght))
+    threshold = edw_settings.MPTT_DESCENDANTS['ranges_join_threshold']
+    if ranges and threshold and len(ranges) > threshold:
+        return _filter_by_ranges_join(model_class, ranges, add_to_result)
+
+    opts = model_class._mptt_meta
+    filters = [Q(**{
+        opts.tree_id_attr: tree_id,
+        '{}__range'.format(opts.left_attr): (lo, hi)
+    }) for tree_id, lo, hi in ranges]
 
     if add_to_result:
         if len(add_to_result) > 1:
-            filters.append(Q(id__in=add_to_result))
+            filters.append(Q(pk__in=add_to_result))
         else:
             filters.append(Q(pk=add_to_result[0]))
 
@@ -53,7 +114,26 @@ def get_queryset_descendants(nodes, include_self=False, add_to_result=None):
         return model_class.objects.filter(reduce(operator.or_, filters))
     else:
         # HACK: Emulate model_class.objects.none()
-        return model_class.objects.filter(id__isnull=True)
+        return model_class.objects.filter(pk__isnull=True)
+
+
+# ==============================================================================
+# get_queryset_descendants
+# ==============================================================================
+def get_queryset_descendants(nodes, include_self=False, add_to_result=None):
+    """
+    RUS: Запрос к базе данных потомков. Если нет узлов,
+    то возвращается пустой запрос.
+    Узлы приводятся к минимальному набору интервалов (см. get_descendants_ranges).
+    :param nodes: список узлов дерева, по которым необходимо отыскать потомков
+    :param include_self: признак включения в результ исходного спичка узлов
+    :param add_to_result: список ключей узлов которые необходимо дополнительно включить в результат
+    :return: список узлов (QuerySet), отсортированный в порядке обхода дерева
+    """
+    if not nodes:
+        # HACK: Emulate MPTTModel.objects.none()
+        return EmptyQuerySet(MPTTModel)
+    return get_queryset_by_ranges(nodes[0].__class__, get_descendants_ranges(nodes, include_self), add_to_result)
 
 
 # ==============================================================================
@@ -64,10 +144,18 @@ class TermTreeInfo(dict):
     Helper class TermTreeInfo
     RUS: Вспомогательный класс
     """
+    __slots__ = ('root', )
+
     def __init__(self, root=None, *args, **kwargs):
         self.root = root
         super(TermTreeInfo, self).__init__(*args, **kwargs)
 
+    def __getstate__(self):
+        return {'root': self.root}
+
+    def __setstate__(self, state):
+        self.root = state['root']
+
     def get_hash(self):
         """
         RUS: Получает список захэшированных неупорядоченных ключей,
@@ -78,31 +166,88 @@ class TermTreeInfo(dict):
 
     def trim(self, ids=None):
         """
-        RUS: Создает копию дерева. Расширяет его. Возвращает дерево, у которого удалены id лишних узлов.
+        RUS: Расширяет дерево без полного копирования (copy-on-write).
+        Возвращает дерево, у которого удалены id лишних узлов.
         """
-        tree = self.deepcopy()
-        tree._expand()
-        return tree.soft_trim(ids)
+        return self.expand(copy_on_write=True).soft_trim(ids)
 
-    def expand(self):
+    def expand(self, copy_on_write=False):
         """
-        RUS: Добавляет в дерево ребенка к предкам.
+        RUS: Возвращает копию дерева, в которой к листьям добавлены их активные потомки.
+        При copy_on_write=True копируются только изменяемые узлы и пути от них до корня,
+        остальные узлы разделяются с исходным деревом, поэтому результат можно только читать.
         """
-        tree = self.deepcopy()
-        tree._expand()
+        if copy_on_write:
+            tree = TermTreeInfo(self.root, self)
+            tree._expand(writable=set())
+        else:
+            tree = self.deepcopy()
+            tree._expand()
         return tree
 
-    def _expand(self):
+    def _expand(self, writable=None):
         """
         RUS: Приватный метод, добавляет в дерево ребенка к предкам.
+        :param writable: множество id узлов, принадлежащих только этому дереву. Если задано,
+        разделяемые с исходным деревом узлы перед изменением копируются
         """
         terms = [x.term for x in self.values() if x.is_leaf and not x.term.is_leaf_node()]
-        if terms:
-            for term in get_queryset_descendants(terms, include_self=False).filter(active=True):
-                ancestor = self.get(term.parent_id)
-                child = self[term.id] = TermInfo(term=term, is_leaf=True)
-                ancestor.is_leaf = False
-                ancestor.append(child)
+        if not terms:
+            return
+        snapshot = get_forest_snapshot(self.root.term.__class__)
+        if snapshot is not None:
+            ids = []
+            for term in terms:
+                ids.extend(snapshot.get_descendants_ids(term.id, active_only=True))
+            terms = (snapshot.make_instance(pk) for pk in snapshot.sort_ids(ids))
+        else:
+            terms = get_queryset_descendants(terms, include_self=False).filter(active=True)
+        for term in terms:
+            ancestor = self.get(term.parent_id)
+            if ancestor is None:
+                # родитель неактивен
+                continue
+            if writable is not None:
+                ancestor = self._get_writable_node(ancestor, writable)
+            if snapshot is not None:
+                _set_cached_parent(term, ancestor.term)
+            child = self[term.id] = TermInfo(term=term, is_leaf=True)
+            if writable is not None:
+                writable.add(term.id)
+            ancestor.is_leaf = False
+            ancestor.append(child)
+
+    def _get_writable_node(self, node, writable):
+        """
+        RUS: Возвращает узел, принадлежащий только этому дереву. Разделяемый узел копируется
+        вместе с путем от него до корня (copy-on-write), корень отмечается в writable ключом None.
+        """
+        pk = node.term.id
+        if pk in writable:
+            return node
+        result = copy = self[pk] = node.clone()
+        writable.add(pk)
+        while True:
+            parent_id = node.term.parent_id
+            if parent_id not in self:
+                parent_id = None
+            src_parent = self.root if parent_id is None else self[parent_id]
+            if parent_id in writable:
+                parent = src_parent
+            else:
+                parent = src_parent.clone()
+                writable.add(parent_id)
+                if parent_id is None:
+                    self.root = parent
+                else:
+                    self[parent_id] = parent
+            for i, child in enumerate(parent):
+                if child is node:
+                    parent[i] = copy
+                    break
+            if parent is src_parent or parent_id is None:
+                return result
+            node, copy = src_parent, parent
 
     def soft_trim(self, ids=None):
         """
@@ -121,9 +266,9 @@ class TermTreeInfo(dict):
                 if pk not in tree:
                     node = tree[pk] = TermInfo(term=src_node.term, is_leaf=True)
                     src_ancestor = self.get(node.term.parent_id)
-                    while src_ancestor:
+                    while src_ancestor is not None:
                         ancestor = tree.get(src_ancestor.term.id)
-                        if not ancestor:
+                        if ancestor is None:
                             node = tree[src_ancestor.term.id] = TermInfo(term=src_ancestor.term, is_leaf=False,
                                                                          children=[node])
                             if node.term.parent_id is None:
@@ -141,17 +286,25 @@ class TermTreeInfo(dict):
             if len(src_ancestor):
                 ancestor.is_leaf = False
                 for src_node in src_ancestor:
-                    ancestor.append(tree._copy_recursively(src_node))
+                    ancestor.append(tree._copy_subtree(src_node))
         return tree
 
-    def _copy_recursively(self, src_node):
+    def _copy_subtree(self, src_node):
         """
-        RUS:  Вспомогательная функция, рекурсивно создает копию узла и его элементов.
+        RUS: Вспомогательная функция, создает копию узла и его потомков.
+        Обход выполняется по стеку, без рекурсии, поэтому глубина дерева не ограничена.
         """
-        node = self[src_node.term.id] = TermInfo(term=src_node.term, is_leaf=src_node.is_leaf)
-        for src_child in src_node:
-            node.append(self._copy_recursively(src_child))
-        return node
+        result = None
+        stack = [(None, src_node)]
+        while stack:
+            parent, src_node = stack.pop()
+            node = self[src_node.term.id] = TermInfo(term=src_node.term, is_leaf=src_node.is_leaf)
+            if parent is None:
+                result = node
+            else:
+                parent.append(node)
+            stack.extend((node, x) for x in reversed(src_node))
+        return result
 
     def deepcopy(self):
         """
@@ -162,30 +315,41 @@ class TermTreeInfo(dict):
                                                         active=origin_root_term.active))
         tree = TermTreeInfo(root)
         for src_node in self.root:
-            root.append(tree._copy_recursively(src_node))
+            root.append(tree._copy_subtree(src_node))
         return tree
 
-    def _invert_recursively(self, node, do_invert_test_fn):
+    def _invert_nodes(self, do_invert_test_fn, snapshot=None):
         """
-        RUS:  Вспомогательная функция, рекурсивно формирует список (QuerySet) терминов инвенсии
+        RUS: Вспомогательная функция, формирует список интервалов (tree_id, lo, hi) значений lft терминов инверсии,
+        при наличии снимка леса - список id терминов инверсии. Обход нелистовых узлов выполняется по стеку.
+        Интервалы вычисляются по границам MPTT узлов дерева без обращения к базе данных:
+        из интервала потомков узла исключаются интервалы его детей, входящих в дерево.
         :param do_invert_test_fn: функция которая опредиляет необходимость инвенрсии узла дерева
         """
-        child_ids = []
-        child_not_leafs = []
-        for child in node:
-            child_ids.append(child.term.id)
-            if not child.is_leaf:
-                child_not_leafs.append(child)
-        if do_invert_test_fn(node):
-            xor_children = node.term.get_children().order_by()
-            xor_children = xor_children.exclude(id__in=child_ids) if len(child_ids) > 1 else xor_children.exclude(
-                pk=child_ids[0])
-            qss = [xor_children]
-        else:
-            qss = []
-        for child in child_not_leafs:
-            qss.extend(self._invert_recursively(child, do_invert_test_fn))
-        return qss
+        result = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if do_invert_test_fn(node):
+                if snapshot is not None:
+                    child_ids = [child.term.id for child in node]
+                    for pk in snapshot.get_children_ids(node.term.id):
+                        if pk not in child_ids:
+                            result.extend(snapshot.get_descendants_ids(pk, include_self=True))
+                else:
+                    term = node.term
+                    opts = term._mptt_meta
+                    tree_id = getattr(term, opts.tree_id_attr)
+                    lo, hi = getattr(term, opts.left_attr) + 1, getattr(term, opts.right_attr) - 1
+                    for child_lft, child_rght in sorted((getattr(child.term, opts.left_attr),
+                                                         getattr(child.term, opts.right_attr)) for child in node):
+                        if child_lft > lo:
+                            result.append((tree_id, lo, child_lft - 1))
+                        lo = max(lo, child_rght + 1)
+                    if lo <= hi:
+                        result.append((tree_id, lo, hi))
+            stack.extend(child for child in reversed(node) if not child.is_leaf)
+        return result
 
     @staticmethod
     def _default_do_invert_test_fn(node):
@@ -199,24 +363,25 @@ class TermTreeInfo(dict):
         По умолчанию инверисией считаются термины не входящие в исходное дерево,
         но связанные с ним правилом "XOR" у которых при этом отсутствует класс представления 'not-invert'
         """
-        qss = self._invert_recursively(self.root, (
-                do_invert_test_fn if do_invert_test_fn is not None else self._default_do_invert_test_fn
-            )) if not self.root.is_leaf else []
-        n = len(qss)
-        if n:
-            qs = qss.pop(0)
-            if n > 1:
-                qs = qs.union(*qss)
-            result = get_queryset_descendants(qs, include_self=True)
-        else:
-            # HACK: Emulate TermModel.objects.none()
-            result = self.root.term.__class__.objects.filter(id__isnull=True)
-        return result
+        if do_invert_test_fn is None:
+            do_invert_test_fn = self._default_do_invert_test_fn
+        snapshot = get_forest_snapshot(self.root.term.__class__)
+        if snapshot is not None:
+            ids = self._invert_nodes(do_invert_test_fn, snapshot) if not self.root.is_leaf else []
+            return snapshot.get_queryset(ids)
+
+        ranges = self._invert_nodes(do_invert_test_fn) if not self.root.is_leaf else []
+        # один запрос по интервалам вместо объединения (UNION) подзапросов по каждому узлу "XOR"
+        return get_queryset_by_ranges(self.root.term.__class__, merge_ranges(ranges))
 
     def get_family(self):
         """
         RUS: Возвращает полный список (QuerySet) терминов дерева, отсортированный в порядке обхода дерева.
         """
+        snapshot = get_forest_snapshot(self.root.term.__class__)
+        if snapshot is not None:
+            return snapshot.get_queryset(self.get_family_ids(snapshot))
+
         leafs = []
         not_leafs_ids = []
         for pk, node in self.items():
@@ -231,6 +396,20 @@ class TermTreeInfo(dict):
 
         return get_queryset_descendants(leafs, include_self=True, add_to_result=not_leafs_ids)
 
+    def get_family_ids(self, snapshot=None):
+        """
+        RUS: Возвращает список id терминов дерева и всех потомков его листьев, вычисленный по снимку леса.
+        """
+        if snapshot is None:
+            snapshot = MPTTForestSnapshot.get(self.root.term.__class__)
+        result = []
+        for pk, node in self.items():
+            if node.is_leaf:
+                result.extend(snapshot.get_descendants_ids(pk, include_self=True))
+            else:
+                result.append(pk)
+        return result
+
 
 # ==============================================================================
 # TermInfo
@@ -241,14 +420,43 @@ class TermInfo(list):
     Usage: tree = TermInfo.decompress(root_term, term_ids_set), result type is TermTreeInfo
     Для собирания дерева терминов TermTreeInfo.
     """
+    __slots__ = ('term', 'is_leaf', '_attrs')
+
     def __init__(self, term=None, is_leaf=False, children=(), attrs=None):
         """
         RUS: Конструктор класса объекта.
         """
         super(TermInfo, self).__init__(children)
-        self.attrs = attrs or {}
+        # словарь атрибутов создается при первом обращении, у большинства узлов он не используется
+        self._attrs = attrs or None
         self.term, self.is_leaf = term, is_leaf
 
+    @property
+    def attrs(self):
+        if self._attrs is None:
+            self._attrs = {}
+        return self._attrs
+
+    @attrs.setter
+    def attrs(self, value):
+        self._attrs = value
+
+    def __getstate__(self):
+        return {'term': self.term, 'is_leaf': self.is_leaf, '_attrs': self._attrs}
+
+    def __setstate__(self, state):
+        # совместимость с узлами, сохраненными в кэше до перехода на __slots__
+        if 'attrs' in state:
+            state = dict(state, _attrs=state['attrs'] or None)
+        self.term, self.is_leaf, self._attrs = state['term'], state['is_leaf'], state['_attrs']
+
+    def clone(self):
+        """
+        RUS: Возвращает поверхностную копию узла, дети разделяются с исходным узлом.
+        """
+        return TermInfo(term=self.term, is_leaf=self.is_leaf, children=self,
+                        attrs=dict(self._attrs) if self._attrs else None)
+
     def get_children_dict(self):
         """
         RUS: Возвращает по id термина ребенка значение.
@@ -260,12 +468,14 @@ class TermInfo(list):
 
     def get_descendants_ids(self):
         """
-        RUS: Возвращает список из id термина ребенка и id его предков.
+        RUS: Возвращает список id потомков узла в порядке обхода дерева.
         """
         result = []
-        for child in self:
-            result.append(child.term.id)
-            result.extend(child.get_descendants_ids())
+        stack = list(reversed(self))
+        while stack:
+            node = stack.pop()
+            result.append(node.term.id)
+            stack.extend(reversed(node))
         return result
 
     @staticmethod
@@ -280,31 +490,77 @@ class TermInfo(list):
         root = TermInfo(term=root_term)
         model_class = root_term.__class__
 
+        snapshot = get_forest_snapshot(model_class)
+        if snapshot is not None:
+            return TermInfo._decompress_from_snapshot(root, value, snapshot)
+
+        terms = list(model_class.objects.filter(pk__in=value))
+        # предки всех выбранных терминов запрашиваются одним запросом по интервалам MPTT
+        selected_ids = set(x.id for x in terms)
+        opts = model_class._mptt_meta
+        filters = [Q(**{
+            opts.tree_id_attr: getattr(x, opts.tree_id_attr),
+            '{}__lt'.format(opts.left_attr): getattr(x, opts.left_attr),
+            '{}__gt'.format(opts.right_attr): getattr(x, opts.right_attr)
+        }) for x in terms if x.parent_id is not None and x.parent_id not in selected_ids]
+        ancestors = dict((x.id, x) for x in terms)
+        if filters:
+            for term in model_class.objects.filter(reduce(operator.or_, filters)).order_by():
+                ancestors.setdefault(term.id, term)
+
         tree = TermTreeInfo(root)
-        for term in model_class.objects.filter(pk__in=value).select_related('parent'):
+        for term in terms:
             if term.id not in tree:
                 node = tree[term.id] = TermInfo(term=term, is_leaf=True)
-                term_parent = term.parent
-                if term_parent:
-                    ancestor = tree.get(term_parent.id)
+                parent_id = term.parent_id
+                while parent_id is not None:
+                    ancestor = tree.get(parent_id)
                     if ancestor is not None:
                         ancestor.is_leaf = False
                         ancestor.append(node)
-                    else:
-                        node = tree[term_parent.id] = TermInfo(term=term_parent, is_leaf=False, children=[node])
-                        if term_parent.parent_id is not None:
-                            for term_ancestor in term_parent.get_ancestors(ascending=True).exclude(pk__in=tree.keys()):
-                                node = tree[term_ancestor.id] = TermInfo(term=term_ancestor, is_leaf=False,
-                                                                         children=[node])
-                            ancestor = tree.get(node.term.parent_id)
-                            if ancestor is not None:
-                                ancestor.is_leaf = False
-                                ancestor.append(node)
-                            else:
-                                root.append(node)
-                        else:
-                            root.append(node)
+                        break
+                    term_ancestor = ancestors.get(parent_id)
+                    if term_ancestor is None:
+                        # нарушена целостность дерева
+                        root.append(node)
+                        break
+                    node = tree[parent_id] = TermInfo(term=term_ancestor, is_leaf=False, children=[node])
+                    parent_id = term_ancestor.parent_id
                 else:
                     root.append(node)
+        TermInfo._set_cached_parents(tree)
+        return tree
 
+    @staticmethod
+    def _decompress_from_snapshot(root, value, snapshot):
+        """
+        RUS: Собирает дерево по снимку леса без обращения к базе данных.
+        """
+        tree = TermTreeInfo(root)
+        for pk in snapshot.sort_ids(value):
+            if pk not in tree:
+                node = tree[pk] = TermInfo(term=snapshot.make_instance(pk), is_leaf=True)
+                parent_id = snapshot.get_parent_id(pk)
+                while parent_id is not None:
+                    ancestor = tree.get(parent_id)
+                    if ancestor is not None:
+                        ancestor.is_leaf = False
+                        ancestor.append(node)
+                        break
+                    node = tree[parent_id] = TermInfo(term=snapshot.make_instance(parent_id), is_leaf=False,
+                                                      children=[node])
+                    parent_id = snapshot.get_parent_id(parent_id)
+                else:
+                    root.append(node)
+        TermInfo._set_cached_parents(tree)
         return tree
+
+    @staticmethod
+    def _set_cached_parents(tree):
+        """
+        RUS: Запоминает родителей терминов дерева, аналогично select_related('parent').
+        """
+        for node in tree.values():
+            parent = tree.get(node.term.parent_id, None)
+            if parent is not None or node.term.parent_id is None:
+                _set_cached_parent(node.term, parent.term if parent is not None else None)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+import time
+from array import array
+
+from django.core.cache import cache
+from django.db import router
+from django.db.models.sql.where import AND
+
+from .sql.where import IdsWhere
+from .. import settings as edw_settings
+
+
+# ==============================================================================
+# MPTTForestSnapshot
+# ==============================================================================
+class MPTTForestSnapshot(object):
+    """
+    ENG: Immutable, array-backed in-process snapshot of the whole MPTT forest.
+    RUS: Неизменяемый снимок всего леса MPTT модели, хранящийся в памяти процесса.
+    Строки упорядочены в порядке обхода дерева (tree_id, lft), поэтому потомки узла
+    занимают непрерывный диапазон позиций сразу за ним.
+    Снимок версионируется счетчиком в глобальном кэше, при изменении версии снимок перезагружается.
+    """
+    VERSION_CACHE_KEY_PATTERN = '{model}:snp_ver'
+    VERSION_CACHE_TIMEOUT = None  # never expire
+
+    # числовые колонки хранятся в массивах, остальные - в кортежах
+    INT_FIELDS = ('id', 'parent_id', 'tree_id', 'lft', 'rght', 'level', 'semantic_rule', 'attributes')
+    # не загружаемые в снимок поля, при обращении к ним экземпляр модели догрузит значение из базы
+    DEFERRED_FIELDS = ('description', )
+
+    _registry = {}
+    _lock = threading.Lock()
+
+    def __init__(self, model_class, version, field_names, rows):
+        """
+        RUS: Конструктор снимка, rows - строки значений полей field_names в порядке обхода дерева.
+        """
+        self.model_class = model_class
+        self.version = version
+        self.created_at = self.checked_at = time.time()
+        self.field_names = tuple(field_names)
+        self.db = router.db_for_read(model_class)
+
+        columns = list(zip(*rows)) if rows else [()] * len(self.field_names)
+        self._columns = {}
+        for name, values in zip(self.field_names, columns):
+            if name in self.INT_FIELDS:
+                self._columns[name] = array(str('q'), [int(x) if x is not None else 0 for x in values])
+            else:
+                self._columns[name] = tuple(values)
+
+        self.ids = self._columns['id']
+        self.parent_ids = self._columns['parent_id']
+        self.lfts = self._columns['lft']
+        self.rghts = self._columns['rght']
+        self.actives = self._columns['active']
+        self._index = dict((pk, i) for i, pk in enumerate(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, pk):
+        return pk in self._index
+
+    @classmethod
+    def get_version_cache_key(cls, model_class):
+        return cls.VERSION_CACHE_KEY_PATTERN.format(model=model_class._meta.object_name.lower())
+
+    @classmethod
+    def get_version(cls, model_class):
+        """
+        RUS: Возвращает текущую версию снимка из глобального кэша, при отсутствии инициализирует ее
+        значением времени, чтобы версия не повторялась после вытеснения ключа из кэша.
+        """
+        key = cls.get_version_cache_key(model_class)
+        version = cache.get(key, None)
+        if version is None:
+            cache.add(key, int(time.time() * 1000), cls.VERSION_CACHE_TIMEOUT)
+            version = cache.get(key, 0)
+        return version
+
+    @classmethod
+    def load(cls, model_class, version):
+        """
+        RUS: Загружает снимок одним запросом к базе данных.
+        """
+        field_names = [f.attname for f in model_class._meta.concrete_fields if f.name not in cls.DEFERRED_FIELDS]
+        rows = list(model_class._default_manager.order_by('tree_id', 'lft').values_list(*field_names))
+        return cls(model_class, version, field_names, rows)
+
+    @classmethod
+    def get(cls, model_class):
+        """
+        RUS: Возвращает актуальный снимок леса модели, версия сверяется с глобальным кэшем
+        не чаще чем раз в 'version_check_interval' секунд.
+        """
+        options = edw_settings.TERM_SNAPSHOT
+        snapshot = cls._registry.get(model_class, None)
+        now = time.time()
+        if snapshot is not None:
+            if now - snapshot.checked_at < options['version_check_interval']:
+                return snapshot
+            if now - snapshot.created_at < options['max_age']:
+                if snapshot.version == cls.get_version(model_class):
+                    snapshot.checked_at = now
+                    return snapshot
+        with cls._lock:
+            current = cls._registry.get(model_class, None)
+            if current is not snapshot and current is not None:
+                # снимок уже перезагружен в соседнем потоке
+                return current
+            snapshot = cls._registry[model_class] = cls.load(model_class, cls.get_version(model_class))
+        return snapshot
+
+    @classmethod
+    def reload(cls, model_class):
+        """
+        RUS: Перезагружает снимок в текущем процессе из базы данных, не дожидаясь проверки версии
+        (например, в фоновой задаче, запущенной после фиксации изменений дерева).
+        """
+        with cls._lock:
+            snapshot = cls._registry[model_class] = cls.load(model_class, cls.get_version(model_class))
+        return snapshot
+
+    @classmethod
+    def invalidate(cls, model_class):
+        """
+        RUS: Сбрасывает снимок в текущем процессе и увеличивает версию для остальных процессов.
+        """
+        cls._registry.pop(model_class, None)
+        key = cls.get_version_cache_key(model_class)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, int(time.time() * 1000), cls.VERSION_CACHE_TIMEOUT)
+
+    def index_of(self, pk):
+        return self._index.get(pk, None)
+
+    def get_value(self, pk, name):
+        return self._columns[name][self._index[pk]]
+
+    def get_descendant_count(self, pk):
+        i = self._index[pk]
+        return (self.rghts[i] - self.lfts[i] - 1) // 2
+
+    def is_leaf_node(self, pk):
+        return not self.get_descendant_count(pk)
+
+    def get_parent_id(self, pk):
+        return self.parent_ids[self._index[pk]] or None
+
+    def get_ancestors_ids(self, pk, ascending=False, include_self=False):
+        """
+        RUS: Возвращает список id предков узла.
+        """
+        result = [pk] if include_self else []
+        parent_id = self.parent_ids[self._index[pk]]
+        while parent_id:
+            result.append(parent_id)
+            parent_id = self.parent_ids[self._index[parent_id]]
+        if not ascending:
+            result.reverse()
+        return result
+
+    def _descendants_range(self, pk, include_self=False):
+        i = self._index[pk]
+        count = (self.rghts[i] - self.lfts[i] - 1) // 2
+        return range(i if include_self else i + 1, i + count + 1)
+
+    def get_descendants_ids(self, pk, include_self=False, active_only=False):
+        """
+        RUS: Возвращает список id потомков узла в порядке обхода дерева.
+        """
+        ids, actives = self.ids, self.actives
+        if active_only:
+            return [ids[i] for i in self._descendants_range(pk, include_self) if actives[i]]
+        return [ids[i] for i in self._descendants_range(pk, include_self)]
+
+    def get_children_ids(self, pk):
+        """
+        RUS: Возвращает список id детей узла в порядке обхода дерева.
+        """
+        result = []
+        i = self._index[pk]
+        end = i + (self.rghts[i] - self.lfts[i] - 1) // 2
+        i += 1
+        while i <= end:
+            result.append(self.ids[i])
+            i += (self.rghts[i] - self.lfts[i] - 1) // 2 + 1
+        return result
+
+    def sort_ids(self, ids):
+        """
+        RUS: Сортирует id узлов в порядке обхода дерева, неизвестные id отбрасываются.
+        """
+        index = self._index
+        return [self.ids[i] for i in sorted(index[pk] for pk in ids if pk in index)]
+
+    def make_instance(self, pk):
+        """
+        RUS: Создает экземпляр модели по данным снимка без обращения к базе данных.
+        """
+        i = self._index[pk]
+        values = [self._columns[name][i] for name in self.field_names]
+        instance = self.model_class.from_db(self.db, self.field_names, self._restore_values(values))
+        return instance
+
+    def _restore_values(self, values):
+        result = []
+        for name, value in zip(self.field_names, values):
+            if name == 'parent_id' and not value:
+                value = None
+            result.append(value)
+        return result
+
+    def get_queryset(self, ids):
+        """
+        RUS: Возвращает запрос (QuerySet) по списку id, отсортированный в порядке обхода дерева.
+        Запрос строится по id, а не по значениям lft снимка, которые могут устареть после изменения дерева.
+        Большой список id соединяется со списком VALUES (см. IdsWhere).
+        """
+        if not ids:
+            # HACK: Emulate model_class.objects.none()
+            return self.model_class._default_manager.filter(id__isnull=True)
+        threshold = edw_settings.TERM_SNAPSHOT['ids_join_threshold']
+        if not threshold or len(ids) <= threshold:
+            return self.model_class._default_manager.filter(id__in=ids)
+
+        queryset = self.model_class._default_manager.all()
+        queryset.query.where.add(IdsWhere(
+            queryset.query.get_initial_alias(), self.model_class._meta.pk.column, ids), AND)
+        return queryset
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+from functools import reduce
+from operator import __or__ as OR
+
+from six import with_metaclass
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils.encoding import python_2_unicode_compatible
+from django.utils.translation import ugettext_lazy as _
+
+from edw import deferred
+from edw import settings as edw_settings
+
+
+#==============================================================================
+# BaseEntityAttributes
+#==============================================================================
+@python_2_unicode_compatible
+class BaseEntityAttributes(with_metaclass(deferred.ForeignKeyBuilder, models.Model)):
+    """
+    ENG: Materialized characteristics and marks of the polymorphic Entity.
+    RUS: Материализованные характеристики и метки Сущности.
+    Списки EntityCharacteristicOrMarkInfo хранятся в JSON и пересчитываются фоновой задачей
+    `update_entities_attributes` при изменении терминов объекта, его дополнительных атрибутов,
+    названий и классов представления терминов-атрибутов. Устаревшие записи удаляются сразу,
+    до пересчета атрибуты объекта вычисляются по терминам.
+    """
+    entity = deferred.OneToOneField('BaseEntity', verbose_name=_('Entity'), related_name='+', primary_key=True)
+    characteristics = models.TextField(_('Characteristics'), default='[]')
+    marks = models.TextField(_('Marks'), default='[]')
+    updated_at = models.DateTimeField(_('Updated at'), auto_now=True)
+
+    class Meta:
+        """
+        RUS: Метаданные класса.
+        """
+        abstract = True
+        verbose_name = _("Entity Attributes")
+        verbose_name_plural = _("Entities Attributes")
+
+    def __str__(self):
+        """
+        RUS: Строковое представление данных.
+        """
+        return "{}".format(self.entity_id)
+
+    @staticmethod
+    def dumps(attrs):
+        """
+        RUS: Сериализует список EntityCharacteristicOrMarkInfo в JSON.
+        """
+        return json.dumps([[x.name, x.path, x.values, x.view_class, x.tree_id, x.tree_left] for x in attrs],
+                          ensure_ascii=False)
+
+    @staticmethod
+    def loads(data):
+        """
+        RUS: Восстанавливает список EntityCharacteristicOrMarkInfo из JSON.
+        """
+        from edw.models.entity import EntityCharacteristicOrMarkInfo
+
+        return [EntityCharacteristicOrMarkInfo(*x) for x in json.loads(data)]
+
+    @classmethod
+    def get_attributes(cls, entities_ids):
+        """
+        RUS: Возвращает словарь "id объекта -> (характеристики, метки)" одним запросом,
+        объекты без материализованных атрибутов в словарь не попадают.
+        """
+        return dict((entity_id, (cls.loads(characteristics), cls.loads(marks))) for entity_id, characteristics, marks in
+                    cls.objects.filter(entity_id__in=entities_ids).values_list('entity_id', 'characteristics', 'marks'))
+
+    @staticmethod
+    def _get_entities_ids_querysets(terms_ids):
+        from edw.models.entity import EntityModel
+        from edw.models.related import AdditionalEntityCharacteristicOrMarkModel
+        from edw.models.sql.semantic import get_m2m_through_fields
+
+        through, entity_field, term_field = get_m2m_through_fields(EntityModel, 'terms')
+        return (
+            through.objects.filter(**{'{}__in'.format(term_field): terms_ids}).values_list(entity_field, flat=True),
+            AdditionalEntityCharacteristicOrMarkModel.objects.filter(
+                term_id__in=terms_ids).values_list('entity_id', flat=True)
+        )
+
+    @classmethod
+    def get_entities_ids(cls, terms_ids):
+        """
+        RUS: Возвращает id объектов, атрибуты которых зависят от терминов.
+        """
+        result = set()
+        for queryset in cls._get_entities_ids_querysets(terms_ids):
+            result.update(queryset.order_by())
+        return result
+
+    @classmethod
+    def invalidate(cls, entities_ids=None, terms_ids=None):
+        """
+        RUS: Удаляет материализованные атрибуты объектов (или объектов, связанных с терминами)
+        и ставит в очередь их пересчет после фиксации транзакции.
+        """
+        entities_ids, terms_ids = list(entities_ids or []), list(terms_ids or [])
+        if entities_ids:
+            cls.objects.filter(entity_id__in=entities_ids).delete()
+        if terms_ids:
+            cls.objects.filter(reduce(OR, [
+                Q(entity_id__in=queryset.order_by()) for queryset in cls._get_entities_ids_querysets(terms_ids)
+            ])).delete()
+        if entities_ids or terms_ids:
+            from edw.tasks import update_entities_attributes
+
+            transaction.on_commit(lambda: update_entities_attributes.delay(entities_ids, terms_ids))
+
+    @classmethod
+    def refresh(cls, entities_ids=None, terms_ids=None):
+        """
+        RUS: Пересчитывает и сохраняет атрибуты объектов порциями по 'chunk_size',
+        атрибуты каждой порции вычисляются пакетно. Возвращает количество обработанных объектов.
+        Снимок леса терминов процесса перезагружается, а термины-атрибуты выбираются из базы данных:
+        процесс фоновой задачи может еще не знать об изменении дерева терминов.
+        """
+        from edw.models.entity import EntityModel, prefetch_characteristics_and_marks
+        from edw.models.mptt_snapshot import MPTTForestSnapshot
+        from edw.models.term import TermModel
+
+        if edw_settings.TERM_SNAPSHOT['enabled']:
+            MPTTForestSnapshot.reload(TermModel.materialized)
+
+        ids = set(entities_ids or [])
+        if terms_ids:
+            ids.update(cls.get_entities_ids(terms_ids))
+        ids = sorted(ids)
+        chunk_size = edw_settings.ENTITY_ATTRIBUTES_PROJECTION['chunk_size']
+        count = 0
+        for i in range(0, len(ids), chunk_size):
+            chunk = ids[i:i + chunk_size]
+            entities = list(EntityModel.objects.filter(id__in=chunk))
+            for entity in entities:
+                # вычисляем атрибуты по терминам, минуя материализованные
+                entity.__dict__['attributes_projection'] = None
+            prefetch_characteristics_and_marks(entities, use_projection=False, use_cache=False)
+            objs = [cls(entity_id=x.id, characteristics=cls.dumps(x.characteristics), marks=cls.dumps(x.marks))
+                    for x in entities]
+            with transaction.atomic():
+                cls.objects.filter(entity_id__in=chunk).delete()
+                cls.objects.bulk_create(objs)
+            count += len(objs)
+        return count
+
+
+EntityAttributesModel = deferred.MaterializedModel(BaseEntityAttributes)
+
+
+_is_materialized = None
+
+
+def is_entity_attributes_enabled():
+    """
+    RUS: Возвращает True, если материализация атрибутов разрешена настройками и модель материализована в проекте.
+    """
+    global _is_materialized
+
+    if not edw_settings.ENTITY_ATTRIBUTES_PROJECTION['enabled']:
+        return False
+    if _is_materialized is None:
+        try:
+            EntityAttributesModel()  # Test pass if model materialized
+        except (ImproperlyConfigured, ImportError):
+            _is_materialized = False
+        else:
+            _is_materialized = True
+    return _is_materialized
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import operator
+from functools import reduce
+
+from django.db.models import Q
+
+from ...utils.set_helpers import uniq
+
+
+# ==============================================================================
+# SemanticFilterComplexityError
+# ==============================================================================
+class SemanticFilterComplexityError(ValueError):
+    """
+    RUS: Превышен допустимый предел сложности семантического фильтра.
+    """
+    pass
+
+
+# ==============================================================================
+# Semantic predicates
+# ==============================================================================
+class TermsPredicate(object):
+    """
+    ENG: Entity has at least one term from `ids`.
+    RUS: Предикат "у объекта есть хотя бы один термин из списка ids".
+    """
+    __slots__ = ('ids', )
+
+    def __init__(self, ids):
+        self.ids = list(ids)
+
+    @property
+    def complexity(self):
+        return 1
+
+    def __repr__(self):
+        return '<{}: {}>'.format(self.__class__.__name__, self.ids)
+
+    def as_q(self, through, entity_field, term_field):
+        """
+        RUS: Возвращает фильтр вида `id IN (SELECT entity_id FROM through WHERE term_id IN (...))`.
+        """
+        lookup = {'{}__in'.format(term_field): self.ids} if len(self.ids) > 1 else {term_field: self.ids[0]}
+        return Q(pk__in=through.objects.filter(**lookup).values(entity_field))
+
+    def resolve(self, index):
+        """
+        RUS: Вычисляет битовую карту id объектов по инвертированному индексу.
+        """
+        return index.union(self.ids)
+
+
+class _CompoundPredicate(object):
+    """
+    RUS: Составной предикат, объединяющий дочерние предикаты логической связкой.
+    """
+    __slots__ = ('children', )
+
+    connector = None
+
+    def __init__(self, children):
+        self.children = list(children)
+
+    @classmethod
+    def make(cls, children):
+        """
+        RUS: Создает предикат, "разворачивая" вложенные предикаты того же типа.
+        Если остается единственный дочерний предикат, возвращается он сам.
+        """
+        flat = []
+        for child in children:
+            if isinstance(child, cls):
+                flat.extend(child.children)
+            elif child is not None:
+                flat.append(child)
+        flat = cls.simplify(flat)
+        if not flat:
+            return None
+        return flat[0] if len(flat) == 1 else cls(flat)
+
+    @classmethod
+    def simplify(cls, children):
+        return children
+
+    @property
+    def complexity(self):
+        return sum(x.complexity for x in self.children)
+
+    def __repr__(self):
+        return '<{}: {}>'.format(self.__class__.__name__, self.children)
+
+    def as_q(self, through, entity_field, term_field):
+        return reduce(self.connector, (x.as_q(through, entity_field, term_field) for x in self.children))
+
+    def resolve(self, index):
+        return reduce(self.connector, (x.resolve(index) for x in self.children))
+
+
+class AndPredicate(_CompoundPredicate):
+    """
+    RUS: Логическое "И" дочерних предикатов.
+    """
+    __slots__ = ()
+
+    connector = operator.and_
+
+
+class OrPredicate(_CompoundPredicate):
+    """
+    RUS: Логическое "ИЛИ" дочерних предикатов.
+    """
+    __slots__ = ()
+
+    connector = operator.or_
+
+    @classmethod
+    def simplify(cls, children):
+        """
+        RUS: Объединяет все предикаты TermsPredicate в один, так как
+        "есть термин из S1" ИЛИ "есть термин из S2" равносильно "есть термин из S1 ∪ S2".
+        """
+        ids = []
+        result = []
+        for child in children:
+            if isinstance(child, TermsPredicate):
+                ids.extend(child.ids)
+            else:
+                result.append(child)
+        if ids:
+            result.insert(0, TermsPredicate(uniq(ids)))
+        return result
+
+
+# ==============================================================================
+# SemanticFilterPlan
+# ==============================================================================
+class SemanticFilterPlan(object):
+    """
+    ENG: Compiled semantic filter, ready for caching.
+    RUS: Скомпилированный семантический фильтр: стратегия и готовый SQL с параметрами,
+    либо предикат для стратегии 'in'. Пустая стратегия означает отсутствие фильтрации.
+    """
+    __slots__ = ('strategy', 'sql', 'params', 'predicate')
+
+    def __init__(self, strategy=None, sql=None, params=None, predicate=None):
+        self.strategy, self.sql, self.params, self.predicate = strategy, sql, params, predicate
+
+    def __repr__(self):
+        return '<{}: {}>'.format(self.__class__.__name__, self.strategy)
+
+
+# ==============================================================================
+# make_semantic_predicate
+# ==============================================================================
+def make_semantic_predicate(tree, max_complexity=None):
+    """
+    RUS: Строит факторизованный предикат по дереву терминов без раскрытия в КНФ.
+    Размер предиката растет линейно от количества узлов дерева.
+    :param tree: дерево терминов TermTreeInfo
+    :param max_complexity: максимально допустимое количество подзапросов
+    :return: предикат или None, если фильтрация не требуется
+    """
+    predicate = tree.root.term.make_predicate(term_info=tree.root)
+    if predicate is not None and max_complexity is not None and predicate.complexity > max_complexity:
+        raise SemanticFilterComplexityError(
+            'Semantic filter complexity {} exceeds limit {}'.format(predicate.complexity, max_complexity))
+    return predicate
+
+
+def get_m2m_through_fields(model, field_name):
+    """
+    RUS: Возвращает промежуточную модель связи многие-ко-многим, имена полей объекта и термина в ней.
+    """
+    field = model._meta.get_field(field_name)
+    return getattr(model, field_name).through, field.m2m_field_name(), field.m2m_reverse_field_name()
+
+
+# ==============================================================================
+# SemanticSQLBuilder
+# ==============================================================================
+class SemanticSQLBuilder(object):
+    """
+    ENG: Builds SQL selecting distinct ids of entities which satisfy semantic predicate.
+    RUS: Строит SQL-запрос, выбирающий уникальные id объектов, удовлетворяющих семантическому предикату.
+    Поддерживаемые стратегии:
+    'intersect' - пересечение (INTERSECT) и объединение (UNION) выборок из промежуточной таблицы;
+    'group_by' - один проход по промежуточной таблице с группировкой и условием HAVING;
+    'exists' - цепочка коррелированных подзапросов EXISTS к таблице объектов.
+    """
+    STRATEGIES = ('intersect', 'group_by', 'exists')
+    # СУБД, не поддерживающие INTERSECT
+    NO_INTERSECT_VENDORS = ('mysql', )
+
+    def __init__(self, connection, entity_model, through, entity_field, term_field, alias='sk'):
+        self.connection = connection
+        self.alias = alias
+        qn = self.qn = connection.ops.quote_name
+        self.entity_table = qn(entity_model._meta.db_table)
+        self.entity_pk = qn(entity_model._meta.pk.column)
+        self.through_table = qn(through._meta.db_table)
+        self.entity_column = qn(through._meta.get_field(entity_field).column)
+        self.term_column = qn(through._meta.get_field(term_field).column)
+        self._alias_index = 0
+
+    @classmethod
+    def choose_strategy(cls, predicate, vendor):
+        """
+        RUS: Выбирает стратегию по структуре предиката.
+        Один подзапрос эффективнее всего выполняется через IN, "плоская" конъюнкция - группировкой,
+        в остальных случаях используется пересечение выборок, либо EXISTS если СУБД не поддерживает INTERSECT.
+        """
+        if isinstance(predicate, TermsPredicate):
+            return 'in'
+        if isinstance(predicate, AndPredicate) and all(isinstance(x, TermsPredicate) for x in predicate.children):
+            return 'group_by'
+        return 'exists' if vendor in cls.NO_INTERSECT_VENDORS else 'intersect'
+
+    def _make_alias(self):
+        self._alias_index += 1
+        return self.qn('{}_{}'.format(self.alias, self._alias_index))
+
+    @staticmethod
+    def _placeholders(ids):
+        return ', '.join(['%s'] * len(ids))
+
+    def build(self, predicate, strategy):
+        """
+        RUS: Возвращает SQL и параметры запроса, единственная колонка которого называется `self.alias`.
+        """
+        self._alias_index = 0
+        params = []
+        if strategy == 'intersect':
+            sql = self._build_intersect(predicate, params)
+        elif strategy == 'group_by':
+            sql = self._build_group_by(predicate, params)
+        elif strategy == 'exists':
+            sql = self._build_exists(predicate, params)
+        else:
+            raise ValueError('Unknown semantic filter strategy `{}`'.format(strategy))
+        return sql, params
+
+    # INTERSECT / UNION
+    def _build_intersect(self, predicate, params):
+        qn = self.qn
+        if isinstance(predicate, TermsPredicate):
+            params.extend(predicate.ids)
+            return 'SELECT DISTINCT {entity} AS {alias} FROM {table} WHERE {term} IN ({ids})'.format(
+                entity=self.entity_column, alias=qn(self.alias), table=self.through_table,
+                term=self.term_column, ids=self._placeholders(predicate.ids))
+        operator_sql = ' INTERSECT ' if isinstance(predicate, AndPredicate) else ' UNION '
+        parts = []
+        for child in predicate.children:
+            child_sql = self._build_intersect(child, params)
+            # вложенные составные запросы оборачиваются подзапросом, так как SQLite не поддерживает скобки
+            parts.append('SELECT {alias} FROM ({sql}) {subquery_alias}'.format(
+                alias=qn(self.alias), sql=child_sql, subquery_alias=self._make_alias()))
+        return operator_sql.join(parts)
+
+    # GROUP BY ... HAVING
+    def _having_condition(self, predicate, params):
+        if isinstance(predicate, TermsPredicate):
+            params.extend(predicate.ids)
+            return 'SUM(CASE WHEN {term} IN ({ids}) THEN 1 ELSE 0 END) > 0'.format(
+                term=self.term_column, ids=self._placeholders(predicate.ids))
+        operator_sql = ' AND ' if isinstance(predicate, AndPredicate) else ' OR '
+        return '({})'.format(operator_sql.join(self._having_condition(x, params) for x in predicate.children))
+
+    @staticmethod
+    def _collect_ids(predicate, ids):
+        if isinstance(predicate, TermsPredicate):
+            ids.extend(predicate.ids)
+        else:
+            for child in predicate.children:
+                SemanticSQLBuilder._collect_ids(child, ids)
+        return ids
+
+    def _build_group_by(self, predicate, params):
+        ids = uniq(self._collect_ids(predicate, []))
+        params.extend(ids)
+        having = self._having_condition(predicate, params)
+        return ('SELECT {entity} AS {alias} FROM {table} WHERE {term} IN ({ids}) '
+                'GROUP BY {entity} HAVING {having}').format(
+            entity=self.entity_column, alias=self.qn(self.alias), table=self.through_table, term=self.term_column,
+            ids=self._placeholders(ids), having=having)
+
+    # EXISTS
+    def _exists_condition(self, predicate, outer_alias, params):
+        if isinstance(predicate, TermsPredicate):
+            params.extend(predicate.ids)
+            inner_alias = self._make_alias()
+            return ('EXISTS (SELECT 1 FROM {table} {inner} WHERE {inner}.{entity} = {outer}.{pk} '
+                    'AND {inner}.{term} IN ({ids}))').format(
+                table=self.through_table, inner=inner_alias, entity=self.entity_column, outer=outer_alias,
+                pk=self.entity_pk, term=self.term_column, ids=self._placeholders(predicate.ids))
+        operator_sql = ' AND ' if isinstance(predicate, AndPredicate) else ' OR '
+        return '({})'.format(operator_sql.join(
+            self._exists_condition(x, outer_alias, params) for x in predicate.children))
+
+    def _build_exists(self, predicate, params):
+        outer_alias = self._make_alias()
+        condition = self._exists_condition(predicate, outer_alias, params)
+        return 'SELECT {outer}.{pk} AS {alias} FROM {table} {outer} WHERE {condition}'.format(
+            outer=outer_alias, pk=self.entity_pk, alias=self.qn(self.alias), table=self.entity_table,
+            condition=condition)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+
+# ==============================================================================
+# RangesWhere
+# ==============================================================================
+class RangesWhere(object):
+    """
+    RUS: Условие WHERE "значение lft узла попадает в один из интервалов (tree_id, lo, hi)",
+    интервалы соединяются со списком VALUES через EXISTS.
+    Столбцы указываются через псевдоним таблицы запроса, который меняется вместе с запросом
+    (relabeled_clone), поэтому условие корректно и во вложенных запросах.
+    """
+    contains_aggregate = False
+    contains_over_clause = False
+
+    def __init__(self, alias, tree_id_column, lft_column, ranges, pk_column=None, add_to_result=None):
+        self.alias = alias
+        self.tree_id_column = tree_id_column
+        self.lft_column = lft_column
+        self.ranges = ranges
+        self.pk_column = pk_column
+        self.add_to_result = add_to_result
+
+    def _get_rows_sql(self, connection):
+        values = ', '.join(['(%s, %s, %s)'] * len(self.ranges))
+        if connection.vendor == 'postgresql':
+            return '(VALUES {}) AS _r (tree_id, lo, hi)'.format(values)
+        elif connection.vendor == 'sqlite':
+            return '(SELECT column1 AS tree_id, column2 AS lo, column3 AS hi FROM (VALUES {})) AS _r'.format(values)
+        return '({}) AS _r'.format(' UNION ALL '.join(['SELECT %s AS tree_id, %s AS lo, %s AS hi'] * len(self.ranges)))
+
+    def as_sql(self, compiler, connection):
+        qn, qn2 = compiler.quote_name_unless_alias, connection.ops.quote_name
+        table = qn(self.alias)
+        sql = 'EXISTS (SELECT 1 FROM {rows} WHERE _r.tree_id = {table}.{tree_id} AND ' \
+              '{table}.{lft} BETWEEN _r.lo AND _r.hi)'.format(rows=self._get_rows_sql(connection), table=table,
+                                                              tree_id=qn2(self.tree_id_column),
+                                                              lft=qn2(self.lft_column))
+        params = [x for r in self.ranges for x in r]
+        if self.add_to_result:
+            sql = '({} OR {}.{} IN ({}))'.format(sql, table, qn2(self.pk_column),
+                                                 ', '.join(['%s'] * len(self.add_to_result)))
+            params.extend(self.add_to_result)
+        return sql, params
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(change_map.get(self.alias, self.alias), self.tree_id_column, self.lft_column,
+                              self.ranges, self.pk_column, self.add_to_result)
+
+    def clone(self):
+        return self.relabeled_clone({})
+
+    def get_group_by_cols(self):
+        return []
+
+
+# ==============================================================================
+# IdsWhere
+# ==============================================================================
+class IdsWhere(object):
+    """
+    RUS: Условие WHERE "ключ узла входит в список id", список соединяется через VALUES.
+    Целочисленные id подставляются в запрос значениями, а не параметрами,
+    поэтому размер списка не ограничен количеством параметров запроса СУБД.
+    """
+    contains_aggregate = False
+    contains_over_clause = False
+
+    def __init__(self, alias, pk_column, ids):
+        self.alias = alias
+        self.pk_column = pk_column
+        self.ids = [int(x) for x in ids]
+
+    def _get_rows_sql(self, connection):
+        if connection.vendor == 'postgresql':
+            values = ', '.join(['({})'.format(x) for x in self.ids])
+            return 'SELECT _i.id FROM (VALUES {}) AS _i (id)'.format(values)
+        elif connection.vendor == 'sqlite':
+            values = ', '.join(['({})'.format(x) for x in self.ids])
+            return 'SELECT column1 FROM (VALUES {})'.format(values)
+        return ', '.join([str(x) for x in self.ids])
+
+    def as_sql(self, compiler, connection):
+        qn, qn2 = compiler.quote_name_unless_alias, connection.ops.quote_name
+        sql = '{}.{} IN ({})'.format(qn(self.alias), qn2(self.pk_column), self._get_rows_sql(connection))
+        return sql, []
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(change_map.get(self.alias, self.alias), self.pk_column, self.ids)
+
+    def clone(self):
+        return self.relabeled_clone({})
+
+    def get_group_by_cols(self):
+        return []
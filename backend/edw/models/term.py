@@ -2,6 +2,7 @@
 from __future__ import unicode_literals
 
 import inspect
+from array import array
 
 from bitfield import BitField
 from django.core.cache import cache
@@ -18,15 +19,15 @@ from mptt.querysets import TreeQuerySet
 from rest_framework.reverse import reverse
 from six import with_metaclass
 
-from .cache import add_cache_key, QuerySetCachedResultMixin
+from .cache import add_cache_key, get_or_set_single_flight, QuerySetCachedResultMixin
 from .fields.tree import TreeForeignKey
 from .mixins.rebuild_tree import RebuildTreeMixin
 from .mixins.term.semantic_rule import (OrRuleFilterMixin, AndRuleFilterMixin, )
-from .mptt_info import get_queryset_descendants, TermInfo
+from .mptt_info import get_forest_snapshot, get_queryset_descendants, TermInfo
 from .. import deferred
 from .. import settings as edw_settings
 from ..signals.mptt import MPTTModelSignalSenderMixin
-from ..utils.circular_buffer_in_cache import RingBuffer
+from ..utils.cache_generation import CacheGeneration, warn_deprecated_buffer
 from ..utils.hash_helpers import get_unique_slug, hash_unsorted_list
 from ..utils.set_helpers import uniq
 
@@ -251,6 +252,13 @@ class BaseTerm(with_metaclass(BaseTermMetaclass, AndRuleFilterMixin, OrRuleFilte
     ATTRIBUTE_EXCLUDE_CACHE_KEY_PATTERN = '{mode}:ate'
     ATTRIBUTE_ANCESTORS_CACHE_TIMEOUT = edw_settings.CACHE_DURATIONS['term_attribute_ancestors']
 
+    LEAF_IDS_BUFFER_CACHE_KEY = 't_lf_bf'
+    LEAF_IDS_BUFFER_CACHE_SIZE = edw_settings.CACHE_BUFFERS_SIZES['term_leaf_ids']
+    LEAF_IDS_CACHE_KEY_PATTERN = '{id}:lf_ids'
+    LEAF_IDS_CACHE_TIMEOUT = edw_settings.CACHE_DURATIONS['term_leaf_ids']
+
+    TREE_GENERATION_CACHE_KEY = 't_tr'
+
     OR_RULE = 10
     XOR_RULE = 20
     AND_RULE = 30
@@ -368,6 +376,15 @@ class BaseTerm(with_metaclass(BaseTermMetaclass, AndRuleFilterMixin, OrRuleFilte
         else:
             return OrRuleFilterMixin.make_filters(self, *args, **kwargs)
 
+    def make_predicate(self, *args, **kwargs):
+        """
+        RUS: Строит семантический предикат согласно правилу термина, аналогично make_filters.
+        """
+        if self.semantic_rule == self.AND_RULE:
+            return AndRuleFilterMixin.make_predicate(self, *args, **kwargs)
+        else:
+            return OrRuleFilterMixin.make_predicate(self, *args, **kwargs)
+
     @cached_property
     def ancestors_list(self):
         """
@@ -532,114 +549,162 @@ class BaseTerm(with_metaclass(BaseTermMetaclass, AndRuleFilterMixin, OrRuleFilte
 
         return tree
 
+    @staticmethod
+    def get_decompress_generation():
+        """
+        RUS: Возвращает поколение ключей кэша разобранных деревьев терминов.
+        """
+        return CacheGeneration.factory(BaseTerm.DECOMPRESS_BUFFER_CACHE_KEY,
+                                       max_size=BaseTerm.DECOMPRESS_BUFFER_CACHE_SIZE)
+
     @staticmethod
     def get_decompress_buffer():
         """
-        RUS: Собирает кольцевой буфер с ключом кэша и указанием максимального размера.
+        RUS: Устаревший синоним `get_decompress_generation`, возвращает поколение, совместимое с кольцевым буфером.
         """
-        return RingBuffer.factory(BaseTerm.DECOMPRESS_BUFFER_CACHE_KEY,
-                                  max_size=BaseTerm.DECOMPRESS_BUFFER_CACHE_SIZE)
+        warn_deprecated_buffer('get_decompress_buffer', 'get_decompress_generation')
+        return BaseTerm.get_decompress_generation()
 
     @staticmethod
     def clear_decompress_buffer():
         """
-        RUS: Очищает буфер, удаляя по указанным ключам.
+        RUS: Очищает кэш разобранных деревьев терминов сменой поколения ключей.
         """
-        buf = BaseTerm.get_decompress_buffer()
-        keys = buf.get_all()
-        buf.clear()
-        cache.delete_many(keys)
+        BaseTerm.get_decompress_generation().incr()
 
     @staticmethod
     def cached_decompress(value=None, fix_it=False):
         """
-        RUS: Собирает дерево из терминов, применяя к нему ключ кэша и удаляя старый кэш по ключу,
-        если он не является акутуальным.
+        RUS: Собирает дерево из терминов, применяя к нему ключ кэша текущего поколения.
         """
-        key = BaseTerm.DECOMPRESS_CACHE_KEY_PATTERN.format(**{
+        generation = BaseTerm.get_decompress_generation()
+        key = generation.make_key(BaseTerm.DECOMPRESS_CACHE_KEY_PATTERN.format(**{
             "value_hash": hash_unsorted_list(value) if value else '',
             "fix_it": 'Y' if fix_it else 'N'
-        })
-        tree = cache.get(key, None)
-        if tree is None:
-            tree = BaseTerm.decompress(value=value, fix_it=fix_it)
-            cache.set(key, tree, BaseTerm.DECOMPRESS_CACHE_TIMEOUT)
-            buf = BaseTerm.get_decompress_buffer()
-            old_key = buf.record(key)
-            if old_key != buf.empty:
-                cache.delete(old_key)
-        return tree
+        }))
+        return get_or_set_single_flight(key, lambda: BaseTerm.decompress(value=value, fix_it=fix_it),
+                                        BaseTerm.DECOMPRESS_CACHE_TIMEOUT, on_cache_set=generation.record)
+
+    @staticmethod
+    def get_children_generation():
+        """
+        RUS: Возвращает поколение ключей кэша детей.
+        """
+        return CacheGeneration.factory(BaseTerm.CHILDREN_BUFFER_CACHE_KEY,
+                                       max_size=BaseTerm.CHILDREN_BUFFER_CACHE_SIZE)
 
     @staticmethod
     def get_children_buffer():
         """
-        RUS: Собирает буфер детей с ключом кэша и ограничением максимального размера.
+        RUS: Устаревший синоним `get_children_generation`, возвращает поколение, совместимое с кольцевым буфером.
         """
-        return RingBuffer.factory(BaseTerm.CHILDREN_BUFFER_CACHE_KEY,
-                                  max_size=BaseTerm.CHILDREN_BUFFER_CACHE_SIZE)
+        warn_deprecated_buffer('get_children_buffer', 'get_children_generation')
+        return BaseTerm.get_children_generation()
 
     @staticmethod
     def clear_children_buffer():
         """
-        RUS: Очищает буфер детей, удаляет кэш по ключам.
+        RUS: Очищает кэш детей сменой поколения ключей.
         """
-        buf = BaseTerm.get_children_buffer()
-        keys = buf.get_all()
-        buf.clear()
-        cache.delete_many(keys)
+        BaseTerm.get_children_generation().incr()
+
+    @staticmethod
+    def get_attribute_ancestors_generation():
+        """
+        RUS: Возвращает поколение ключей кэша предков-атрибутов.
+        """
+        return CacheGeneration.factory(BaseTerm.ATTRIBUTE_ANCESTORS_BUFFER_CACHE_KEY,
+                                       max_size=BaseTerm.ATTRIBUTE_ANCESTORS_BUFFER_CACHE_SIZE)
 
     @staticmethod
     def get_attribute_ancestors_buffer():
         """
-        RUS: Собирает буфер предков с ключом кэша и ограничением максимального размера.
+        RUS: Устаревший синоним `get_attribute_ancestors_generation`, возвращает поколение, совместимое с кольцевым буфером.
         """
-        return RingBuffer.factory(BaseTerm.ATTRIBUTE_ANCESTORS_BUFFER_CACHE_KEY,
-                                  max_size=BaseTerm.ATTRIBUTE_ANCESTORS_BUFFER_CACHE_SIZE)
+        warn_deprecated_buffer('get_attribute_ancestors_buffer', 'get_attribute_ancestors_generation')
+        return BaseTerm.get_attribute_ancestors_generation()
 
     @staticmethod
     def clear_attribute_ancestors_buffer():
         """
-        RUS: Очищает буфер атрибутов предков, удаляет кэш по ключам.
+        RUS: Очищает кэш предков-атрибутов сменой поколения ключей.
+        """
+        BaseTerm.get_attribute_ancestors_generation().incr()
+
+    @staticmethod
+    def get_tree_generation():
+        """
+        RUS: Возвращает поколение дерева терминов, меняется при любом изменении терминов.
+        Используется для формирования ETag ответов REST интерфейса.
+        """
+        return CacheGeneration.factory(BaseTerm.TREE_GENERATION_CACHE_KEY)
+
+    @staticmethod
+    def get_leaf_ids_generation():
+        """
+        RUS: Возвращает поколение ключей кэша id активных терминов поддеревьев.
         """
-        buf = BaseTerm.get_attribute_ancestors_buffer()
-        keys = buf.get_all()
-        buf.clear()
-        cache.delete_many(keys)
+        return CacheGeneration.factory(BaseTerm.LEAF_IDS_BUFFER_CACHE_KEY,
+                                       max_size=BaseTerm.LEAF_IDS_BUFFER_CACHE_SIZE)
 
     @staticmethod
-    def get_all_active_characteristics_descendants_ids():
+    def clear_leaf_ids_buffer():
+        """
+        RUS: Очищает кэш id активных терминов поддеревьев сменой поколения ключей.
+        """
+        BaseTerm.get_leaf_ids_generation().incr()
+
+    def get_leaf_ids(self):
+        """
+        RUS: Возвращает список id активных терминов поддерева, включая сам термин.
+        Поддерево вычисляется по снимку леса, без снимка - кэшируется компактным массивом
+        под ключом текущего поколения, при построении фильтров база данных не запрашивается.
+        """
+        if not self.active or self.pk is None or self.is_leaf_node():
+            return super(BaseTerm, self).get_leaf_ids()
+        snapshot = get_forest_snapshot(self.__class__)
+        if snapshot is not None and self.pk in snapshot:
+            return snapshot.get_descendants_ids(self.pk, include_self=True, active_only=True)
+        generation = BaseTerm.get_leaf_ids_generation()
+        key = generation.make_key(BaseTerm.LEAF_IDS_CACHE_KEY_PATTERN.format(id=self.pk))
+        ids = get_or_set_single_flight(key, lambda: array(str('q'), super(BaseTerm, self).get_leaf_ids()),
+                                       BaseTerm.LEAF_IDS_CACHE_TIMEOUT, on_cache_set=generation.record)
+        return list(ids)
+
+    @staticmethod
+    def get_all_active_characteristics_descendants_ids(use_cache=True):
         """
         RUS: Получает кэшированные id всех характеристик потомков со статусом активен.
         """
-        key = BaseTerm.ALL_ACTIVE_CHARACTERISTICS_DESCENDANTS_IDS_CACHE_KEY
-        descendants_ids = cache.get(key, None)
-        if descendants_ids is None:
+        def compute():
             characteristics_queryset = TermModel.objects.active().filter(
                 attributes=TermModel.attributes.is_characteristic)
             if characteristics_queryset:
-                descendants_ids = list(get_queryset_descendants(
+                return list(get_queryset_descendants(
                     characteristics_queryset).active().order_by().values_list('id', flat=True).distinct())
-            else:
-                descendants_ids = []
-            cache.set(key, descendants_ids, BaseTerm.ALL_ATTRIBUTE_DESCENDANTS_IDS_CACHE_TIMEOUT)
-        return descendants_ids
+            return []
+
+        if not use_cache:
+            return compute()
+        return get_or_set_single_flight(BaseTerm.ALL_ACTIVE_CHARACTERISTICS_DESCENDANTS_IDS_CACHE_KEY, compute,
+                                        BaseTerm.ALL_ATTRIBUTE_DESCENDANTS_IDS_CACHE_TIMEOUT)
 
     @staticmethod
-    def get_all_active_marks_descendants_ids():
+    def get_all_active_marks_descendants_ids(use_cache=True):
         """
         RUS: Получает кэшированные id всех меток потомков со статусом активен.
         """
-        key = BaseTerm.ALL_ACTIVE_MARKS_DESCENDANTS_IDS_CACHE_KEY
-        descendants_ids = cache.get(key, None)
-        if descendants_ids is None:
+        def compute():
             marks_queryset = TermModel.objects.active().filter(attributes=TermModel.attributes.is_mark)
             if marks_queryset:
-                descendants_ids = list(get_queryset_descendants(
+                return list(get_queryset_descendants(
                     marks_queryset).active().order_by().values_list('id', flat=True).distinct())
-            else:
-                descendants_ids = []
-            cache.set(key, descendants_ids, BaseTerm.ALL_ATTRIBUTE_DESCENDANTS_IDS_CACHE_TIMEOUT)
-        return descendants_ids
+            return []
+
+        if not use_cache:
+            return compute()
+        return get_or_set_single_flight(BaseTerm.ALL_ACTIVE_MARKS_DESCENDANTS_IDS_CACHE_KEY, compute,
+                                        BaseTerm.ALL_ATTRIBUTE_DESCENDANTS_IDS_CACHE_TIMEOUT)
 
     @staticmethod
     def get_all_active_root_ids(use_cache=True):
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+import os
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.six.moves import cPickle as pickle
+
+from .. import settings as edw_settings
+from ..utils.bitmap import make_bitmap, intersects, intersection_len
+
+
+logger = logging.getLogger(__name__)
+
+
+# ==============================================================================
+# EntityTermsIndex
+# ==============================================================================
+class EntityTermsIndex(object):
+    """
+    ENG: Inverted index term id -> bitmap of entities ids.
+    RUS: Инвертированный индекс "id термина -> битовая карта id объектов".
+    Строится командой `build_entity_terms_index` и хранится в памяти процесса.
+    Изменения связей объектов с терминами записываются в журнал в глобальном кэше после фиксации транзакции,
+    каждый процесс применяет их к своей копии индекса. Если журнал потерян,
+    индекс считается недостоверным и не используется до перезагрузки.
+    """
+    FIELD_NAME = 'terms'
+
+    SEQUENCE_CACHE_KEY = 'e_t_idx:seq'
+    JOURNAL_CACHE_KEY_PATTERN = 'e_t_idx:j:{seq}'
+
+    ADD = 'add'
+    REMOVE = 'remove'
+
+    RETRY_TIMEOUT = 60
+
+    _instance = None
+    _retry_after = 0
+    _lock = threading.RLock()
+
+    def __init__(self, terms, seq):
+        self.terms = terms
+        self.seq = seq
+        # номер первой отсутствующей записи журнала и время ее обнаружения
+        self._gap = None
+
+    @staticmethod
+    def is_enabled():
+        return edw_settings.ENTITY_TERMS_INDEX['enabled']
+
+    # Journal
+    @classmethod
+    def get_sequence(cls):
+        seq = cache.get(cls.SEQUENCE_CACHE_KEY, None)
+        if seq is None:
+            cache.add(cls.SEQUENCE_CACHE_KEY, 0, None)
+            seq = cache.get(cls.SEQUENCE_CACHE_KEY, 0)
+        return seq
+
+    @classmethod
+    def record(cls, op, entity_ids, term_ids):
+        """
+        RUS: Записывает изменение связей объектов с терминами в журнал после фиксации транзакции,
+        при откате транзакции запись не производится. Процессы применяют журнал к своим индексам
+        при следующем обращении.
+        """
+        if not cls.is_enabled():
+            return
+        entity_ids, term_ids = list(entity_ids), list(term_ids)
+        if not entity_ids or not term_ids:
+            return
+        transaction.on_commit(lambda: cls._write(op, entity_ids, term_ids))
+
+    @classmethod
+    def _write(cls, op, entity_ids, term_ids):
+        """
+        RUS: Публикует номер записи и записывает ее в журнал. Между увеличением счетчика и записью
+        читатели могут не найти запись, поэтому sync ожидает ее в течение 'journal_write_timeout'.
+        """
+        try:
+            seq = cache.incr(cls.SEQUENCE_CACHE_KEY)
+        except ValueError:
+            # счетчик потерян, журнал недостоверен
+            cache.add(cls.SEQUENCE_CACHE_KEY, 0, None)
+            seq = cache.incr(cls.SEQUENCE_CACHE_KEY)
+        cache.set(cls.JOURNAL_CACHE_KEY_PATTERN.format(seq=seq), (op, entity_ids, term_ids),
+                  edw_settings.ENTITY_TERMS_INDEX['journal_timeout'])
+
+    def apply(self, op, entity_ids, term_ids):
+        """
+        RUS: Применяет изменение к индексу.
+        """
+        terms = self.terms
+        if op == self.ADD:
+            for term_id in term_ids:
+                bitmap = terms.get(term_id, None)
+                if bitmap is None:
+                    bitmap = terms[term_id] = make_bitmap()
+                bitmap.update(entity_ids)
+        else:
+            for term_id in term_ids:
+                bitmap = terms.get(term_id, None)
+                if bitmap is not None:
+                    bitmap.difference_update(entity_ids)
+
+    def sync(self):
+        """
+        RUS: Применяет к индексу записи журнала. Возвращает False, если журнал неполон.
+        Записи применяются по порядку до первой отсутствующей. Отсутствующая запись может быть
+        еще не записана, журнал считается неполным, если она не появилась за 'journal_write_timeout' секунд.
+        """
+        options = edw_settings.ENTITY_TERMS_INDEX
+        seq = self.get_sequence()
+        if seq == self.seq:
+            return True
+        if seq < self.seq or seq - self.seq > options['max_journal_lag']:
+            return False
+        keys = [(i, self.JOURNAL_CACHE_KEY_PATTERN.format(seq=i)) for i in range(self.seq + 1, seq + 1)]
+        entries = cache.get_many([key for i, key in keys])
+        for i, key in keys:
+            entry = entries.get(key, None)
+            if entry is None:
+                now = time.time()
+                if self._gap is None or self._gap[0] != i:
+                    self._gap = (i, now)
+                return now - self._gap[1] < options['journal_write_timeout']
+            self.apply(*entry)
+            self.seq = i
+        self._gap = None
+        return True
+
+    # Build & persistence
+    @classmethod
+    def build(cls):
+        """
+        RUS: Строит индекс по промежуточной таблице связи объектов с терминами.
+        """
+        from .entity import EntityModel
+
+        seq = cls.get_sequence()
+        through = EntityModel.terms.through
+        field = EntityModel._meta.get_field(cls.FIELD_NAME)
+        entity_field, term_field = field.m2m_field_name(), field.m2m_reverse_field_name()
+
+        values = {}
+        for entity_id, term_id in through.objects.order_by().values_list(
+                '{}_id'.format(entity_field), '{}_id'.format(term_field)).iterator():
+            ids = values.get(term_id, None)
+            if ids is None:
+                ids = values[term_id] = []
+            ids.append(entity_id)
+        terms = dict((term_id, make_bitmap(ids)) for term_id, ids in values.items())
+        return cls(terms, seq)
+
+    def save(self, path):
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((self.seq, self.terms), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            seq, terms = pickle.load(f)
+        return cls(terms, seq)
+
+    @classmethod
+    def get(cls):
+        """
+        RUS: Возвращает синхронизированный с журналом индекс процесса или None, если индекс недоступен.
+        """
+        if not cls.is_enabled():
+            return None
+        options = edw_settings.ENTITY_TERMS_INDEX
+        with cls._lock:
+            index = cls._instance
+            if index is None:
+                if time.time() < cls._retry_after:
+                    return None
+                path = options['path']
+                if path and os.path.exists(path):
+                    index = cls.load(path)
+                elif options['build_on_demand']:
+                    index = cls.build()
+                else:
+                    cls._retry_after = time.time() + cls.RETRY_TIMEOUT
+                    return None
+            if not index.sync():
+                logger.warning("Entity terms index journal is incomplete, index disabled until rebuild")
+                cls._instance = None
+                cls._retry_after = time.time() + cls.RETRY_TIMEOUT
+                return None
+            cls._instance = index
+        return index
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._instance = None
+            cls._retry_after = 0
+
+    # Queries
+    @staticmethod
+    def get_max_ids(connection, max_ids=None):
+        """
+        RUS: Возвращает максимальное количество id объектов, передаваемых в запрос через индекс,
+        с учетом ограничения СУБД на количество параметров запроса (например, SQLite).
+        """
+        if max_ids is None:
+            max_ids = edw_settings.ENTITY_TERMS_INDEX['max_ids']
+        max_query_params = getattr(connection.features, 'max_query_params', None)
+        if max_query_params:
+            # оставляем половину параметров остальным условиям запроса
+            max_ids = min(max_ids, max_query_params // 2)
+        return max_ids
+
+    @staticmethod
+    def get_entities_ids(entities_qs, max_ids):
+        """
+        RUS: Возвращает список id объектов выборки или None, если объектов больше max_ids,
+        из базы данных выбирается не более max_ids + 1 id.
+        """
+        ids = list(entities_qs.order_by().values_list('id', flat=True)[:max_ids + 1])
+        return ids if len(ids) <= max_ids else None
+
+    def union(self, term_ids):
+        """
+        RUS: Возвращает битовую карту объектов, связанных хотя бы с одним из терминов.
+        """
+        result = make_bitmap()
+        for term_id in term_ids:
+            bitmap = self.terms.get(term_id, None)
+            if bitmap is not None:
+                result |= bitmap
+        return result
+
+    def get_related_terms_ids(self, entities_ids, candidate_ids):
+        """
+        RUS: Возвращает id терминов из списка кандидатов, связанных хотя бы с одним из объектов.
+        """
+        entities = make_bitmap(entities_ids)
+        terms = self.terms
+        return [pk for pk in candidate_ids if pk in terms and intersects(terms[pk], entities)]
+
+    def get_terms_counts(self, term_ids, initial_ids, filter_ids):
+        """
+        RUS: Возвращает словарь {id термина: (количество объектов начальной выборки,
+        количество объектов отфильтрованной выборки)}, выборки считаются независимо друг от друга,
+        термины без объектов в обеих выборках пропускаются.
+        """
+        initial_entities, filter_entities = make_bitmap(initial_ids), make_bitmap(filter_ids)
+        counts = {}
+        for pk in term_ids:
+            bitmap = self.terms.get(pk, None)
+            if bitmap is not None:
+                total, filtered = intersection_len(bitmap, initial_entities), intersection_len(bitmap, filter_entities)
+                if total or filtered:
+                    counts[pk] = (total, filtered)
+        return counts
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import json
+
+from django.utils import six
+from django.utils.encoding import force_bytes, force_text
+
+from rest_framework.utils.encoders import JSONEncoder
+
+
+EXPORT_NDJSON = 'ndjson'
+EXPORT_CSV = 'csv'
+
+EXPORT_CONTENT_TYPES = {
+    EXPORT_NDJSON: 'application/x-ndjson; charset=utf-8',
+    EXPORT_CSV: 'text/csv; charset=utf-8',
+}
+
+
+def iterate_chunks(queryset, chunk_size):
+    """
+    Итератор порций объектов запроса, объекты выбираются курсором на стороне сервера
+    (`iterator`), в памяти находится не более одной порции
+    """
+    try:
+        iterator = queryset.iterator(chunk_size=chunk_size)
+    except TypeError:
+        # Django < 2.0, размер выборки курсора определяется СУБД
+        iterator = queryset.iterator()
+    chunk = []
+    for obj in iterator:
+        chunk.append(obj)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Echo(object):
+    """
+    Псевдо-буфер для `csv.writer`, возвращает записанную строку вместо ее сохранения
+    """
+    def write(self, value):
+        return value
+
+
+def _flatten_value(value):
+    """
+    Значение ячейки CSV: списки характеристик и меток - "название: значение, значение; ...",
+    прочие списки - через запятую, словари - JSON
+    """
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        items = []
+        for item in value:
+            if isinstance(item, dict) and 'name' in item and 'values' in item:
+                items.append('{}: {}'.format(item['name'], ', '.join(force_text(x) for x in item['values'])))
+            else:
+                items.append(_flatten_value(item))
+        return '; '.join(items) if items and isinstance(value[0], dict) else ', '.join(items)
+    if isinstance(value, dict):
+        return json.dumps(value, cls=JSONEncoder, ensure_ascii=False)
+    return force_text(value)
+
+
+def render_ndjson(rows):
+    """
+    Строки NDJSON (JSON объект на строку)
+    """
+    for row in rows:
+        yield json.dumps(row, cls=JSONEncoder, ensure_ascii=False) + '\n'
+
+
+def render_csv(rows):
+    """
+    Строки CSV, заголовок формируется по полям первой строки
+    """
+    writer = csv.writer(Echo())
+    fields = None
+    for row in rows:
+        if fields is None:
+            fields = list(row.keys())
+            yield _write_csv_row(writer, fields)
+        yield _write_csv_row(writer, [_flatten_value(row.get(x, None)) for x in fields])
+
+
+def _write_csv_row(writer, values):
+    if six.PY2:
+        # модуль csv Python 2 работает только с байтовыми строками
+        return writer.writerow([force_bytes(x) for x in values])
+    return writer.writerow(values)
+
+
+EXPORT_RENDERERS = {
+    EXPORT_NDJSON: render_ndjson,
+    EXPORT_CSV: render_csv,
+}
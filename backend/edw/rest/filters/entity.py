@@ -13,6 +13,7 @@ from django.apps import apps
 from django.db.models.expressions import BaseExpression
 from django.template import loader
 from django.utils import six
+from django.utils.encoding import force_text
 from django.utils.functional import cached_property
 from django.utils.module_loading import import_string
 from django.utils.translation import ugettext_lazy as _
@@ -28,6 +29,7 @@ from edw.models.rest import (
     DynamicFilterMixin,
     DynamicGroupByMixin
 )
+from edw.models.sql.semantic import SemanticFilterComplexityError
 from edw.models.term import TermModel
 from edw.rest.filters.decorators import get_from_underscore_or_data
 from edw.rest.filters.widgets import CSVWidget
@@ -263,8 +265,12 @@ class EntityFilter(BaseEntityFilter):
         selected = self.term_ids[:]
         selected.extend(self.data_mart_term_ids)
 
-        queryset = queryset.semantic_filter(selected, use_cached_decompress=self.use_cached_decompress, fix_it=False,
-                                            trim_ids=self.data_mart_term_ids if self.data_mart_term_ids else None)
+        try:
+            queryset = queryset.semantic_filter(selected, use_cached_decompress=self.use_cached_decompress,
+                                                fix_it=False,
+                                                trim_ids=self.data_mart_term_ids if self.data_mart_term_ids else None)
+        except SemanticFilterComplexityError as e:
+            raise serializers.ValidationError({'terms': [force_text(e)]})
         self.data['_terms_filter_meta'] = queryset.semantic_filter_meta
         return queryset
 
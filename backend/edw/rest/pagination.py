@@ -1,10 +1,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import datetime
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from collections import OrderedDict
 
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils import six
+from django.utils.encoding import force_bytes, force_text
+from django.utils.translation import ugettext_lazy as _
+
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from edw import settings as edw_settings
 from edw.utils.hash_helpers import get_data_mart_cookie_setting
@@ -20,18 +33,53 @@ def _get_count(queryset):
         return len(queryset)
 
 
+COUNT_EXACT = 'exact'
+COUNT_CACHED = 'cached'
+COUNT_ESTIMATE = 'estimate'
+COUNT_HAS_MORE = 'has_more'
+
+COUNT_STRATEGIES = (COUNT_EXACT, COUNT_CACHED, COUNT_ESTIMATE, COUNT_HAS_MORE)
+
+PAGINATION_OFFSET = 'offset'
+PAGINATION_CURSOR = 'cursor'
+
+PAGINATION_MODES = (PAGINATION_OFFSET, PAGINATION_CURSOR)
+
+
 class SetQueryset2NoneIfEmptyPaginationMixin(object):
     """
-    В случаи когда количесто элементов равно нулю, возвращаем пустой список без запроса к БД
+    В случаи когда количесто элементов равно нулю, возвращаем пустой список без запроса к БД.
+    Способ подсчета количества элементов определяется методом `get_count_strategy`:
+    'exact' - точный подсчет, 'cached' - точный подсчет с кэшированием (`queryset.cached_count`),
+    'estimate' - оценка количества при превышении порога `count_estimate_threshold`,
+    'has_more' - без подсчета, выбирается на один элемент больше лимита.
+    Если подсчет не точный, `count_is_exact` равен False, а `count` - оценка либо нижняя граница количества.
     """
+    count_strategy = None
+    count_is_exact = True
+    count_estimate_threshold = None
+
+    def get_count_strategy(self, request):
+        return None
+
     def paginate_queryset(self, queryset, request, view=None):
         self.limit = self.get_limit(request)
         if self.limit is None:
             return None
 
         self.offset = self.get_offset(request)
-        self.count = _get_count(queryset)
         self.request = request
+        self.count_strategy = self.get_count_strategy(request)
+
+        if self.count_strategy == COUNT_HAS_MORE:
+            result = list(queryset[self.offset:self.offset + self.limit + 1])
+            self.count = self.offset + len(result)
+            self.count_is_exact = len(result) <= self.limit
+            if self.count > self.limit and self.template is not None:
+                self.display_page_controls = True
+            return result[:self.limit]
+
+        self.count, self.count_is_exact = self.get_count(queryset)
 
         if not self.count:
             return []
@@ -40,6 +88,29 @@ class SetQueryset2NoneIfEmptyPaginationMixin(object):
             self.display_page_controls = True
         return list(queryset[self.offset:self.offset + self.limit])
 
+    def get_count(self, queryset):
+        """
+        Returns tuple (count, is exact) according to the count strategy
+        """
+        if self.count_strategy == COUNT_ESTIMATE and self.count_estimate_threshold is not None:
+            estimated_count = getattr(queryset, 'estimated_count', None)
+            estimate = estimated_count() if estimated_count is not None else None
+            if estimate is not None:
+                if estimate >= self.count_estimate_threshold:
+                    return estimate, False
+            else:
+                bounded_count = getattr(queryset, 'bounded_count', None)
+                if bounded_count is not None:
+                    # СУБД не оценивает количество, считаем не больше порога (и не меньше запрошенной страницы)
+                    bound = max(self.count_estimate_threshold, self.offset + self.limit) + 1
+                    count = bounded_count(bound)
+                    return count, count < bound
+        if self.count_strategy in (COUNT_CACHED, COUNT_ESTIMATE):
+            cached_count = getattr(queryset, 'cached_count', None)
+            if cached_count is not None:
+                return cached_count(), True
+        return _get_count(queryset), True
+
 
 class EDWLimitOffsetPagination(SetQueryset2NoneIfEmptyPaginationMixin, LimitOffsetPagination):
     """
@@ -54,14 +125,20 @@ class EDWLimitOffsetPagination(SetQueryset2NoneIfEmptyPaginationMixin, LimitOffs
         ENG: Method is passed the serialized page data and should return a Response instance
         RUS: Передаются сериализованные страницы и возвращает пользвательский стиль нумерации страниц
         """
-        return Response(OrderedDict([
-            ('count', self.count),
+        items = [('count', self.count)]
+        if self.count_strategy is not None:
+            items.extend([
+                ('count_strategy', self.count_strategy),
+                ('count_is_exact', self.count_is_exact)
+            ])
+        items.extend([
             ('limit', self.limit),
             ('offset', self.offset),
             ('next', self.get_next_link()),
             ('previous', self.get_previous_link()),
             ('results', data)
-        ]))
+        ])
+        return Response(OrderedDict(items))
 
 
 class DataMartPagination(EDWLimitOffsetPagination):
@@ -86,6 +163,22 @@ class EntityPagination(EDWLimitOffsetPagination):
     """
     default_limit = edw_settings.REST_PAGINATION['entity_default_limit']
     max_limit = edw_settings.REST_PAGINATION['entity_max_limit']
+    count_estimate_threshold = edw_settings.REST_PAGINATION['entity_count_estimate_threshold']
+    count_strategy_query_param = 'count_strategy'
+
+    def get_count_strategy(self, request):
+        """
+        Возвращает способ подсчета количества объектов: из параметра запроса, настроек витрины данных
+        либо способ по умолчанию
+        """
+        strategy = request.query_params.get(self.count_strategy_query_param, None)
+        if strategy not in COUNT_STRATEGIES:
+            data_mart = request.GET.get('_data_mart', None)
+            strategy = edw_settings.REST_PAGINATION['entity_count_strategy_by_data_mart'].get(
+                data_mart.slug, None) if data_mart is not None else None
+            if strategy is None:
+                strategy = edw_settings.REST_PAGINATION['entity_count_strategy']
+        return strategy
 
     def get_limit(self, request):
         """
@@ -94,3 +187,194 @@ class EntityPagination(EDWLimitOffsetPagination):
         limit = get_data_mart_cookie_setting(request, "limit")
         limit = int(limit) if limit else super(EntityPagination, self).get_limit(request)
         return min(limit, self.max_limit)
+
+
+class _CursorJSONEncoder(DjangoJSONEncoder):
+    """
+    Кодирует дату и время с точностью до микросекунд, в отличие от `DjangoJSONEncoder`, иначе граничное
+    значение курсора усекается до миллисекунд и объекты с отброшенной частью пропускаются либо повторяются
+    """
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super(_CursorJSONEncoder, self).default(o)
+
+
+class EntityCursorPagination(EntityPagination):
+    """
+    Постраничная навигация объектов по ключу (keyset): следующая страница выбирается условием
+    "после последнего объекта текущей страницы" по полям сортировки, поэтому стоимость запроса
+    не зависит от глубины страницы. Курсор непрозрачен для клиента и содержит сортировку,
+    значения полей сортировки граничного объекта и направление выборки.
+    Поддерживается сортировка по полям модели и аннотациям (в т.ч. заданная `EntityOrderingFilter`),
+    к сортировке добавляется 'id' для однозначности. Если сортировка не поддерживается
+    (случайная, по связанным полям или выражениям), используется нумерация по смещению.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = _('Invalid cursor')
+    template = 'rest_framework/pagination/previous_and_next.html'
+
+    is_cursor = False
+    ordering = None
+    next_position = None
+    previous_position = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.request = request
+        self.ordering = self.get_keyset_ordering(queryset)
+        self.is_cursor = self.ordering is not None
+        if not self.is_cursor:
+            # шаблон нумерации по смещению
+            self.template = LimitOffsetPagination.template
+            return super(EntityCursorPagination, self).paginate_queryset(queryset, request, view)
+
+        position, reverse = self.decode_cursor(request)
+        ordering = [self._reverse_ordering(x) for x in self.ordering] if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            nulls_largest = connections[queryset.db].vendor in ('postgresql', 'oracle')
+            queryset = queryset.filter(self._get_keyset_filter(ordering, position, nulls_largest))
+
+        result = list(queryset[:self.limit + 1])
+        has_following = len(result) > self.limit
+        result = result[:self.limit]
+        if reverse:
+            result.reverse()
+
+        has_next, has_previous = (True, has_following) if reverse else (has_following, position is not None)
+        self.next_position = self._get_position(result[-1]) if has_next and result else None
+        self.previous_position = self._get_position(result[0]) if has_previous and result else None
+        if (self.next_position is not None or self.previous_position is not None) and self.template is not None:
+            self.display_page_controls = True
+        return result
+
+    def get_keyset_ordering(self, queryset):
+        """
+        Возвращает сортировку запроса с добавленным 'id' либо None, если сортировка не поддерживается
+        """
+        query = queryset.query
+        ordering = list(query.order_by) or (list(query.get_meta().ordering) if query.default_ordering else [])
+        result = []
+        for item in ordering:
+            if not isinstance(item, six.string_types):
+                return None
+            name = item.lstrip('-')
+            if name == 'pk':
+                name = 'id'
+            if name not in query.annotations:
+                try:
+                    field = query.get_meta().get_field(name)
+                except FieldDoesNotExist:
+                    return None
+                if not field.concrete or field.is_relation:
+                    return None
+            result.append('-' + name if item.startswith('-') else name)
+            if name == 'id':
+                break
+        else:
+            result.append('id')
+        return result
+
+    @staticmethod
+    def _reverse_ordering(item):
+        return item[1:] if item.startswith('-') else '-' + item
+
+    @staticmethod
+    def _get_keyset_filter(ordering, position, nulls_largest):
+        """
+        Возвращает условие выборки объектов, следующих за позицией при заданной сортировке.
+        NULL считается наибольшим значением для PostgreSQL и Oracle и наименьшим для остальных СУБД
+        """
+        result, equal = None, Q()
+        for item, value in zip(ordering, position):
+            name, desc = item.lstrip('-'), item.startswith('-')
+            nulls_last = nulls_largest != desc
+            if value is None:
+                following = None if nulls_last else Q(**{'{}__isnull'.format(name): False})
+                same = Q(**{'{}__isnull'.format(name): True})
+            else:
+                following = Q(**{'{}__{}'.format(name, 'lt' if desc else 'gt'): value})
+                if nulls_last:
+                    following |= Q(**{'{}__isnull'.format(name): True})
+                same = Q(**{name: value})
+            if following is not None:
+                following = equal & following
+                result = following if result is None else result | following
+            equal &= same
+        return result if result is not None else Q(pk__in=[])
+
+    def _get_position(self, obj):
+        return [obj.pk if x.lstrip('-') == 'id' else getattr(obj, x.lstrip('-')) for x in self.ordering]
+
+    def decode_cursor(self, request):
+        """
+        Возвращает позицию и направление выборки из курсора запроса, (None, False) - первая страница.
+        Курсор, полученный при другой сортировке, игнорируется
+        """
+        encoded = request.query_params.get(self.cursor_query_param, None)
+        if encoded is None:
+            return None, False
+        try:
+            ordering, position, reverse = json.loads(force_text(urlsafe_b64decode(force_bytes(encoded))))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if ordering != self.ordering or not isinstance(position, list) or len(position) != len(ordering):
+            return None, False
+        return position, bool(reverse)
+
+    def encode_cursor(self, position, reverse):
+        """
+        Возвращает ссылку на страницу с курсором
+        """
+        data = json.dumps([self.ordering, position, reverse], cls=_CursorJSONEncoder, separators=(',', ':'))
+        url = remove_query_param(self.request.build_absolute_uri(), self.offset_query_param)
+        return replace_query_param(url, self.cursor_query_param, force_text(urlsafe_b64encode(force_bytes(data))))
+
+    def get_next_link(self):
+        if not self.is_cursor:
+            return super(EntityCursorPagination, self).get_next_link()
+        return self.encode_cursor(self.next_position, False) if self.next_position is not None else None
+
+    def get_previous_link(self):
+        if not self.is_cursor:
+            return super(EntityCursorPagination, self).get_previous_link()
+        return self.encode_cursor(self.previous_position, True) if self.previous_position is not None else None
+
+    def get_paginated_response(self, data):
+        if not self.is_cursor:
+            return super(EntityCursorPagination, self).get_paginated_response(data)
+        return Response(OrderedDict([
+            ('limit', self.limit),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_html_context(self):
+        if not self.is_cursor:
+            return super(EntityCursorPagination, self).get_html_context()
+        return {
+            'previous_url': self.get_previous_link(),
+            'next_url': self.get_next_link()
+        }
+
+
+def get_entity_pagination_mode(request):
+    """
+    Возвращает способ нумерации страниц объектов: 'cursor', если в запросе передан курсор,
+    из параметра запроса 'pagination', настроек витрины данных либо способ по умолчанию
+    """
+    if EntityCursorPagination.cursor_query_param in request.query_params:
+        return PAGINATION_CURSOR
+    mode = request.query_params.get('pagination', None)
+    if mode not in PAGINATION_MODES:
+        data_mart = request.GET.get('_data_mart', None)
+        mode = edw_settings.REST_PAGINATION['entity_pagination_by_data_mart'].get(
+            data_mart.slug, None) if data_mart is not None else None
+        if mode is None:
+            mode = edw_settings.REST_PAGINATION['entity_pagination']
+    return mode
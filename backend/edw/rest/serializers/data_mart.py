@@ -3,7 +3,6 @@ from __future__ import unicode_literals
 
 from collections import OrderedDict
 
-from django.core.cache import cache
 from django.core.exceptions import (
     ValidationError,
     ObjectDoesNotExist,
@@ -11,20 +10,17 @@ from django.core.exceptions import (
     ImproperlyConfigured
 )
 from django.db import models
-from django.template import TemplateDoesNotExist
-from django.template.loader import select_template
 from django.utils import six
 from django.utils.functional import cached_property
-from django.utils.html import strip_spaces_between_tags
-from django.utils.safestring import mark_safe, SafeText
+from django.utils.safestring import mark_safe
 from django.utils.text import Truncator
-from django.utils.translation import get_language_from_request
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 from rest_framework.fields import empty
 from rest_framework_recursive.fields import RecursiveField
 
 from edw.utils.common import unicode_to_repr
+from edw.utils.cache_generation import warn_deprecated_buffer
 from edw import settings as edw_settings
 from edw.models.data_mart import DataMartModel
 from edw.models.rest import (
@@ -37,6 +33,7 @@ from edw.models.rest import (
     UpdateOrCreateSerializerMixin
 )
 from edw.rest.serializers.decorators import get_from_context_or_request
+from edw.rest.serializers.mixins import HTMLSnippetSerializerMixin, HTMLSnippetListSerializerMixin
 from rest_framework_bulk.serializers import BulkListSerializer, BulkSerializerMixin
 
 
@@ -79,6 +76,7 @@ class DataMartDynamicMetaMixin(object):
 # DataMartBulkListSerializer
 #==============================================================================
 class DataMartBulkListSerializer(DataMartDynamicMetaMixin,
+                                 HTMLSnippetListSerializerMixin,
                                  CheckPermissionsBulkListSerializerMixin,
                                  DynamicFieldsListSerializerMixin,
                                  DynamicCreateUpdateValidateListSerializerMixin,
@@ -87,6 +85,14 @@ class DataMartBulkListSerializer(DataMartDynamicMetaMixin,
     class Meta:
         model = None
 
+    def to_representation(self, data):
+        """
+        HTML фрагменты витрин данных списка выбираются из кэша одним запросом
+        """
+        iterable = list(data.all() if isinstance(data, models.Manager) else data)
+        self.prefetch_html_snippets(iterable)
+        return super(DataMartBulkListSerializer, self).to_representation(iterable)
+
 
 #==============================================================================
 # DataMartValidator
@@ -151,7 +157,8 @@ class DataMartValidator(object):
         ))
 
 
-class DataMartCommonSerializer(UpdateOrCreateSerializerMixin,
+class DataMartCommonSerializer(HTMLSnippetSerializerMixin,
+                               UpdateOrCreateSerializerMixin,
                                CheckPermissionsSerializerMixin,
                                BulkSerializerMixin,
                                serializers.ModelSerializer):
@@ -204,41 +211,10 @@ class DataMartCommonSerializer(UpdateOrCreateSerializerMixin,
 
     HTML_SNIPPET_CACHE_KEY_PATTERN = 'data_mart:{0}|{1}-{2}-{3}-{4}-{5}'
 
-    def render_html(self, data_mart, postfix):
-        """
-        Return a HTML snippet containing a rendered summary for this data mart.
-        Build a template search path with `postfix` distinction.
-        """
-        if not self.label:
-            msg = "The DataMart Serializer must be configured using a `label` field."
-            raise ImproperlyConfigured(msg)
-        app_label = data_mart._meta.app_label.lower()
-        request = self.context['request']
-        cache_key = self.HTML_SNIPPET_CACHE_KEY_PATTERN.format(data_mart.id, app_label, self.label,
-                                                               data_mart.data_mart_model,
-                                                               postfix, get_language_from_request(request))
-        content = cache.get(cache_key)
-        if content:
-            return mark_safe(content)
-        params = [
-            (app_label, self.label, data_mart.data_mart_model, postfix),
-            (app_label, self.label, 'data_mart', postfix),
-            ('edw', self.label, 'data_mart', postfix),
-        ]
-        try:
-            template = select_template(['{0}/data_marts/{1}-{2}-{3}.html'.format(*p) for p in params])
-        except TemplateDoesNotExist:
-            return SafeText("<!-- no such template: `{0}/data_marts/{1}-{2}-{3}.html` -->".format(*params[0]))
-        # when rendering emails, we require an absolute URI, so that media can be accessed from
-        # the mail client
-        absolute_base_uri = request.build_absolute_uri('/').rstrip('/')
-        context = {
-            'data_mart': data_mart,
-            'ABSOLUTE_BASE_URI': absolute_base_uri
-        }
-        content = strip_spaces_between_tags(template.render(context, request).strip())
-        cache.set(cache_key, content, edw_settings.CACHE_DURATIONS['data_mart_html_snippet'])
-        return mark_safe(content)
+    html_snippet_name = 'data_mart'
+    html_snippet_templates_dir = 'data_marts'
+    html_snippet_model_attr = 'data_mart_model'
+    html_snippet_cache_duration = 'data_mart_html_snippet'
 
     def get_data_mart_url(self, instance):
         return instance.get_absolute_url(request=self.context.get('request'), format=self.context.get('format'))
@@ -442,14 +418,15 @@ class _DataMartFilterMixin(object):
 
     @staticmethod
     def on_cache_set(key):
-        buf = DataMartModel.get_children_buffer()
-        old_key = buf.record(key)
-        if old_key != buf.empty:
-            cache.delete(old_key)
+        """
+        Deprecated, record the key in the children cache generation
+        """
+        warn_deprecated_buffer('on_cache_set', 'DataMartModel.get_children_generation().record')
+        DataMartModel.get_children_generation().record(key)
 
     def prepare_data(self, data):
         if self.cached:
-            return data.cache(on_cache_set=_DataMartFilterMixin.on_cache_set,
+            return data.cache(generation=DataMartModel.get_children_generation(),
                               timeout=DataMartModel.CHILDREN_CACHE_TIMEOUT)
         else:
             return list(data)
@@ -475,7 +452,7 @@ class DataMartTreeListField(_DataMartFilterMixin, serializers.ListField):
         return self.parent._depth
 
 
-class _DataMartTreeRootSerializer(_DataMartFilterMixin, serializers.ListSerializer):
+class _DataMartTreeRootSerializer(_DataMartFilterMixin, HTMLSnippetListSerializerMixin, serializers.ListSerializer):
     """
     Data Mart Tree Root Serializer
     """
@@ -483,6 +460,11 @@ class _DataMartTreeRootSerializer(_DataMartFilterMixin, serializers.ListSerializ
     def depth(self):
         return 0
 
+    def prepare_data(self, data):
+        data_marts = super(_DataMartTreeRootSerializer, self).prepare_data(data)
+        self.prefetch_html_snippets(data_marts)
+        return data_marts
+
 
 class DataMartTreeSerializer(DataMartTreeSerializerBase):
     """
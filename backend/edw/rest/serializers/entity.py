@@ -3,7 +3,6 @@ from __future__ import unicode_literals
 
 from collections import OrderedDict
 from django.apps import apps
-from django.core.cache import cache
 from django.core.exceptions import (
     ValidationError,
     ObjectDoesNotExist,
@@ -15,22 +14,21 @@ from django.db.models.expressions import BaseExpression
 from django.db.models.fields import NOT_PROVIDED
 from django.db.models.fields.related import RelatedField
 from django.db.models.fields.reverse_related import ForeignObjectRel
-from django.template import TemplateDoesNotExist
-from django.template.loader import select_template
 from django.utils import six
 from django.utils.functional import cached_property
-from django.utils.html import strip_spaces_between_tags
 from django.utils.module_loading import import_string
-from django.utils.safestring import mark_safe, SafeText
-from django.utils.translation import get_language_from_request
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 from rest_framework.reverse import reverse
 
-from edw import settings as edw_settings
 from edw.utils.common import unicode_to_repr
+from edw.utils.cache_generation import warn_deprecated_buffer
 from edw.models.data_mart import DataMartModel
-from edw.models.entity import EntityModel
+from edw.models.entity import (
+    EntityModel,
+    prefetch_characteristics_and_marks,
+    prefetch_groups_characteristics_and_marks
+)
 from edw.models.related import AdditionalEntityCharacteristicOrMarkModel
 from edw.models.rest import (
     DynamicFieldsSerializerMixin,
@@ -45,6 +43,7 @@ from edw.models.term import TermModel
 from edw.rest.filters.entity import EntityFilter
 from edw.rest.serializers.data_mart import DataMartCommonSerializer, DataMartDetailSerializer
 from edw.rest.serializers.decorators import empty
+from edw.rest.serializers.mixins import HTMLSnippetSerializerMixin, HTMLSnippetListSerializerMixin
 from edw.utils.set_helpers import uniq
 from rest_framework_bulk.serializers import BulkListSerializer, BulkSerializerMixin
 
@@ -148,6 +147,7 @@ class EntityDynamicMetaMixin(object):
 # EntityBulkListSerializer
 #==============================================================================
 class EntityBulkListSerializer(EntityDynamicMetaMixin,
+                               HTMLSnippetListSerializerMixin,
                                CheckPermissionsBulkListSerializerMixin,
                                DynamicFieldsListSerializerMixin,
                                DynamicCreateUpdateValidateListSerializerMixin,
@@ -156,6 +156,26 @@ class EntityBulkListSerializer(EntityDynamicMetaMixin,
     class Meta:
         model = None
 
+    def to_representation(self, data):
+        """
+        RUS: Вычисляет характеристики и метки всех сущностей списка пакетно, вместо запросов по каждой сущности.
+        HTML фрагменты сущностей списка выбираются из кэша одним запросом.
+        """
+        iterable = list(data.all() if isinstance(data, models.Manager) else data)
+        fields = getattr(self.child, 'fields', {})
+        if getattr(self.child, 'group_by', None):
+            # при группировке характеристики и метки берутся из групп сущностей
+            prefetch_groups = getattr(self.child, 'prefetch_groups', None)
+            if prefetch_groups is not None:
+                prefetch_groups(iterable)
+        else:
+            characteristics = 'characteristics' in fields or 'short_characteristics' in fields
+            marks = 'marks' in fields or 'short_marks' in fields
+            if characteristics or marks:
+                prefetch_characteristics_and_marks(iterable, characteristics=characteristics, marks=marks)
+        self.prefetch_html_snippets(iterable)
+        return super(EntityBulkListSerializer, self).to_representation(iterable)
+
 
 #==============================================================================
 # EntityValidator
@@ -341,7 +361,8 @@ class EntityValidator(object):
 #==============================================================================
 # EntityCommonSerializer
 #==============================================================================
-class EntityCommonSerializer(UpdateOrCreateSerializerMixin,
+class EntityCommonSerializer(HTMLSnippetSerializerMixin,
+                             UpdateOrCreateSerializerMixin,
                              CheckPermissionsSerializerMixin,
                              BulkSerializerMixin,
                              serializers.ModelSerializer):
@@ -370,43 +391,17 @@ class EntityCommonSerializer(UpdateOrCreateSerializerMixin,
 
     HTML_SNIPPET_CACHE_KEY_PATTERN = 'entity:{0}|{1}-{2}-{3}-{4}-{5}'
 
-    def render_html(self, entity, postfix):
-        """
-        Return a HTML snippet containing a rendered summary for this entity.
-        Build a template search path with `postfix` distinction.
-        """
-        if not self.label:
-            msg = "The Entity Serializer must be configured using a `label` field."
-            raise ImproperlyConfigured(msg)
-        app_label = entity._meta.app_label.lower()
-        request = self.context['request']
-        cache_key = self.HTML_SNIPPET_CACHE_KEY_PATTERN.format(entity.id, app_label, self.label, entity.entity_model,
-                                                            postfix, get_language_from_request(request))
-        content = cache.get(cache_key)
-        if content:
-            return mark_safe(content)
-        params = [
-            (app_label, self.label, entity.entity_model, postfix),
-            (app_label, self.label, 'entity', postfix),
-            ('edw', self.label, 'entity', postfix),
-        ]
-        try:
-            template = select_template(['{0}/entities/{1}-{2}-{3}.html'.format(*p) for p in params])
-        except TemplateDoesNotExist:
-            return SafeText("<!-- no such template: `{0}/entities/{1}-{2}-{3}.html` -->".format(*params[0]))
-        # when rendering emails, we require an absolute URI, so that media can be accessed from
-        # the mail client
-        absolute_base_uri = request.build_absolute_uri('/').rstrip('/')
-        context = {
-            'entity': entity,
-            'ABSOLUTE_BASE_URI': absolute_base_uri
-        }
+    html_snippet_name = 'entity'
+    html_snippet_templates_dir = 'entities'
+    html_snippet_model_attr = 'entity_model'
+    html_snippet_cache_duration = 'entity_html_snippet'
+
+    def get_html_snippet_context(self, entity):
+        context = super(EntityCommonSerializer, self).get_html_snippet_context(entity)
         data_mart = self.data_mart_from_request
         if data_mart is not None:
             context['data_mart'] = data_mart
-        content = strip_spaces_between_tags(template.render(context, request).strip())
-        cache.set(cache_key, content, edw_settings.CACHE_DURATIONS['entity_html_snippet'])
-        return mark_safe(content)
+        return context
 
     @cached_property
     def group_size_alias(self):
@@ -435,7 +430,7 @@ class EntityCommonSerializer(UpdateOrCreateSerializerMixin,
             else:
                 return []
         # Удаляем термины с ограничением на установку извне
-        return [key for key, value in tree.expand().items() if not value.term.system_flags.external_tagging_restriction]
+        return [key for key, value in tree.expand(copy_on_write=True).items() if not value.term.system_flags.external_tagging_restriction]
 
     @cached_property
     def data_mart_relations(self):
@@ -483,19 +478,26 @@ class SerializerRegistryMetaclass(serializers.SerializerMetaclass):
 entity_summary_serializer_class = None
 
 
-def _get_aggregation(queryset, aggregation_meta, root):
+def _get_aggregate_kwargs(aggregation_meta):
+    """
+    Выражения агрегации из метаданных агрегации
+    """
+    return dict([(key, value[0]) for key, value in aggregation_meta.items() if isinstance(value[0], BaseExpression)])
+
+
+def _get_aggregation(queryset, aggregation_meta, root, aggregation=None):
     """
     Процедура агрегации запроса
     :param queryset: Запрос (общий либо подзапрос `alike`)
     :param aggregation_meta: Метаданные агрегации
     :param root: Корень сериалайзера
+    :param aggregation: Заранее вычисленный словарь агрегации, если задан, запрос не выполняется
     :return:
     """
     if aggregation_meta:
         aggregation_meta_items = aggregation_meta.items()
-        aggregate_kwargs = dict([(key, value[0]) for key, value in aggregation_meta_items
-                                 if isinstance(value[0], BaseExpression)])
-        aggregation = queryset.aggregate(**aggregate_kwargs)
+        if aggregation is None:
+            aggregation = queryset.aggregate(**_get_aggregate_kwargs(aggregation_meta))
         result = OrderedDict()
         name_field = serializers.CharField()
         for key, (alias, field, name) in aggregation_meta_items:
@@ -543,6 +545,9 @@ class EntitySummarySerializerBase(six.with_metaclass(SerializerRegistryMetaclass
         kwargs.setdefault('label', 'summary')
         # init local cache for calculating attributes
         self.attributes_ancestors_local_cache = {}
+        # groups and aggregations of the page rows prepared by `prefetch_groups`
+        self._prefetched_groups = {}
+        self._prefetched_aggregations = {}
         super(EntitySummarySerializerBase, self).__init__(*args, **kwargs)
 
     def to_representation(self, data):
@@ -554,8 +559,11 @@ class EntitySummarySerializerBase(six.with_metaclass(SerializerRegistryMetaclass
         if self.group_by:
             group_size = getattr(data, self.group_size_alias, 0)
             if group_size > 1:
-                queryset = self.context['filter_queryset']
-                self._group_queryset = group_queryset = queryset.alike(data.id, *self.group_by)
+                group_queryset = self._prefetched_groups.get(data.id, None)
+                if group_queryset is None:
+                    queryset = self.context['filter_queryset']
+                    group_queryset = queryset.alike(data.id, *self.group_by)
+                self._group_queryset = group_queryset
                 # inject local cache to entities group
                 group_queryset.attributes_ancestors_local_cache = self.attributes_ancestors_local_cache
                 # patch short_characteristics & short_marks
@@ -570,6 +578,47 @@ class EntitySummarySerializerBase(six.with_metaclass(SerializerRegistryMetaclass
     def group_by(self):
         return self.context.get('group_by', [])
 
+    def prefetch_groups(self, entities):
+        """
+        Prepare groups of the page rows at once: group members, characteristics & marks and aggregation
+        are fetched by a few queries instead of `alike` queries for every row
+        """
+        group_size_alias = self.group_size_alias
+        characteristics, marks = 'short_characteristics' in self.fields, 'short_marks' in self.fields
+        pks, singles = [], []
+        for entity in entities:
+            if getattr(entity, group_size_alias, 0) > 1:
+                pks.append(entity.id)
+            else:
+                singles.append(entity)
+        if singles and (characteristics or marks):
+            prefetch_characteristics_and_marks(singles, characteristics=characteristics, marks=marks)
+        if not pks:
+            return
+        queryset = self.context['filter_queryset']
+        self._prefetched_groups = groups = queryset.alike_groups(pks, *self.group_by)
+        for group_queryset in groups.values():
+            # inject local cache to entities group
+            group_queryset.attributes_ancestors_local_cache = self.attributes_ancestors_local_cache
+        if characteristics or marks:
+            prefetch_groups_characteristics_and_marks(groups.values(), characteristics=characteristics, marks=marks)
+        aggregation_meta = self.context.get('aggregation_meta', None)
+        if aggregation_meta:
+            pks = list(groups.keys())
+            aggregations = queryset.aggregate_alike([groups[pk].alike_values for pk in pks],
+                                                    **_get_aggregate_kwargs(aggregation_meta))
+            self._prefetched_aggregations = dict(zip(pks, aggregations))
+
+    def prefetch_html_snippets(self, entities):
+        """
+        Group rows are skipped: their snippets depend on characteristics & marks of the group
+        patched by `to_representation`, so they are rendered at the row serialization
+        """
+        if self.group_by:
+            group_size_alias = self.group_size_alias
+            entities = [x for x in entities if getattr(x, group_size_alias, 0) <= 1]
+        super(EntitySummarySerializerBase, self).prefetch_html_snippets(entities)
+
     @cached_property
     def is_root(self):
         return self == self.root or (
@@ -592,7 +641,8 @@ class EntitySummarySerializerBase(six.with_metaclass(SerializerRegistryMetaclass
                 extra = {}
             extra[self.group_size_alias] = self._group_size
             extra.update(instance.get_group_extra(self.context))
-            group_aggregation = _get_aggregation(self._group_queryset, self.context['aggregation_meta'], self.root)
+            group_aggregation = _get_aggregation(self._group_queryset, self.context['aggregation_meta'], self.root,
+                                                 self._prefetched_aggregations.get(instance.id, None))
             if group_aggregation:
                 extra.update(group_aggregation)
             return extra
@@ -931,30 +981,53 @@ class EntitySummaryMetadataSerializer(serializers.Serializer):
     alike = serializers.SerializerMethodField()
     potential_terms_ids = serializers.SerializerMethodField()
     real_terms_ids = serializers.SerializerMethodField()
+    terms_counts = serializers.SerializerMethodField()
     extra = serializers.SerializerMethodField()
 
     @staticmethod
     def on_terms_ids_cache_set(key):
-        buf = EntityModel.get_terms_cache_buffer()
-        old_key = buf.record(key)
-        if old_key != buf.empty:
-            cache.delete(old_key)
+        """
+        Deprecated, record the key in the terms ids cache generation
+        """
+        warn_deprecated_buffer('on_terms_ids_cache_set', 'EntityModel.get_terms_cache_generation().record')
+        EntityModel.get_terms_cache_generation().record(key)
+
+    def _get_cached_terms_counts(self, instance):
+        """
+        RUS: Возвращает количества объектов по терминам для начальной и отфильтрованной выборок,
+        вычисляемые за один проход.
+        """
+        terms_counts = getattr(self, '_cached_terms_counts', None)
+        if terms_counts is None:
+            initial_queryset = self.context['initial_queryset']
+            terms_counts = self._cached_terms_counts = initial_queryset.get_terms_counts(
+                self.context['initial_filter_meta'], self.context['filter_queryset'],
+                self.context['terms_filter_meta']
+            ).cache(generation=EntityModel.get_terms_cache_journaled_generation(),
+                    timeout=EntityModel.TERMS_IDS_CACHE_TIMEOUT,
+                    journal=EntityModel.get_terms_cache_journal(),
+                    dependencies=lambda: EntityModel.get_terms_cache_dependencies(
+                        (self.context['initial_filter_meta'], self.context['terms_filter_meta']),
+                        self.context['data_mart']))
+        return terms_counts
 
     def get_potential_terms_ids(self, instance):
-        tree = self.context['initial_filter_meta']
-        initial_queryset = self.context['initial_queryset']
-        return initial_queryset.get_terms_ids(tree).cache(on_cache_set=self.on_terms_ids_cache_set,
-                                                          timeout=EntityModel.TERMS_IDS_CACHE_TIMEOUT)
+        return [pk for pk, total, filtered in self._get_cached_terms_counts(instance) if total is not None]
 
     def _get_cached_real_terms_ids(self, instance):
         real_terms_ids = getattr(self, '_cached_real_terms_ids', None)
         if real_terms_ids is None:
-            tree = self.context['terms_filter_meta']
-            filter_queryset = self.context['filter_queryset']
-            real_terms_ids = self._cached_real_terms_ids = filter_queryset.get_terms_ids(tree).cache(
-                on_cache_set=self.on_terms_ids_cache_set, timeout=EntityModel.TERMS_IDS_CACHE_TIMEOUT)
+            real_terms_ids = self._cached_real_terms_ids = [
+                pk for pk, total, filtered in self._get_cached_terms_counts(instance) if filtered is not None]
         return real_terms_ids
 
+    def get_terms_counts(self, instance):
+        """
+        RUS: Возвращает словарь {id термина: [количество объектов начальной выборки,
+        количество объектов отфильтрованной выборки]}.
+        """
+        return dict((pk, [total, filtered]) for pk, total, filtered in self._get_cached_terms_counts(instance))
+
     def get_terms_ids(self, instance):
         return self.context['terms_ids']
 
@@ -1008,6 +1081,23 @@ class EntitySummaryMetadataSerializer(serializers.Serializer):
             return None
 
 
+class EntityExportSerializer(EntityCommonSerializer):
+    """
+    Serialize entities for the bulk export: plain fields with characteristics & marks, without summary metadata.
+    Characteristics & marks are fetched for a chunk of entities at once by the list serializer.
+    """
+    entity_url = serializers.SerializerMethodField()
+    characteristics = AttributeSerializer(read_only=True, many=True)
+    marks = AttributeSerializer(read_only=True, many=True)
+
+    class Meta(EntityCommonSerializer.Meta):
+        fields = ('id', 'entity_name', 'entity_url', 'entity_model', 'active', 'created_at', 'updated_at',
+                  'characteristics', 'marks')
+
+    def get_entity_url(self, instance):
+        return instance.get_absolute_url(request=self.context.get('request'), format=self.context.get('format'))
+
+
 class EntityTotalSummarySerializer(serializers.Serializer):
     meta = EntitySummaryMetadataSerializer(source="*")
     objects = EntitySummarySerializer(source="*", many=True)
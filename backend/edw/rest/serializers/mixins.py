@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.template import TemplateDoesNotExist
+from django.template.loader import select_template
+from django.utils.html import strip_spaces_between_tags
+from django.utils.safestring import mark_safe, SafeText
+from django.utils.translation import get_language_from_request
+
+from edw import settings as edw_settings
+
+
+#==============================================================================
+# HTMLSnippetSerializerMixin
+#==============================================================================
+class HTMLSnippetSerializerMixin(object):
+    """
+    Render cached HTML snippets of the polymorphic objects (entities, data marts).
+    Snippets of the list page are fetched by `prefetch_html_snippets` at once: one `get_many` for all keys,
+    only misses are rendered and stored by one `set_many`.
+    """
+    # cache key pattern: id, app_label, label, object model, postfix, language
+    HTML_SNIPPET_CACHE_KEY_PATTERN = None
+    # serializer fields rendered by `render_html`: {field name: postfix}
+    HTML_SNIPPET_FIELDS = {
+        'media': 'media'
+    }
+
+    html_snippet_name = None
+    html_snippet_templates_dir = None
+    html_snippet_model_attr = None
+    html_snippet_cache_duration = None
+
+    def get_html_snippet_cache_key(self, obj, postfix):
+        return self.HTML_SNIPPET_CACHE_KEY_PATTERN.format(
+            obj.id, obj._meta.app_label.lower(), self.label, getattr(obj, self.html_snippet_model_attr), postfix,
+            get_language_from_request(self.context['request']))
+
+    def get_html_snippet_template(self, obj, postfix):
+        """
+        Return the template selected by the search path with `postfix` distinction or None,
+        template is resolved once for every object model, label and postfix
+        """
+        model = getattr(obj, self.html_snippet_model_attr)
+        key = (obj._meta.app_label.lower(), self.label, model, postfix)
+        templates = self.__dict__.setdefault('_html_snippet_templates', {})
+        if key not in templates:
+            try:
+                templates[key] = select_template(self._get_html_snippet_template_names(*key))
+            except TemplateDoesNotExist:
+                templates[key] = None
+        return templates[key]
+
+    def _get_html_snippet_template_names(self, app_label, label, model, postfix):
+        params = [
+            (app_label, label, model, postfix),
+            (app_label, label, self.html_snippet_name, postfix),
+            ('edw', label, self.html_snippet_name, postfix),
+        ]
+        return ['{0}/{1}/{2}-{3}-{4}.html'.format(p[0], self.html_snippet_templates_dir, *p[1:]) for p in params]
+
+    def get_html_snippet_context(self, obj):
+        # when rendering emails, we require an absolute URI, so that media can be accessed from
+        # the mail client
+        return {
+            self.html_snippet_name: obj,
+            'ABSOLUTE_BASE_URI': self.context['request'].build_absolute_uri('/').rstrip('/')
+        }
+
+    def _check_html_snippet_label(self):
+        if not self.label:
+            msg = "The {} must be configured using a `label` field."
+            raise ImproperlyConfigured(msg.format(self.__class__.__name__))
+
+    def _render_html_snippet(self, obj, postfix):
+        """
+        Return rendered content or None if no template found
+        """
+        template = self.get_html_snippet_template(obj, postfix)
+        if template is None:
+            return None
+        return strip_spaces_between_tags(
+            template.render(self.get_html_snippet_context(obj), self.context['request']).strip())
+
+    def _get_no_template_snippet(self, obj, postfix):
+        model = getattr(obj, self.html_snippet_model_attr)
+        return SafeText("<!-- no such template: `{}` -->".format(
+            self._get_html_snippet_template_names(obj._meta.app_label.lower(), self.label, model, postfix)[0]))
+
+    def render_html(self, obj, postfix):
+        """
+        Return a HTML snippet containing a rendered summary for this object.
+        Build a template search path with `postfix` distinction.
+        """
+        self._check_html_snippet_label()
+        cache_key = self.get_html_snippet_cache_key(obj, postfix)
+        # snippets prepared by `prefetch_html_snippets` are kept by the serializer instance
+        prefetched = getattr(self, '_prefetched_html_snippets', None)
+        content = prefetched.get(cache_key, None) if prefetched else None
+        if content is None:
+            content = cache.get(cache_key)
+        if content:
+            return mark_safe(content)
+        content = self._render_html_snippet(obj, postfix)
+        if content is None:
+            return self._get_no_template_snippet(obj, postfix)
+        cache.set(cache_key, content, edw_settings.CACHE_DURATIONS[self.html_snippet_cache_duration])
+        return mark_safe(content)
+
+    def prefetch_html_snippets(self, objects):
+        """
+        Prepare HTML snippets of all objects of the list page for the serializer fields
+        listed in `HTML_SNIPPET_FIELDS`
+        """
+        postfixes = [postfix for name, postfix in self.HTML_SNIPPET_FIELDS.items() if name in self.fields]
+        objects = [x for x in objects if getattr(x, 'id', None) is not None]
+        if not postfixes or not objects:
+            return
+        self._check_html_snippet_label()
+        keys = dict(((obj.id, postfix), self.get_html_snippet_cache_key(obj, postfix))
+                    for obj in objects for postfix in postfixes)
+        snippets = cache.get_many(list(keys.values()))
+        missed = {}
+        for obj in objects:
+            for postfix in postfixes:
+                cache_key = keys[(obj.id, postfix)]
+                if not snippets.get(cache_key, None) and cache_key not in missed:
+                    content = self._render_html_snippet(obj, postfix)
+                    if content is not None:
+                        missed[cache_key] = content
+        if missed:
+            cache.set_many(missed, edw_settings.CACHE_DURATIONS[self.html_snippet_cache_duration])
+            snippets.update(missed)
+        self._prefetched_html_snippets = snippets
+
+
+#==============================================================================
+# HTMLSnippetListSerializerMixin
+#==============================================================================
+class HTMLSnippetListSerializerMixin(object):
+    """
+    Fetch HTML snippets of the list page at once before the items serialization
+    """
+    def prefetch_html_snippets(self, objects):
+        prefetch_html_snippets = getattr(self.child, 'prefetch_html_snippets', None)
+        if prefetch_html_snippets is not None:
+            prefetch_html_snippets(objects)
@@ -1,12 +1,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.core.cache import cache
 from django.core.exceptions import (
     ValidationError,
     ObjectDoesNotExist,
     MultipleObjectsReturned
 )
+from django.db.models import Q
 from django.utils.functional import cached_property
 from django.utils.safestring import mark_safe
 from django.utils.text import Truncator
@@ -17,7 +17,9 @@ from rest_framework.fields import empty
 from rest_framework_recursive.fields import RecursiveField
 
 from edw.utils.common import unicode_to_repr
+from edw.utils.cache_generation import warn_deprecated_buffer
 from edw.models.data_mart import DataMartModel
+from edw.models.mptt_info import get_descendants_ranges, get_queryset_by_ranges
 from edw.models.rest import (
     BasePermissionsSerializerMixin,
     CheckPermissionsBulkListSerializerMixin,
@@ -259,17 +261,25 @@ class _TermsFilterMixin(object):
 
     @staticmethod
     def on_cache_set(key):
-        buf = TermModel.get_children_buffer()
-        old_key = buf.record(key)
-        if old_key != buf.empty:
-            cache.delete(old_key)
+        """
+        Deprecated, record the key in the children cache generation
+        """
+        warn_deprecated_buffer('on_cache_set', 'TermModel.get_children_generation().record')
+        TermModel.get_children_generation().record(key)
 
     def prepare_data(self, data):
         if self.cached:
-            return data.cache(on_cache_set=_TermsFilterMixin.on_cache_set, timeout=TermModel.CHILDREN_CACHE_TIMEOUT)
+            return data.cache(generation=TermModel.get_children_generation(),
+                              timeout=TermModel.CHILDREN_CACHE_TIMEOUT)
         else:
             return list(data)
 
+    def prefetch_children(self, terms, selected_terms):
+        """
+        Hook for loading children of the whole subtree at once, see `_TermTreeRootSerializer`
+        """
+        pass
+
     def to_representation(self, data):
         next_depth = self.depth + 1
         if self.max_depth is not None and next_depth > self.max_depth:
@@ -277,7 +287,12 @@ class _TermsFilterMixin(object):
         else:
             selected_terms = self.get_selected_terms()
             if self.is_expanded_specification or selected_terms is not None:
-                terms = self.prepare_data(self.active_only_filter(data))
+                if isinstance(data, _PrefetchedChildren):
+                    # дети загружены одним запросом вместе со всем деревом
+                    terms = data
+                else:
+                    terms = self.prepare_data(self.active_only_filter(data))
+                    self.prefetch_children(terms, selected_terms)
                 for term in terms:
                     term._depth = next_depth
                     try:
@@ -289,10 +304,32 @@ class _TermsFilterMixin(object):
         return super(_TermsFilterMixin, self).to_representation(terms)
 
 
+class _PrefetchedChildren(list):
+    """
+    Children of the term loaded together with the whole tree
+    """
+
+
 class TermTreeListField(_TermsFilterMixin, serializers.ListField):
     """
     TermTreeListField
     """
+    @cached_property
+    def tree_root(self):
+        """
+        :return: nearest `_TermTreeRootSerializer` ancestor, the tree may be nested into another serializer
+        """
+        parent = self.parent
+        while parent is not None and not isinstance(parent, _TermTreeRootSerializer):
+            parent = parent.parent
+        return parent
+
+    def get_attribute(self, instance):
+        prefetched = getattr(self.tree_root, '_prefetched_children', None)
+        if prefetched is not None and instance.id in prefetched:
+            return prefetched[instance.id]
+        return super(TermTreeListField, self).get_attribute(instance)
+
     def get_selected_terms(self):
         term_info = self.parent._selected_term_info
         return None if term_info is None else term_info.get_children_dict()
@@ -348,6 +385,43 @@ class _TermTreeRootSerializer(_TermsFilterMixin, serializers.ListSerializer):
     def is_expanded_specification(self):
         return True
 
+    @cached_property
+    @get_from_context_or_request('prefetch', True)
+    def prefetch(self, value):
+        """
+        :return: `prefetch` value in context or request, if `True` the whole tree is loaded in one query, default: True
+        """
+        return serializers.BooleanField().to_internal_value(value)
+
+    def prefetch_children(self, terms, selected_terms):
+        """
+        RUS: Загружает детей всех узлов дерева одним запросом в порядке обхода MPTT.
+        Запрос ограничен глубиной `max_depth` и узлами, дети которых будут выведены: выбранными
+        или с развернутой спецификацией. Лишние узлы отбрасываются при обходе дерева сериалайзером.
+        """
+        if not self.prefetch or not terms:
+            return
+        selected_ids = []
+        for term_info in (selected_terms or {}).values():
+            selected_ids.append(term_info.term.id)
+            selected_ids.extend(term_info.get_descendants_ids())
+
+        queryset = get_queryset_by_ranges(TermModel, get_descendants_ranges(terms))
+        if self.max_depth is not None:
+            # глубина корневых узлов равна 1
+            queryset = queryset.filter(level__lte=max(x.level for x in terms) + self.max_depth - 1)
+        expanded = Q(parent__specification_mode=TermModel.EXPANDED_SPECIFICATION)
+        queryset = self.active_only_filter(queryset.filter(
+            expanded | Q(parent_id__in=selected_ids) if selected_ids else expanded))
+
+        # экземпляры корневых узлов могут разделяться через кэш процесса, поэтому дети хранятся в сериалайзере
+        prefetched = self._prefetched_children = dict((x.id, _PrefetchedChildren()) for x in terms)
+        for term in queryset:
+            prefetched[term.id] = _PrefetchedChildren()
+            parent_children = prefetched.get(term.parent_id, None)
+            if parent_children is not None:
+                parent_children.append(term)
+
     @cached_property
     @get_from_context_or_request('fix_it', None)
     def fix_it(self, value):
@@ -16,17 +16,6 @@ from rest_framework.settings import api_settings
 from rest_framework.renderers import JSONRenderer
 
 
-def _get_count(queryset):
-    """
-    ENG: Determine an object count, supporting either querysets or regular lists.
-    RUS: Возвращает количество объектов, поддерживающих запрос к базе данных с помощью метода .count() или len().
-    """
-    try:
-        return queryset.count()
-    except (AttributeError, TypeError):
-        return len(queryset)
-
-
 class Request(request.Request):
 
     def __init__(self, request, query_params=None, parsers=None, authenticators=None,
@@ -287,8 +276,9 @@ class BaseRetrieveDataTag(Tag):
         if self.paginator is None:
             return None
 
-        self._queryset_count = _get_count(queryset)
         page = self.paginator.paginate_queryset(queryset, self.request, view=self)
+        # количество уже подсчитано пагинатором выбранным способом
+        self._queryset_count = self.paginator.count
         self._page_len = len(page)
         return page
 
@@ -1,7 +1,25 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
 from functools import wraps
 
+from django.utils.encoding import force_bytes
+from django.utils.http import parse_etags, quote_etag, urlencode
+from rest_framework import status
+from rest_framework.response import Response
+
+from edw import settings as edw_settings
+
+
+def make_etag(prefix, query_params, generations):
+    """
+    ENG: Make ETag from the prefix (path, format), request query params and cache generations
+    RUS: Формирует ETag по префиксу (путь, формат), параметрам запроса и поколениям ключей кэша
+    """
+    params = sorted((k, v) for k in query_params for v in query_params.getlist(k))
+    value = '{}|{}|{}'.format(prefix, urlencode(params), ':'.join([str(x) for x in generations]))
+    return hashlib.md5(force_bytes(value)).hexdigest()
+
 
 def remove_empty_params_from_request(exclude=None):
     """
@@ -30,6 +48,40 @@ def remove_empty_params_from_request(exclude=None):
     return remove_empty_params_from_request_decorator
 
 
+def etag_conditional_response(get_generations):
+    """
+    ENG: Answer `304 Not Modified` without serialization if `If-None-Match` request header
+    matches ETag made from the request and cache generations returned by `get_generations`
+    RUS: Отвечает 304 без сериализации данных, если заголовок запроса `If-None-Match`
+    совпадает с ETag, сформированным по запросу и поколениям ключей кэша
+    """
+    def etag_conditional_response_decorator(func):
+        @wraps(func)
+        def func_wrapper(self, request, *args, **kwargs):
+            options = edw_settings.REST_CONDITIONAL
+            if not options['enabled'] or request.method not in ('GET', 'HEAD'):
+                return func(self, request, *args, **kwargs)
+
+            renderer = getattr(request, 'accepted_renderer', None)
+            prefix = '{}|{}'.format(request.path, renderer.format if renderer is not None else '')
+            etag = quote_etag(make_etag(prefix, request.query_params, get_generations()))
+
+            # слабое сравнение, префикс 'W/' игнорируется
+            etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+            etags = [x[2:] if x.startswith('W/') else x for x in etags]
+            if etag in etags or '*' in etags:
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = func(self, request, *args, **kwargs)
+            if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+                response['ETag'] = etag
+                if options['cache_control']:
+                    response['Cache-Control'] = options['cache_control']
+            return response
+        return func_wrapper
+    return etag_conditional_response_decorator
+
+
 class CustomSerializerViewSetMixin(object):
     """
     Сериалайзер для запросов
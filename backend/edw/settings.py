@@ -32,10 +32,13 @@ CACHE_DURATIONS = {
     'term_all_attribute_descendants_ids': 3600,
     'term_attribute_ancestors': 3600,
     'term_all_active_root_ids': 3600,
+    'term_leaf_ids': 3600,
 
     'entity_html_snippet': 86400,
     'entity_terms_ids': 3600,
+    'entity_semantic_filter_plan': 3600,
     'entity_data_mart': 3600,
+    'entity_count': 600,
     'entity_validate_term_model': 60,
     'entity_validate_data_mart_model': 60,
 
@@ -48,15 +51,55 @@ CACHE_BUFFERS_SIZES = {
     'term_decompress': 500,
     'term_children': 500,
     'term_attribute_ancestors': 2000,
+    'term_leaf_ids': 2000,
 
     'data_mart_children': 500,
 
     'entity_terms_ids': 500,
+    'entity_terms_ids_journal': 1000,
+    'entity_semantic_filter_plan': 500,
     'entity_data_mart': 500,
+    'entity_count': 1000,
 }
 CACHE_BUFFERS_SIZES.update(getattr(settings, 'EDW_CACHE_BUFFERS_SIZES', {}))
 
 
+CACHE_GENERATIONS = {
+    # ограничивать количество ключей семейства кэша размером CACHE_BUFFERS_SIZES (кольцевой буфер)
+    'bounded': False,
+}
+CACHE_GENERATIONS.update(getattr(settings, 'EDW_CACHE_GENERATIONS', {}))
+
+
+LOCAL_CACHE = {
+    # локальный для процесса LRU кэш перед глобальным кэшем для семейств ключей с поколениями
+    'enabled': True,
+    'max_size': 1000,
+    # время жизни записи в секундах
+    'ttl': 5,
+    # время в секундах, в течение которого номер поколения семейства берется из памяти процесса,
+    # ограничивает задержку инвалидации семейства в других процессах
+    'generation_ttl': 1,
+    # переопределение параметров по ключу семейства, например {'t_ch_bf': {'max_size': 5000}}
+    'families': {},
+}
+LOCAL_CACHE.update(getattr(settings, 'EDW_LOCAL_CACHE', {}))
+
+
+CACHE_SINGLE_FLIGHT = {
+    # при промахе кэша значение вычисляет только один процесс
+    'enabled': True,
+    # время жизни блокировки вычисления, секунды
+    'lock_timeout': 30,
+    # максимальное время ожидания значения, вычисляемого другим процессом, секунды
+    'wait_timeout': 5,
+    'wait_interval': 0.05,
+    # сколько секунд после истечения таймаута отдавать устаревшее значение, пока вычисляется новое
+    'stale_timeout': 60,
+}
+CACHE_SINGLE_FLIGHT.update(getattr(settings, 'EDW_CACHE_SINGLE_FLIGHT', {}))
+
+
 REST_PAGINATION = {
     'data_mart_default_limit': api_settings.PAGE_SIZE,
     'data_mart_max_limit': 500,
@@ -66,10 +109,44 @@ REST_PAGINATION = {
 
     'entity_default_limit': api_settings.PAGE_SIZE,
     'entity_max_limit': 500,
+    # способ подсчета количества объектов списка:
+    # 'exact' - точный подсчет, 'cached' - точный подсчет с кэшированием по хэшу запроса,
+    # 'estimate' - оценка планировщика СУБД (либо ограниченный подсчет) при превышении порога,
+    # 'has_more' - без подсчета, выбирается на одну строку больше лимита для определения следующей страницы
+    'entity_count_strategy': 'exact',
+    # способы подсчета для витрин данных, {slug витрины данных: способ}
+    'entity_count_strategy_by_data_mart': {},
+    # порог количества объектов, начиная с которого способ 'estimate' возвращает оценку
+    'entity_count_estimate_threshold': 10000,
+    # способ нумерации страниц объектов: 'offset' - по смещению, 'cursor' - по ключу (курсору),
+    # стоимость запроса страницы по курсору не зависит от ее глубины
+    'entity_pagination': 'offset',
+    # способы нумерации страниц для витрин данных, {slug витрины данных: способ}
+    'entity_pagination_by_data_mart': {},
 }
 REST_PAGINATION.update(getattr(settings, 'EDW_REST_PAGINATION', {}))
 
 
+REST_EXPORT = {
+    # размер порции объектов потоковой выгрузки, характеристики и метки порции вычисляются пакетно
+    'entity_chunk_size': 500,
+    # формат выгрузки по умолчанию: 'ndjson' либо 'csv'
+    'entity_default_format': 'ndjson',
+}
+REST_EXPORT.update(getattr(settings, 'EDW_REST_EXPORT', {}))
+
+
+REST_CONDITIONAL = {
+    # отвечать 304 Not Modified на запросы деревьев и списков терминов и витрин данных с актуальным ETag
+    'enabled': True,
+    # значение заголовка Cache-Control ответов с ETag, None - не устанавливать
+    'cache_control': 'private, no-cache',
+    # время кэширования (в секундах) данных тега шаблона `get_term_tree` по ETag
+    'template_tag_timeout': 3600,
+}
+REST_CONDITIONAL.update(getattr(settings, 'EDW_REST_CONDITIONAL', {}))
+
+
 REGISTRATION_PROCESS = {
     'registration_salt': 'registration',
     'do_activation': False,
@@ -78,12 +155,72 @@ REGISTRATION_PROCESS = {
 REGISTRATION_PROCESS.update(getattr(settings, 'EDW_REGISTRATION_PROCESS', {}))
 
 
+TERM_SNAPSHOT = {
+    # использовать снимок дерева терминов в памяти процесса
+    'enabled': True,
+    # интервал (в секундах) сверки версии снимка с глобальным кэшем
+    'version_check_interval': 1,
+    # максимальное время жизни снимка (в секундах)
+    'max_age': 3600,
+    # количество id в запросе терминов по снимку, при превышении которого
+    # вместо списка параметров IN используется соединение со списком VALUES; 0 - не использовать
+    'ids_join_threshold': 500
+}
+TERM_SNAPSHOT.update(getattr(settings, 'EDW_TERM_SNAPSHOT', {}))
+
+
+MPTT_DESCENDANTS = {
+    # количество интервалов (tree_id, lft) в запросе потомков, при превышении которого
+    # вместо цепочки OR используется соединение со списком VALUES; 0 - не использовать
+    'ranges_join_threshold': 100
+}
+MPTT_DESCENDANTS.update(getattr(settings, 'EDW_MPTT_DESCENDANTS', {}))
+
+
 SEMANTIC_FILTER = {
-    'filters_chunk_limit': 5
+    # способ построения запроса по факторизованному предикату дерева терминов:
+    # 'in' - по одному подзапросу IN на ветку дерева;
+    # 'intersect' - пересечение/объединение выборок из промежуточной таблицы (INTERSECT/UNION);
+    # 'group_by' - один проход по промежуточной таблице с GROUP BY ... HAVING;
+    # 'exists' - цепочка коррелированных подзапросов EXISTS;
+    # 'auto' - выбор стратегии по структуре предиката и типу СУБД
+    'strategy': 'auto',
+    # предельное количество подзапросов предиката, при превышении возбуждается SemanticFilterComplexityError
+    'max_predicates': 200
 }
 SEMANTIC_FILTER.update(getattr(settings, 'EDW_SEMANTIC_FILTER', {}))
 
 
+ENTITY_TERMS_INDEX = {
+    # использовать инвертированный индекс "термин -> битовая карта id объектов"
+    'enabled': False,
+    # путь к файлу индекса, строится командой `build_entity_terms_index`
+    'path': None,
+    # строить индекс в процессе при отсутствии файла
+    'build_on_demand': False,
+    # максимальное количество id объектов, передаваемых в запрос и выбираемых из базы для пересечения
+    # с индексом, при превышении используется SQL; ограничивается количеством параметров запроса СУБД
+    'max_ids': 10000,
+    # время жизни записей журнала изменений (в секундах)
+    'journal_timeout': 86400,
+    # максимальное количество неприменненных записей журнала, при превышении индекс перезагружается
+    'max_journal_lag': 10000,
+    # время ожидания (в секундах) записи журнала, номер которой уже опубликован
+    'journal_write_timeout': 10
+}
+ENTITY_TERMS_INDEX.update(getattr(settings, 'EDW_ENTITY_TERMS_INDEX', {}))
+
+
+ENTITY_ATTRIBUTES_PROJECTION = {
+    # использовать материализованные характеристики и метки объектов,
+    # действует только если модель EntityAttributesModel материализована в проекте
+    'enabled': True,
+    # количество объектов, пересчитываемых за один проход фоновой задачи
+    'chunk_size': 500
+}
+ENTITY_ATTRIBUTES_PROJECTION.update(getattr(settings, 'EDW_ENTITY_ATTRIBUTES_PROJECTION', {}))
+
+
 CLASSIFY = {
     # баланс между точностью и полнотой
     # принимает значения в диапазоне 0<β<1 если вы хотите отдать приоритет точности,
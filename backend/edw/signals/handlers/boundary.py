@@ -10,6 +10,7 @@ from edw.models.entity import EntityModel
 from edw.models.mixins.entity.place import PlaceMixin
 from edw.models.boundary import BoundaryModel
 from edw.signals import make_dispatch_uid
+from edw.signals.handlers.entity import replace_entities_term
 
 # ==============================================================================
 # Find Models with PlaceMixin
@@ -47,8 +48,7 @@ def on_pre_save_boundary(sender, instance, **kwargs):
                 boundary_term_id = instance.term.id
                 entities_ids = EntityModel.objects.instance_of(*_model_with_place_mixin).filter(
                     terms__id=origin_boundary_term_id).values_list('id', flat=True)
-                EntityModel.terms.through.objects.filter(
-                    entity_id__in=list(entities_ids), term_id=origin_boundary_term_id).update(term_id=boundary_term_id)
+                replace_entities_term(entities_ids, origin_boundary_term_id, boundary_term_id)
 
         clear_boundary_polygons_cache(instance)
 
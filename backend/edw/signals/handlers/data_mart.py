@@ -29,7 +29,7 @@ def get_children_keys(sender, parent_id):
         if parent_id is not None else
         "toplvl"
     ])
-    return [key, ":".join([key, "actv"])]
+    return sender.get_children_generation().make_keys([key, ":".join([key, "actv"])])
 
 
 def get_data_mart_all_active_terms_keys():
@@ -95,6 +95,7 @@ def invalidate_after_terms_set_changed(sender, instance, **kwargs):
         # clear cache
         keys = get_data_mart_all_active_terms_keys()
         cache.delete_many(keys)
+        DataMartModel.get_tree_generation().incr()  # Change data marts tree ETag
 
 
 def invalidate_data_mart_before_save(sender, instance, **kwargs):
@@ -106,8 +107,7 @@ def invalidate_data_mart_before_save(sender, instance, **kwargs):
                     DataMartModel.clear_children_buffer()  # Clear children buffer
                     instance._parent_id_validate = True
                 else:
-                    keys = get_children_keys(sender, original.parent_id)
-                    cache.delete_many(keys)
+                    sender.get_children_generation().delete_many(get_children_keys(sender, original.parent_id))
             else:
                 if original.active != instance.active:
                     if instance.active:
@@ -121,7 +121,7 @@ def invalidate_data_mart_before_save(sender, instance, **kwargs):
                     keys = []
                     for parent_id in parent_id_list:
                         keys.extend(get_children_keys(sender, parent_id))
-                    cache.delete_many(keys)
+                    sender.get_children_generation().delete_many(keys)
                     instance._parent_id_validate = True
         except sender.DoesNotExist:
             pass
@@ -136,9 +136,14 @@ def invalidate_data_mart_after_save(sender, instance, **kwargs):
         # Clear Entity Data Mart
         EntityModel.clear_data_mart_cache_buffer()
 
+        # Change data marts tree ETag
+        DataMartModel.get_tree_generation().incr()
+
+        # Invalidate entities terms ids cache entries depending on data mart
+        EntityModel.record_terms_cache_changes(data_marts_ids=[instance.id])
+
         if not getattr(instance, '_parent_id_validate', False):
-            keys = get_children_keys(sender, instance.parent_id)
-            cache.delete_many(keys)
+            sender.get_children_generation().delete_many(get_children_keys(sender, instance.parent_id))
 
 
 def invalidate_data_mart_before_delete(sender, instance, **kwargs):
@@ -150,7 +155,7 @@ def invalidate_data_mart_before_delete(sender, instance, **kwargs):
 
 def invalidate_data_mart_after_move(sender, instance, target, position, prev_parent, **kwargs):
     keys = get_children_keys(sender, prev_parent.id if prev_parent is not None else None)
-    cache.delete_many(keys)
+    sender.get_children_generation().delete_many(keys)
 
     invalidate_data_mart_after_save(sender, instance, **kwargs)
 
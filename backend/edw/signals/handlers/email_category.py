@@ -14,6 +14,7 @@ from edw.models.customer import CustomerModel
 from edw.models.mixins.entity.customer_category import CustomerCategoryMixin
 from edw.models.email_category import EmailCategoryModel
 from edw.signals import make_dispatch_uid
+from edw.signals.handlers.entity import replace_entities_term
 
 
 if six.PY3:
@@ -53,9 +54,7 @@ def on_pre_save_email_category(sender, instance, **kwargs):
                 customer_category_term_id = instance.term.id
                 entities_ids = EntityModel.objects.instance_of(*_model_with_customer_category_mixin).filter(
                     terms__id=origin_customer_category_term_id).values_list('id', flat=True)
-                EntityModel.terms.through.objects.filter(
-                    entity_id__in=list(entities_ids), term_id=origin_customer_category_term_id).update(
-                    term_id=customer_category_term_id)
+                replace_entities_term(entities_ids, origin_customer_category_term_id, customer_category_term_id)
 
 
 # ==============================================================================
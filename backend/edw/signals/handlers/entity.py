@@ -7,12 +7,16 @@ from django.core.exceptions import ImproperlyConfigured
 from django.db.models.signals import (
     m2m_changed,
     pre_delete,
+    post_delete,
     post_save
 )
 from django.dispatch import receiver
 
 from edw.models.entity import EntityModel
+from edw.models.related import AdditionalEntityCharacteristicOrMarkModel
+from edw.models.related.entity_attributes import EntityAttributesModel, is_entity_attributes_enabled
 from edw.models.term import TermModel
+from edw.models.terms_index import EntityTermsIndex
 from edw.rest.serializers.entity import EntityCommonSerializer
 from edw.signals import make_dispatch_uid
 from edw.signals.entity import external_add_terms, external_remove_terms
@@ -83,10 +87,75 @@ def invalidate_after_terms_set_changed(sender, instance, **kwargs):
                 external_remove_terms.send(sender=instance.__class__, instance=instance, pk_set=pk_set)
 
 
+# update entity terms index and terms ids cache journal after terms set changed
+@receiver(m2m_changed, sender=Model, dispatch_uid=make_dispatch_uid(
+    m2m_changed, 'record_after_terms_set_changed', Model))
+def record_after_terms_set_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear":
+        related = instance.entities if reverse else instance.terms
+        instance._cleared_pk_set = set(related.values_list('id', flat=True))
+        return
+    elif action == "post_clear":
+        pk_set = getattr(instance, "_cleared_pk_set", None)
+        del instance._cleared_pk_set
+        op = EntityTermsIndex.REMOVE
+    elif action == "post_add":
+        op = EntityTermsIndex.ADD
+    elif action == "post_remove":
+        op = EntityTermsIndex.REMOVE
+    else:
+        return
+    if pk_set:
+        if reverse:
+            entities_ids, terms_ids = pk_set, [instance.id]
+        else:
+            entities_ids, terms_ids = [instance.id], pk_set
+        EntityTermsIndex.record(op, entities_ids, terms_ids)
+        EntityModel.record_terms_cache_changes(terms_ids)
+        EntityModel.clear_count_cache_buffer()
+        invalidate_entities_attributes(entities_ids, terms_ids)
+
+
+def invalidate_entities_attributes(entities_ids, terms_ids):
+    # Refresh materialized characteristics and marks if attributes terms changed
+    if is_entity_attributes_enabled():
+        attributes_terms_ids = set(TermModel.get_all_active_characteristics_descendants_ids())
+        attributes_terms_ids.update(TermModel.get_all_active_marks_descendants_ids())
+        if attributes_terms_ids.intersection(terms_ids):
+            EntityAttributesModel.invalidate(entities_ids=entities_ids)
+
+
+def replace_entities_term(entities_ids, origin_term_id, term_id):
+    """
+    RUS: Переносит связи сущностей с термина `origin_term_id` на термин `term_id` одним запросом.
+    Массовое обновление промежуточной таблицы не отправляет сигнал m2m_changed, поэтому изменения
+    записываются в индекс терминов, журнал кэша id терминов и материализованные атрибуты явно.
+    """
+    through = EntityModel.terms.through
+    entities_ids = list(through.objects.filter(
+        entity_id__in=list(entities_ids), term_id=origin_term_id).values_list('entity_id', flat=True))
+    if not entities_ids:
+        return
+    through.objects.filter(entity_id__in=entities_ids, term_id=origin_term_id).update(term_id=term_id)
+
+    EntityTermsIndex.record(EntityTermsIndex.REMOVE, entities_ids, [origin_term_id])
+    EntityTermsIndex.record(EntityTermsIndex.ADD, entities_ids, [term_id])
+    EntityModel.record_terms_cache_changes([origin_term_id, term_id])
+    EntityModel.clear_count_cache_buffer()
+    if is_entity_attributes_enabled():
+        EntityAttributesModel.invalidate(entities_ids=entities_ids)
+
+
 # invalidate after entity changed
-def invalidate_entity_after_save(sender, instance, **kwargs):
-    # Clear terms ids buffer
-    EntityModel.clear_terms_cache_buffer()
+def invalidate_entity(instance, terms_ids):
+    # Clear terms ids buffer, journaled entries are kept
+    EntityModel.get_terms_cache_generation().incr()
+
+    # Invalidate journaled terms ids cache entries depending on entity terms
+    EntityModel.record_terms_cache_changes(terms_ids)
+
+    # Clear queries counts cache
+    EntityModel.clear_count_cache_buffer()
 
     # Clear HTML snippets
     keys = get_HTML_snippets_keys(instance)
@@ -97,8 +166,32 @@ def invalidate_entity_after_save(sender, instance, **kwargs):
     cache.delete_many(keys)
 
 
+def invalidate_entity_after_save(sender, instance, **kwargs):
+    invalidate_entity(instance, instance.terms.values_list('id', flat=True))
+
+
 def invalidate_entity_before_delete(sender, instance, **kwargs):
-    invalidate_entity_after_save(sender, instance, **kwargs)
+    terms_ids = list(instance.terms.values_list('id', flat=True))
+    invalidate_entity(instance, terms_ids)
+
+    # Remove entity from terms index, through table rows are deleted by cascade without m2m_changed signal
+    EntityTermsIndex.record(EntityTermsIndex.REMOVE, [instance.id], terms_ids)
+
+
+# ==============================================================================
+# Additional characteristics or marks event handlers
+# ==============================================================================
+def invalidate_entity_attributes_after_additional_save(sender, instance, **kwargs):
+    if is_entity_attributes_enabled():
+        EntityAttributesModel.invalidate(entities_ids=[instance.entity_id])
+
+
+Model = AdditionalEntityCharacteristicOrMarkModel.materialized
+
+post_save.connect(invalidate_entity_attributes_after_additional_save, Model,
+                  dispatch_uid=make_dispatch_uid(post_save, invalidate_entity_attributes_after_additional_save, Model))
+post_delete.connect(invalidate_entity_attributes_after_additional_save, Model, dispatch_uid=make_dispatch_uid(
+    post_delete, invalidate_entity_attributes_after_additional_save, Model))
 
 
 # ==============================================================================
@@ -8,6 +8,7 @@ from edw.models.entity import EntityModel
 from edw.models.mixins.entity.place import PlaceMixin
 from edw.models.postal_zone import PostZoneModel
 from edw.signals import make_dispatch_uid
+from edw.signals.handlers.entity import replace_entities_term
 
 # ==============================================================================
 # Find Models with PlaceMixin
@@ -36,8 +37,7 @@ def on_pre_save_postzone(sender, instance, **kwargs):
                 zone_term_id = instance.term.id
                 entities_ids = EntityModel.objects.instance_of(*_model_with_place_mixin).filter(
                     terms__id=origin_zone_term_id).values_list('id', flat=True)
-                EntityModel.terms.through.objects.filter(
-                    entity_id__in=list(entities_ids), term_id=origin_zone_term_id).update(term_id=zone_term_id)
+                replace_entities_term(entities_ids, origin_zone_term_id, zone_term_id)
 
 
 #==============================================================================
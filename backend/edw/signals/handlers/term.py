@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from django.core.cache import cache
-from django.db.models import F
+from django.db import transaction
+from django.db.models import F, Q
 from django.db.models.signals import (
     pre_delete,
 )
@@ -15,6 +16,9 @@ from edw.signals.mptt import (
 from edw.models.term import TermModel
 from edw.models.data_mart import DataMartModel
 from edw.models.entity import EntityModel
+from edw.models.mptt_info import get_queryset_descendants
+from edw.models.mptt_snapshot import MPTTForestSnapshot
+from edw.models.related.entity_attributes import EntityAttributesModel, is_entity_attributes_enabled
 
 
 def get_children_keys(sender, parent_id):
@@ -24,7 +28,7 @@ def get_children_keys(sender, parent_id):
         if parent_id is not None else
         "toplvl"
     ])
-    return [key, ":".join([key, "actv"])]
+    return sender.get_children_generation().make_keys([key, ":".join([key, "actv"])])
 
 
 def _get_attribute_ancestors_key(sender, id, attribute_mode):
@@ -36,9 +40,10 @@ def _get_attribute_ancestors_key(sender, id, attribute_mode):
     ])
 
 def get_attribute_ancestors_keys(sender, instance):
-    return [_get_attribute_ancestors_key(sender, id, attribute_mode) for id in
-            instance.get_descendants(include_self=True).values_list('id', flat=True) for attribute_mode in
-            (sender.attributes.is_characteristic, sender.attributes.is_mark)]
+    return sender.get_attribute_ancestors_generation().make_keys([
+        _get_attribute_ancestors_key(sender, id, attribute_mode) for id in
+        instance.get_descendants(include_self=True).values_list('id', flat=True) for attribute_mode in
+        (sender.attributes.is_characteristic, sender.attributes.is_mark)])
 
 
 def get_all_active_attributes_descendants_keys(sender):
@@ -50,6 +55,29 @@ def get_data_mart_all_active_terms_keys():
     return [DataMartModel.ALL_ACTIVE_TERMS_COUNT_CACHE_KEY, DataMartModel.ALL_ACTIVE_TERMS_IDS_CACHE_KEY]
 
 
+def get_entity_attributes_terms_ids(sender, instance, prev_parent=None):
+    # terms of subtree which names and view classes are used in entities characteristics and marks,
+    # active state is not taken into account, since it may be changing right now
+    is_attribute = Q(attributes=sender.attributes.is_characteristic) | Q(attributes=sender.attributes.is_mark)
+    subtree = instance.get_descendants(include_self=True)
+    families = [instance.get_ancestors(include_self=True)]
+    if prev_parent is not None:
+        # subtree could be moved from the attribute term, tree fields of the previous parent instance are stale
+        families.append(sender._default_manager.get(pk=prev_parent.pk).get_ancestors(include_self=True))
+    if any(x.filter(is_attribute).exists() for x in families):
+        return list(subtree.values_list('id', flat=True))
+    attributes_terms = list(subtree.filter(is_attribute))
+    if not attributes_terms:
+        return []
+    return list(get_queryset_descendants(attributes_terms, include_self=True).values_list('id', flat=True))
+
+
+def invalidate_term_snapshot():
+    MPTTForestSnapshot.invalidate(TermModel.materialized)
+    # HACK: reload snapshot after commit, otherwise other processes can load uncommitted state
+    transaction.on_commit(lambda: MPTTForestSnapshot.invalidate(TermModel.materialized))
+
+
 #==============================================================================
 # Term model event handlers
 #==============================================================================
@@ -57,16 +85,20 @@ def invalidate_term_before_save(sender, instance, **kwargs):
     if instance.id is not None:
         try:
             original = sender._default_manager.get(pk=instance.id)
+            if is_entity_attributes_enabled() and (
+                    original.parent_id != instance.parent_id or original.active != instance.active or
+                    original.attributes != instance.attributes or original.name != instance.name or
+                    original.view_class != instance.view_class):
+                instance._entity_attributes_terms_ids = get_entity_attributes_terms_ids(sender, original)
             if original.parent_id != instance.parent_id:
                 if original.active != instance.active:
                     TermModel.clear_children_buffer()  # Clear children buffer
                     instance._parent_id_validate = True
                 else:
-                    keys = get_children_keys(sender, original.parent_id)
-                    cache.delete_many(keys)
+                    sender.get_children_generation().delete_many(get_children_keys(sender, original.parent_id))
 
-                keys = get_attribute_ancestors_keys(sender, instance)
-                keys.extend(get_all_active_attributes_descendants_keys(sender))
+                sender.get_attribute_ancestors_generation().delete_many(get_attribute_ancestors_keys(sender, instance))
+                keys = get_all_active_attributes_descendants_keys(sender)
                 keys.extend(get_data_mart_all_active_terms_keys())
                 cache.delete_many(keys)
             else:
@@ -82,8 +114,10 @@ def invalidate_term_before_save(sender, instance, **kwargs):
                                               exclude(lft=F('rght')-1).values_list('id', flat=True))
                         parent_id_list.append(original.parent_id)
 
+                    children_keys = []
                     for parent_id in parent_id_list:
-                        keys.extend(get_children_keys(sender, parent_id))
+                        children_keys.extend(get_children_keys(sender, parent_id))
+                    sender.get_children_generation().delete_many(children_keys)
                     instance._parent_id_validate = True
 
                     keys.extend(get_all_active_attributes_descendants_keys(sender))
@@ -94,11 +128,11 @@ def invalidate_term_before_save(sender, instance, **kwargs):
                         instance.attributes & (
                             instance.__class__.attributes.is_characteristic | instance.__class__.attributes.is_mark
                         ) and (original.name != instance.name or original.view_class != instance.view_class)):
-                    keys = get_attribute_ancestors_keys(sender, instance)
+                    sender.get_attribute_ancestors_generation().delete_many(
+                        get_attribute_ancestors_keys(sender, instance))
                     if not getattr(instance, '_all_active_attributes_descendants_validate', False):
-                        keys.extend(get_all_active_attributes_descendants_keys(sender))
+                        cache.delete_many(get_all_active_attributes_descendants_keys(sender))
                         instance._all_active_attributes_descendants_validate = True
-                    cache.delete_many(keys)
 
         except sender.DoesNotExist:
             pass
@@ -109,29 +143,47 @@ def invalidate_term_before_save(sender, instance, **kwargs):
 def invalidate_term_after_save(sender, instance, **kwargs):
     if instance.id is not None:
         if not getattr(instance, '_parent_id_validate', False):
-            keys = get_children_keys(sender, instance.parent_id)
-            cache.delete_many(keys)
+            sender.get_children_generation().delete_many(get_children_keys(sender, instance.parent_id))
     TermModel.clear_decompress_buffer()  # Clear decompress buffer
+    TermModel.clear_leaf_ids_buffer()  # Clear subtrees leaf ids buffer
+    TermModel.get_tree_generation().incr()  # Change terms tree ETag
+    invalidate_term_snapshot()  # Reload terms forest snapshot
     cache.delete(TermModel.ALL_ACTIVE_ROOT_IDS_CACHE_KEY) # Clear all active root ids cache
     EntityModel.clear_terms_cache_buffer() # Clear terms ids buffer
+    EntityModel.clear_semantic_filter_plan_buffer()  # Clear semantic filter plans buffer
+    EntityModel.clear_count_cache_buffer()  # Clear entities queries counts buffer
+    # Refresh materialized entities attributes, the refresh is queued on commit after the snapshot invalidation
+    terms_ids = getattr(instance, '_entity_attributes_terms_ids', None)
+    if terms_ids is not None:
+        del instance._entity_attributes_terms_ids
+        EntityAttributesModel.invalidate(terms_ids=terms_ids)
+    entities_ids = getattr(instance, '_entity_attributes_entities_ids', None)
+    if entities_ids is not None:
+        del instance._entity_attributes_entities_ids
+        EntityAttributesModel.invalidate(entities_ids=entities_ids)
 
 
 def invalidate_term_before_delete(sender, instance, **kwargs):
-    keys = get_attribute_ancestors_keys(sender, instance)
+    if is_entity_attributes_enabled():
+        # entities terms are deleted by cascade, so entities are resolved before delete
+        instance._entity_attributes_entities_ids = EntityAttributesModel.get_entities_ids(
+            get_entity_attributes_terms_ids(sender, instance))
+    sender.get_attribute_ancestors_generation().delete_many(get_attribute_ancestors_keys(sender, instance))
     if instance.active:
-        keys.extend(get_data_mart_all_active_terms_keys())
+        keys = get_data_mart_all_active_terms_keys()
         keys.extend(get_all_active_attributes_descendants_keys(sender))
-    cache.delete_many(keys)
+        cache.delete_many(keys)
     invalidate_term_after_save(sender, instance, **kwargs)
 
 
 def invalidate_term_after_move(sender, instance, target, position, prev_parent, **kwargs):
     prev_parent_id = prev_parent.id if prev_parent is not None else None
-    keys = get_children_keys(sender, prev_parent_id)
+    sender.get_children_generation().delete_many(get_children_keys(sender, prev_parent_id))
     if prev_parent_id != instance.parent_id:
-        keys.extend(get_attribute_ancestors_keys(sender, instance))
-        keys.extend(get_all_active_attributes_descendants_keys(sender))
-    cache.delete_many(keys)
+        sender.get_attribute_ancestors_generation().delete_many(get_attribute_ancestors_keys(sender, instance))
+        cache.delete_many(get_all_active_attributes_descendants_keys(sender))
+        if is_entity_attributes_enabled():
+            instance._entity_attributes_terms_ids = get_entity_attributes_terms_ids(sender, instance, prev_parent)
     invalidate_term_after_save(sender, instance, **kwargs)
 
 
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from celery import shared_task
+
+from edw.models.related.entity_attributes import EntityAttributesModel
+
+
+@shared_task(name='update_entities_attributes')
+def update_entities_attributes(entities_ids=None, terms_ids=None):
+    count = EntityAttributesModel.refresh(entities_ids, terms_ids)
+
+    return {
+        'entities_ids': entities_ids,
+        'terms_ids': terms_ids,
+        'count': count,
+    }
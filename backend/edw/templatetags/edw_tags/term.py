@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from django.core.cache import cache
+
 from classytags.core import Options
 from classytags.arguments import MultiKeywordArgument, Argument
 
+from edw import settings as edw_settings
 from edw.models.term import TermModel
 from edw.rest.templatetags import BaseRetrieveDataTag
 from edw.rest.serializers.term import TermTreeSerializer
+from edw.rest.viewsets import make_etag
+from edw.views.term import get_trees_generations
 
 
 class GetTermTree(BaseRetrieveDataTag):
@@ -21,16 +26,31 @@ class GetTermTree(BaseRetrieveDataTag):
         Argument('varname', required=False, resolve=False)
     )
 
+    DATA_CACHE_KEY_PATTERN = 'tt_tag:{etag}'
+
     def render_tag(self, context, kwargs, varname):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True, context=context)
-        data = serializer.data
+        options = edw_settings.REST_CONDITIONAL
+        if options['enabled']:
+            # данные кэшируются по ETag, как ответы REST интерфейса
+            key = self.DATA_CACHE_KEY_PATTERN.format(etag=make_etag(
+                self.name, self.request.query_params, get_trees_generations()))
+            data = cache.get(key, None)
+            if data is None:
+                data = self.get_data(context)
+                cache.set(key, data, options['template_tag_timeout'])
+        else:
+            data = self.get_data(context)
         if varname:
             context[varname] = data
             return ''
         else:
             return self.to_json(data)
 
+    def get_data(self, context):
+        queryset = self.get_queryset()
+        serializer = self.get_serializer(queryset, many=True, context=context)
+        return serializer.data
+
 
 def attributes_has_view_class(value, arg):
     if value and isinstance(value, (tuple, list)):
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+import time
+import warnings
+
+from django.core.cache import cache
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from edw import settings as edw_settings
+from edw.utils.cache_generation import CacheGeneration, warn_deprecated_buffer
+from edw.utils.lru_cache import LRUCache
+from edw.models.defaults.term import Term
+from edw.models.term import TermModel
+from edw.models.cache import (
+    get_compact_row_class,
+    get_or_set_single_flight,
+    InvalidationJournal,
+    QuerySetCachedResultMixin,
+    SingleFlightEntry,
+    SINGLE_FLIGHT_LOCK_KEY_PATTERN
+)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'edw-test-single-flight',
+    }
+})
+class SingleFlightCacheTestHandler(SimpleTestCase):
+    KEY = 'tst_sf'
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        self.calls_lock = threading.Lock()
+
+    def compute(self, value='new', delay=0.2):
+        with self.calls_lock:
+            self.calls += 1
+        time.sleep(delay)
+        return value
+
+    def run_threads(self, target, count):
+        results = []
+
+        def worker():
+            results.append(target())
+
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_single_flight_computes_once(self):
+        results = self.run_threads(lambda: get_or_set_single_flight(self.KEY, self.compute, 60), 8)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, ['new'] * 8)
+        self.assertIsNone(cache.get(SINGLE_FLIGHT_LOCK_KEY_PATTERN.format(key=self.KEY)))
+
+    def test_stale_value_served_while_revalidating(self):
+        cache.set(self.KEY, SingleFlightEntry('old', time.time() - 1), 60)
+
+        revalidating = threading.Thread(
+            target=lambda: get_or_set_single_flight(self.KEY, lambda: self.compute(delay=0.5), 60))
+        revalidating.start()
+        time.sleep(0.1)
+
+        # пока значение вычисляется, остальные получают устаревшее без ожидания
+        started_at = time.time()
+        results = self.run_threads(lambda: get_or_set_single_flight(self.KEY, self.compute, 60), 4)
+        self.assertEqual(results, ['old'] * 4)
+        self.assertLess(time.time() - started_at, 0.4)
+
+        revalidating.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(get_or_set_single_flight(self.KEY, self.compute, 60), 'new')
+        self.assertEqual(self.calls, 1)
+
+    def test_wait_timeout_computes_without_lock(self):
+        options = edw_settings.CACHE_SINGLE_FLIGHT
+        wait_timeout = options['wait_timeout']
+        options['wait_timeout'] = 0.2
+        try:
+            # блокировка захвачена "зависшим" процессом
+            cache.add(SINGLE_FLIGHT_LOCK_KEY_PATTERN.format(key=self.KEY), 1, 60)
+            result = get_or_set_single_flight(self.KEY, lambda: self.compute(delay=0), 60)
+        finally:
+            options['wait_timeout'] = wait_timeout
+
+        self.assertEqual(result, 'new')
+        self.assertEqual(self.calls, 1)
+
+
+class _CachedResult(QuerySetCachedResultMixin, list):
+
+    misses = 0
+
+    def prepare_for_cache(self, data):
+        _CachedResult.misses += 1
+        return super(_CachedResult, self).prepare_for_cache(data)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'edw-test-invalidation-journal',
+    }
+})
+class InvalidationJournalTestHandler(TransactionTestCase):
+    KEY = 'tst_jrnl'
+
+    def setUp(self):
+        cache.clear()
+        _CachedResult.misses = 0
+        self.journal = InvalidationJournal.factory(self.KEY)
+
+    def get(self, value, dependencies):
+        result = _CachedResult([value])
+        result._cache_key = '{}:entry'.format(self.KEY)
+        return result.cache(journal=self.journal, dependencies=dependencies)
+
+    def test_only_dependent_entries_are_invalidated(self):
+        self.assertEqual(self.get(1, [1, 2]), [1])
+        self.journal.record([3])
+        self.assertEqual(self.get(2, [1, 2]), [1])
+        self.assertEqual(_CachedResult.misses, 1)
+
+        self.journal.record([2])
+        self.assertEqual(self.get(3, [1, 2]), [3])
+        self.assertEqual(_CachedResult.misses, 2)
+
+    def test_dependencies_are_not_stored(self):
+        self.get(1, [1, 2])
+        self.assertEqual(cache.get('{}:entry'.format(self.KEY)), (self.journal.get_sequence(), [1]))
+
+    def test_record_is_written_once_on_commit(self):
+        seq = self.journal.get_sequence()
+        with transaction.atomic():
+            self.journal.record([1])
+            self.assertEqual(self.journal.get_sequence(), seq)
+        self.assertEqual(self.journal.get_sequence(), seq + 1)
+
+        try:
+            with transaction.atomic():
+                self.journal.record([1])
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.journal.get_sequence(), seq + 1)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'edw-test-cache-generation',
+    }
+})
+class CacheGenerationTestHandler(SimpleTestCase):
+    KEY = 'tst_gen'
+
+    def setUp(self):
+        cache.clear()
+        self.generation = CacheGeneration.factory(self.KEY)
+
+    def test_incr_invalidates_family(self):
+        key = self.generation.make_key('entry')
+        cache.set(key, 1)
+        self.generation.incr()
+        self.assertNotEqual(self.generation.make_key('entry'), key)
+
+    def test_ring_buffer_compatible_api(self):
+        # прежний способ очистки буфера: get_all, clear, delete_many
+        key = self.generation.make_key('entry')
+        self.assertEqual(self.generation.record(key), self.generation.empty)
+        keys = self.generation.get_all()
+        self.generation.clear()
+        cache.delete_many(keys)
+        self.assertEqual(keys, [])
+        self.assertNotEqual(self.generation.make_key('entry'), key)
+
+    def test_deprecation_warning(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            warn_deprecated_buffer('get_tst_buffer', 'get_tst_generation')
+        self.assertEqual(len(caught), 1)
+        self.assertTrue(issubclass(caught[0].category, DeprecationWarning))
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'edw-test-local-cache',
+    }
+})
+class LocalCacheTierTestHandler(SimpleTestCase):
+    KEY = 'tst_lc'
+
+    @classmethod
+    def setUpClass(cls):
+        super(LocalCacheTierTestHandler, cls).setUpClass()
+        edw_settings.LOCAL_CACHE['families'][cls.KEY] = {'ttl': 0.2, 'generation_ttl': 0.2}
+        cls.generation = CacheGeneration.factory(cls.KEY)
+
+    @classmethod
+    def tearDownClass(cls):
+        del edw_settings.LOCAL_CACHE['families'][cls.KEY]
+        super(LocalCacheTierTestHandler, cls).tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        _CachedResult.misses = 0
+        self.generation.incr()
+        LRUCache.reset_all()
+
+    def get(self, value):
+        result = _CachedResult([value])
+        result._cache_key = '{}:entry'.format(self.KEY)
+        return result.cache(generation=self.generation)
+
+    def test_local_hit(self):
+        self.assertEqual(self.get(1), [1])
+        cache.clear()
+        # значение и номер поколения берутся из памяти процесса без обращения к глобальному кэшу
+        self.assertEqual(self.get(2), [1])
+        self.assertEqual(_CachedResult.misses, 1)
+        self.assertEqual(self.generation.local_cache.get_stats()['hits'], 1)
+
+    def test_delete_many_keeps_generation(self):
+        self.assertEqual(self.get(1), [1])
+        generation = self.generation.get()
+        key = self.generation.make_key('{}:entry'.format(self.KEY))
+        self.generation.delete_many([key])
+        # ключ удаляется из глобального кэша и локального кэша процесса, поколение семейства не меняется
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(self.generation.get(), generation)
+        self.assertEqual(self.get(2), [2])
+        self.assertEqual(len(self.generation.local_cache), 1)
+
+    def test_generation_change_is_seen_after_ttl(self):
+        self.assertEqual(self.get(1), [1])
+        # поколение изменено другим процессом
+        cache.incr(self.generation.generation_cache_key)
+        self.assertEqual(self.get(2), [1])
+        time.sleep(0.25)
+        self.assertEqual(self.get(3), [3])
+        self.assertEqual(_CachedResult.misses, 2)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'edw-test-compact-cache',
+    }
+})
+class CompactCacheFormatTestHandler(TestCase):
+    KEY = 'tst_cmp'
+    FIELDS = ('id', 'parent_id', 'name', 'parent__name', 'parent__slug')
+
+    def setUp(self):
+        cache.clear()
+        for pk, parent_id in ((1, None), (2, 1), (3, 1)):
+            Term.objects.create(id=pk, parent_id=parent_id, name='Term{}'.format(pk), slug='term{}'.format(pk),
+                                semantic_rule=TermModel.OR_RULE, specification_mode=TermModel.STANDARD_SPECIFICATION,
+                                active=True, description='', attributes=0, system_flags=0)
+
+    def get(self, **kwargs):
+        result = TermModel.objects.order_by('id')
+        result._cache_key = '{}:entry'.format(self.KEY)
+        return result.cache(**kwargs)
+
+    def test_rows_are_read_as_attributes(self):
+        rows = self.get(fields=self.FIELDS)
+        self.assertEqual([(x.pk, x.id, x.parent_id, x.name) for x in rows],
+                         [(1, 1, None, 'Term1'), (2, 2, 1, 'Term2'), (3, 3, 1, 'Term3')])
+        self.assertIsNone(rows[0].parent)
+        self.assertEqual((rows[1].parent.name, rows[1].parent.slug), ('Term1', 'term1'))
+        self.assertIs(type(rows[0]), get_compact_row_class(self.FIELDS))
+
+        # в кэше хранятся кортежи значений полей, повторное чтение не обращается к базе данных
+        self.assertEqual(list(cache.get('{}:entry'.format(self.KEY)).value[0]), [1, None, 'Term1', None, None])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(fields=self.FIELDS), rows)
+
+    def test_local_cache_returns_copy(self):
+        local_cache = {}
+        rows = self.get(fields=self.FIELDS, local_cache=local_cache)
+        rows.pop()
+        self.assertEqual(len(self.get(fields=self.FIELDS, local_cache=local_cache)), 3)
+
+    def test_full_format_entry_is_returned_as_is(self):
+        self.get()
+        terms = self.get(fields=self.FIELDS)
+        self.assertEqual([x.__class__ for x in terms], [Term] * 3)
+        self.assertEqual([x.name for x in terms], ['Term1', 'Term2', 'Term3'])
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory, override_settings
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from edw import settings as edw_settings
+from edw.models.data_mart import DataMartModel
+from edw.models.defaults.term import Term
+from edw.models.term import TermModel
+from edw.rest.viewsets import etag_conditional_response
+from edw.views.term import get_trees_generations
+
+
+class _TreeView(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    @etag_conditional_response(get_trees_generations)
+    def tree(self, request):
+        self.calls += 1
+        return Response({'calls': self.calls})
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'edw-test-conditional-response',
+    }
+})
+class ETagConditionalResponseTestHandler(TestCase):
+    PATH = '/edw/api/terms/tree/?selected=1'
+
+    def setUp(self):
+        cache.clear()
+        self.view = _TreeView()
+
+    def get(self, path=PATH, **extra):
+        return self.view.tree(Request(RequestFactory().get(path, **extra)))
+
+    def test_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], edw_settings.REST_CONDITIONAL['cache_control'])
+
+        for if_none_match in (etag, 'W/{}'.format(etag), '"other", {}'.format(etag), '*'):
+            response = self.get(HTTP_IF_NONE_MATCH=if_none_match)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response['ETag'], etag)
+        # ответ 304 отдается без вызова представления
+        self.assertEqual(self.view.calls, 1)
+
+        response = self.get('/edw/api/terms/tree/?selected=2', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_query_params_order_does_not_matter(self):
+        etag = self.get('/edw/api/terms/tree/?selected=1&max_depth=2')['ETag']
+        self.assertEqual(self.get('/edw/api/terms/tree/?max_depth=2&selected=1')['ETag'], etag)
+
+    def test_term_change_invalidates_etag(self):
+        etag = self.get()['ETag']
+        Term.objects.create(id=1, name='Term1', slug='term1', semantic_rule=TermModel.OR_RULE,
+                            specification_mode=TermModel.STANDARD_SPECIFICATION, active=True, description='',
+                            attributes=0, system_flags=0)
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        DataMartModel.get_tree_generation().incr()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.view.calls, 3)
+
+    def test_disabled(self):
+        options = edw_settings.REST_CONDITIONAL
+        enabled = options['enabled']
+        options['enabled'] = False
+        try:
+            response = self.get()
+        finally:
+            options['enabled'] = enabled
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('ETag', response)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from edw import settings as edw_settings
+from edw.models.defaults.term import Term
+from edw.models.mptt_snapshot import MPTTForestSnapshot
+from edw.models.term import TermModel
+from edw.signals.handlers.term import get_entity_attributes_terms_ids
+
+
+class EntityAttributesInvalidationTestHandler(TestCase):
+    # (id, parent id, attributes, active)
+    TERMS = (
+        (1, None, 0, True),
+        (2, 1, int(TermModel.attributes.is_characteristic), True),
+        (3, 2, 0, False),
+        (4, 3, 0, True),
+        (5, 1, 0, True),
+        (6, None, 0, True),
+    )
+
+    def setUp(self):
+        for pk, parent_id, attributes, active in self.TERMS:
+            Term.objects.create(id=pk, parent_id=parent_id, name='Term{}'.format(pk), slug='term{}'.format(pk),
+                                semantic_rule=TermModel.OR_RULE, specification_mode=TermModel.STANDARD_SPECIFICATION,
+                                active=active, description='', attributes=attributes, system_flags=0)
+
+    def get_terms_ids(self, pk, prev_parent=None):
+        return sorted(get_entity_attributes_terms_ids(TermModel, TermModel.objects.get(pk=pk), prev_parent))
+
+    def test_inactive_subtree_terms_are_included(self):
+        self.assertEqual(self.get_terms_ids(1), [2, 3, 4])
+        self.assertEqual(self.get_terms_ids(2), [2, 3, 4])
+        # термин деактивируется или активируется, его поддерево все равно учитывается
+        self.assertEqual(self.get_terms_ids(3), [3, 4])
+        self.assertEqual(self.get_terms_ids(5), [])
+        self.assertEqual(self.get_terms_ids(6), [])
+
+    def test_subtree_moved_from_attribute_term(self):
+        self.assertEqual(self.get_terms_ids(6, prev_parent=TermModel.objects.get(pk=2)), [6])
+
+    def test_snapshot_reload(self):
+        options = edw_settings.TERM_SNAPSHOT
+        enabled = options['enabled']
+        options['enabled'] = True
+        try:
+            MPTTForestSnapshot.invalidate(TermModel.materialized)
+            snapshot = MPTTForestSnapshot.get(TermModel.materialized)
+            self.assertEqual(snapshot.get_descendants_ids(2, include_self=True, active_only=True), [2, 4])
+            # изменение без сигналов, версия снимка не меняется
+            TermModel.objects.filter(pk=4).update(active=False)
+            self.assertIs(MPTTForestSnapshot.get(TermModel.materialized), snapshot)
+            snapshot = MPTTForestSnapshot.reload(TermModel.materialized)
+            self.assertIs(MPTTForestSnapshot.get(TermModel.materialized), snapshot)
+            self.assertEqual(snapshot.get_descendants_ids(2, include_self=True, active_only=True), [2])
+        finally:
+            options['enabled'] = enabled
+            MPTTForestSnapshot.invalidate(TermModel.materialized)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from edw.models.defaults.term import Term
+from edw.models.entity import EntityAttributeAncestorsResolver, EntityCharacteristicOrMarkGetter
+from edw.models.mptt_snapshot import MPTTForestSnapshot
+from edw.models.term import TermModel
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'edw-test-entity-characteristics',
+    }
+})
+class EntityAttributeAncestorsResolverTestHandler(TestCase):
+    CHARACTERISTIC = int(TermModel.attributes.is_characteristic)
+    MARK = int(TermModel.attributes.is_mark)
+    # (id, parent id, name, attributes, view class)
+    TERMS = (
+        (1, None, 'Color', CHARACTERISTIC, 'color'),
+        (2, 1, 'Red', 0, 'red'),
+        (3, 1, 'Blue', 0, None),
+        (4, None, 'Size', CHARACTERISTIC | MARK, None),
+        (5, 4, '42', 0, None),
+        (6, 4, '7', 0, None),
+        (7, None, 'Material', CHARACTERISTIC, None),
+        (8, 7, 'Wood', CHARACTERISTIC, 'natural'),
+        (9, 8, 'Oak', 0, None),
+        (10, 7, 'Metal', 0, None),
+        (11, None, 'Other', 0, None),
+        (12, 11, 'Sale', MARK, 'sale'),
+    )
+
+    def setUp(self):
+        cache.clear()
+        for pk, parent_id, name, attributes, view_class in self.TERMS:
+            Term.objects.create(id=pk, parent_id=parent_id, name=name, slug='term{}'.format(pk),
+                                semantic_rule=TermModel.OR_RULE, specification_mode=TermModel.STANDARD_SPECIFICATION,
+                                active=True, description='', attributes=attributes, system_flags=0,
+                                view_class=view_class)
+        MPTTForestSnapshot.invalidate(TermModel.materialized)
+
+    def get_attributes(self, terms_ids, attribute_mode, resolver=None):
+        terms = list(TermModel.objects.filter(id__in=terms_ids).order_by('tree_id', 'lft'))
+        getter = EntityCharacteristicOrMarkGetter(terms, [], attribute_mode, TermModel._mptt_meta,
+                                                  attributes_ancestors_local_cache={}, ancestors_resolver=resolver)
+        return [(x.name, x.path, x.values, x.view_class) for x in getter.all()]
+
+    def test_resolver_equals_queries(self):
+        resolver = EntityAttributeAncestorsResolver(MPTTForestSnapshot.load(TermModel.materialized, 0))
+        for terms_ids in ([2, 3, 5, 6, 9, 10], [2, 8], [9], [12, 5], [11], []):
+            for attribute_mode in (TermModel.attributes.is_characteristic, TermModel.attributes.is_mark):
+                expected = self.get_attributes(terms_ids, attribute_mode)
+                self.assertEqual(self.get_attributes(terms_ids, attribute_mode, resolver), expected,
+                                 msg='terms: {}, mode: {}'.format(terms_ids, attribute_mode))
+        attributes = self.get_attributes([2, 3, 5, 6, 9], TermModel.attributes.is_characteristic, resolver)
+        self.assertEqual([(name, values, view_class) for name, path, values, view_class in attributes], [
+            ('Color', ['Blue', 'Red'], ['color', 'red']),
+            ('Size', ['7', '42'], []),
+            # характеристика внутри характеристики: значением является ее потомок
+            ('Wood', ['Oak'], ['natural']),
+        ])
+
+    def test_resolver_instances_are_shared(self):
+        resolver = EntityAttributeAncestorsResolver(MPTTForestSnapshot.load(TermModel.materialized, 0))
+        oak = resolver.get_instance(9)
+        self.assertIs(oak.parent, resolver.get_instance(8))
+        self.assertIs(oak.parent.parent, resolver.get_instance(7))
+        self.assertIsNone(oak.parent.parent.parent)
+        self.assertIn(9, resolver)
+        self.assertNotIn(100500, resolver)
+        mode = TermModel.attributes.is_characteristic
+        with self.assertNumQueries(0):
+            self.assertEqual([x.id for x in resolver.get_attribute_ancestors(oak, mode)], [8, 7])
+            self.assertIsNone(resolver.get_no_attribute_ancestor(resolver.get_instance(8), mode))
+            self.assertEqual(resolver.get_no_attribute_ancestor(oak, TermModel.attributes.is_mark).id, 8)
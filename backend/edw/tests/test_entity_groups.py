@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db.models import Count, Max
+from django.test import TestCase
+
+from edw.models.defaults.term import Term
+from edw.models.entity import BaseEntityQuerySet
+from edw.models.term import TermModel
+
+
+class _AlikeQuerySet(TermModel.objects.all().__class__):
+    """
+    Terms queryset with the entities grouping methods, they depend on the queryset API only
+    """
+    alike = BaseEntityQuerySet.__dict__['alike']
+    alike_groups = BaseEntityQuerySet.__dict__['alike_groups']
+    aggregate_alike = BaseEntityQuerySet.__dict__['aggregate_alike']
+
+
+class AlikeGroupsTestHandler(TestCase):
+    FIELDS = ('semantic_rule', 'specification_mode')
+    # (id, semantic rule, specification mode)
+    TERMS = (
+        (1, TermModel.OR_RULE, TermModel.STANDARD_SPECIFICATION),
+        (2, TermModel.OR_RULE, TermModel.STANDARD_SPECIFICATION),
+        (3, TermModel.AND_RULE, TermModel.STANDARD_SPECIFICATION),
+        (4, TermModel.OR_RULE, TermModel.EXPANDED_SPECIFICATION),
+        (5, TermModel.AND_RULE, TermModel.STANDARD_SPECIFICATION),
+        (6, TermModel.OR_RULE, TermModel.STANDARD_SPECIFICATION),
+    )
+
+    def setUp(self):
+        for pk, semantic_rule, specification_mode in self.TERMS:
+            Term.objects.create(id=pk, name='Term{}'.format(pk), slug='term{}'.format(pk),
+                                semantic_rule=semantic_rule, specification_mode=specification_mode,
+                                active=pk != 6, description='', attributes=0, system_flags=0)
+
+    def get_queryset(self, queryset=None):
+        if queryset is None:
+            queryset = TermModel.objects.all()
+        queryset.__class__ = _AlikeQuerySet
+        return queryset
+
+    def test_alike_groups_equal_alike(self):
+        for queryset in (self.get_queryset(), self.get_queryset(TermModel.objects.filter(active=True))):
+            pks = [1, 3, 4, 100500]
+            with self.assertNumQueries(2):
+                groups = queryset.alike_groups(pks, *self.FIELDS)
+            self.assertEqual(sorted(groups.keys()), [1, 3, 4])
+            for pk, group in groups.items():
+                expected = sorted(queryset.alike(pk, *self.FIELDS).values_list('id', flat=True))
+                self.assertEqual(group.ids, expected)
+                self.assertEqual(sorted(group.values_list('id', flat=True)), expected)
+                self.assertEqual(group.alike_values, queryset.values(*self.FIELDS).get(pk=pk))
+        self.assertEqual(self.get_queryset().alike_groups([], *self.FIELDS), {})
+
+    def test_aggregate_alike_equals_aggregate(self):
+        queryset = self.get_queryset()
+        groups = queryset.alike_groups([1, 3, 4], *self.FIELDS)
+        alikes = [x.alike_values for x in groups.values()]
+        expected = [queryset.filter(**x).aggregate(count=Count('id'), max_id=Max('id')) for x in alikes]
+
+        with self.assertNumQueries(1):
+            result = queryset.aggregate_alike(alikes, count=Count('id'), max_id=Max('id'))
+        self.assertEqual(result, expected)
+
+        # имя агрегации совпадает с полем модели, агрегация вычисляется по каждой группе
+        expected = [queryset.filter(**x).aggregate(name=Max('name')) for x in alikes]
+        with self.assertNumQueries(len(alikes)):
+            result = queryset.aggregate_alike(alikes, name=Max('name'))
+        self.assertEqual(result, expected)
+
+        distinct = self.get_queryset(TermModel.objects.distinct())
+        expected = [distinct.filter(**x).aggregate(count=Count('id')) for x in alikes]
+        with self.assertNumQueries(len(alikes)):
+            result = distinct.aggregate_alike(alikes, count=Count('id'))
+        self.assertEqual(result, expected)
+        self.assertEqual(queryset.aggregate_alike([], count=Count('id')), [])
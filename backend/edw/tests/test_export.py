@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import datetime
+import io
+import json
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import six
+from django.utils.encoding import force_text
+
+from edw.models.defaults.term import Term
+from edw.models.term import TermModel
+from edw.rest.export import iterate_chunks, render_csv, render_ndjson, _flatten_value
+
+
+ROWS = [
+    OrderedDict([
+        ('id', 1),
+        ('entity_name', 'Объект "1"'),
+        ('created_at', datetime.datetime(2020, 1, 2, 3, 4, 5)),
+        ('price', Decimal('10.50')),
+        ('short_characteristics', [{'name': 'Цвет', 'values': ['красный', 'синий']},
+                                   {'name': 'Размер', 'values': [42]}]),
+        ('tags', ['a', 'b']),
+        ('extra', {'url': '/entity/1/'}),
+        ('media', None),
+    ]),
+    OrderedDict([
+        ('id', 2),
+        ('entity_name', 'Объект, второй\nстрока'),
+        ('created_at', None),
+        ('price', None),
+        ('short_characteristics', []),
+        ('tags', []),
+        ('extra', {}),
+        ('media', '<p>2</p>'),
+    ]),
+]
+
+
+class ExportRenderersTestHandler(SimpleTestCase):
+
+    def test_ndjson(self):
+        lines = list(render_ndjson(ROWS))
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(all(x.endswith('\n') and x.count('\n') == 1 for x in lines))
+        data = json.loads(lines[0])
+        self.assertEqual(data['entity_name'], 'Объект "1"')
+        self.assertEqual(data['created_at'], '2020-01-02T03:04:05')
+        self.assertEqual(data['price'], 10.5)
+        self.assertEqual(json.loads(lines[1])['entity_name'], 'Объект, второй\nстрока')
+
+    def test_csv(self):
+        content = ''.join(force_text(x) for x in render_csv(iter(ROWS)))
+        rows = list(csv.reader(io.StringIO(content) if six.PY3 else io.BytesIO(content.encode('utf-8'))))
+        if six.PY2:
+            rows = [[force_text(x) for x in row] for row in rows]
+        self.assertEqual(rows[0], list(ROWS[0].keys()))
+        self.assertEqual(rows[1], ['1', 'Объект "1"', '2020-01-02 03:04:05', '10.50',
+                                   'Цвет: красный, синий; Размер: 42', 'a, b', '{"url": "/entity/1/"}', ''])
+        self.assertEqual(rows[2], ['2', 'Объект, второй\nстрока', '', '', '', '', '{}', '<p>2</p>'])
+
+    def test_csv_without_rows(self):
+        self.assertEqual(list(render_csv([])), [])
+
+    def test_flatten_value(self):
+        self.assertEqual(_flatten_value([[1, 2], [3]]), '1, 2, 3')
+        self.assertEqual(_flatten_value([{'id': 1}, {'id': 2}]), '{"id": 1}; {"id": 2}')
+        self.assertEqual(_flatten_value(True), 'True')
+
+
+class IterateChunksTestHandler(TestCase):
+
+    def setUp(self):
+        for pk in range(1, 8):
+            Term.objects.create(id=pk, name='Term{}'.format(pk), slug='term{}'.format(pk),
+                                semantic_rule=TermModel.OR_RULE, specification_mode=TermModel.STANDARD_SPECIFICATION,
+                                active=True, description='', attributes=0, system_flags=0)
+
+    def test_chunks(self):
+        queryset = TermModel.objects.order_by('id')
+        chunks = [[x.id for x in chunk] for chunk in iterate_chunks(queryset, 3)]
+        self.assertEqual(chunks, [[1, 2, 3], [4, 5, 6], [7]])
+        self.assertEqual([len(x) for x in iterate_chunks(queryset, 7)], [7])
+        self.assertEqual(list(iterate_chunks(queryset.none(), 3)), [])
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.test import TestCase, RequestFactory, override_settings
+
+from edw.models.defaults.term import Term
+from edw.models.term import TermModel
+from edw.rest.serializers import mixins
+from edw.rest.serializers.mixins import HTMLSnippetSerializerMixin
+
+
+class _CacheCalls(object):
+    """
+    Counts calls of the cache methods
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self.calls = []
+
+    def __getattr__(self, name):
+        self.calls.append(name)
+        return getattr(self.cache, name)
+
+
+class _TermSnippetRenderer(HTMLSnippetSerializerMixin):
+    HTML_SNIPPET_CACHE_KEY_PATTERN = 'test_snippet:{0}:{1}:{2}:{3}:{4}:{5}'
+
+    label = 'summary'
+    html_snippet_name = 'term'
+    html_snippet_templates_dir = 'terms'
+    html_snippet_model_attr = 'slug'
+    html_snippet_cache_duration = 'entity_html_snippet'
+
+    def __init__(self, request):
+        self.fields = {'media': None}
+        self.context = {'request': request}
+        self.rendered = []
+
+    def _render_html_snippet(self, obj, postfix):
+        self.rendered.append(obj.id)
+        return '<p>{}</p>'.format(obj.name)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'edw-test-html-snippets',
+    }
+})
+class HTMLSnippetPrefetchTestHandler(TestCase):
+
+    def setUp(self):
+        for pk in range(1, 6):
+            Term.objects.create(id=pk, name='Term{}'.format(pk), slug='term{}'.format(pk),
+                                semantic_rule=TermModel.OR_RULE, specification_mode=TermModel.STANDARD_SPECIFICATION,
+                                active=True, description='', attributes=0, system_flags=0)
+        self.cache = mixins.cache
+        mixins.cache = _CacheCalls(self.cache)
+        self.cache.clear()
+        self.request = RequestFactory().get('/')
+
+    def tearDown(self):
+        mixins.cache = self.cache
+
+    def render_page(self):
+        terms = list(TermModel.objects.order_by('id'))
+        mixins.cache.calls = []
+        renderer = _TermSnippetRenderer(self.request)
+        renderer.prefetch_html_snippets(terms)
+        return [renderer.render_html(x, 'media') for x in terms], renderer
+
+    def test_page_snippets_are_fetched_at_once(self):
+        snippets, renderer = self.render_page()
+        self.assertEqual(snippets, ['<p>Term{}</p>'.format(pk) for pk in range(1, 6)])
+        self.assertEqual(mixins.cache.calls, ['get_many', 'set_many'])
+        self.assertEqual(renderer.rendered, [1, 2, 3, 4, 5])
+
+        snippets, renderer = self.render_page()
+        self.assertEqual(snippets, ['<p>Term{}</p>'.format(pk) for pk in range(1, 6)])
+        self.assertEqual(mixins.cache.calls, ['get_many'])
+        self.assertEqual(renderer.rendered, [])
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db.models import F
+from django.test import TestCase, RequestFactory
+from django.utils import timezone
+from rest_framework.request import Request
+
+from edw import settings as edw_settings
+from edw.models.defaults.term import Term
+from edw.models.term import TermModel
+from edw.rest.pagination import (
+    EntityCursorPagination,
+    EntityPagination,
+    COUNT_EXACT,
+    COUNT_CACHED,
+    COUNT_ESTIMATE,
+    COUNT_HAS_MORE
+)
+
+
+class _Items(list):
+    """
+    List with the counting methods of entities queryset
+    """
+    estimate = None
+    count_calls = 0
+
+    def count(self):
+        self.count_calls += 1
+        return len(self)
+
+    def cached_count(self):
+        return len(self)
+
+    def estimated_count(self):
+        return self.estimate
+
+    def bounded_count(self, bound):
+        return min(len(self), bound)
+
+
+def make_request(url):
+    request = RequestFactory().get(url)
+    request.GET = request.GET.copy()
+    request.GET['_data_mart'] = None
+    return Request(request)
+
+
+class EntityPaginationCountTestHandler(TestCase):
+
+    def paginate(self, items, strategy, offset=0, limit=10, threshold=100):
+        pagination = EntityPagination()
+        pagination.count_estimate_threshold = threshold
+        page = pagination.paginate_queryset(items, make_request('/?limit={}&offset={}&count_strategy={}'.format(
+            limit, offset, strategy)))
+        return page, pagination
+
+    def test_exact(self):
+        items = _Items(range(25))
+        page, pagination = self.paginate(items, COUNT_EXACT)
+        self.assertEqual((page, pagination.count, pagination.count_is_exact), (list(range(10)), 25, True))
+        self.assertEqual(items.count_calls, 1)
+
+    def test_cached(self):
+        items = _Items(range(25))
+        page, pagination = self.paginate(items, COUNT_CACHED)
+        self.assertEqual((pagination.count, pagination.count_is_exact), (25, True))
+        self.assertEqual(items.count_calls, 0)
+
+    def test_estimate(self):
+        items = _Items(range(25))
+        items.estimate = 1000
+        page, pagination = self.paginate(items, COUNT_ESTIMATE)
+        self.assertEqual((page, pagination.count, pagination.count_is_exact), (list(range(10)), 1000, False))
+        # оценка ниже порога, количество считается точно
+        items.estimate = 50
+        page, pagination = self.paginate(items, COUNT_ESTIMATE)
+        self.assertEqual((pagination.count, pagination.count_is_exact), (25, True))
+
+    def test_bounded_estimate(self):
+        items = _Items(range(250))
+        page, pagination = self.paginate(items, COUNT_ESTIMATE)
+        self.assertEqual((pagination.count, pagination.count_is_exact), (101, False))
+        # граница не меньше запрошенной страницы
+        page, pagination = self.paginate(items, COUNT_ESTIMATE, offset=200)
+        self.assertEqual((page, pagination.count, pagination.count_is_exact), (list(range(200, 210)), 211, False))
+        page, pagination = self.paginate(_Items(range(25)), COUNT_ESTIMATE)
+        self.assertEqual((pagination.count, pagination.count_is_exact), (25, True))
+
+    def test_has_more(self):
+        items = _Items(range(25))
+        page, pagination = self.paginate(items, COUNT_HAS_MORE, offset=10)
+        self.assertEqual((page, pagination.count, pagination.count_is_exact), (list(range(10, 20)), 21, False))
+        self.assertIsNotNone(pagination.get_next_link())
+        page, pagination = self.paginate(items, COUNT_HAS_MORE, offset=20)
+        self.assertEqual((page, pagination.count, pagination.count_is_exact), (list(range(20, 25)), 25, True))
+        self.assertIsNone(pagination.get_next_link())
+        self.assertEqual(items.count_calls, 0)
+
+    def test_default_strategy(self):
+        page, pagination = self.paginate(_Items(range(25)), 'unknown')
+        self.assertEqual(pagination.count_strategy, edw_settings.REST_PAGINATION['entity_count_strategy'])
+        response = pagination.get_paginated_response(page)
+        self.assertEqual((response.data['count'], response.data['count_is_exact']), (25, True))
+
+
+class EntityCursorPaginationTestHandler(TestCase):
+    LIMIT = 2
+
+    def setUp(self):
+        created_at = timezone.now().replace(microsecond=0)
+        # значения различаются только микросекундами, 2 и 3 совпадают
+        for pk, microsecond, specification_mode in ((1, 1, 0), (2, 2, 1), (3, 2, 0), (4, 3, 1), (5, 4, 0)):
+            Term.objects.create(id=pk, name='Term{}'.format(pk), slug='term{}'.format(pk),
+                                semantic_rule=TermModel.OR_RULE, specification_mode=specification_mode,
+                                active=True, description='', attributes=0, system_flags=0)
+            Term.objects.filter(pk=pk).update(created_at=created_at + datetime.timedelta(microseconds=microsecond))
+
+    def paginate(self, queryset, url):
+        pagination = EntityCursorPagination()
+        page = pagination.paginate_queryset(queryset, make_request(url))
+        self.assertTrue(pagination.is_cursor)
+        return [x.pk for x in page], pagination
+
+    def walk(self, queryset):
+        """
+        Проходит страницы вперед по ссылкам 'next', затем назад по ссылкам 'previous'
+        """
+        forward, backward = [], []
+        page, pagination = self.paginate(queryset, '/?limit={}'.format(self.LIMIT))
+        forward.append(page)
+        while pagination.get_next_link() is not None:
+            page, pagination = self.paginate(queryset, pagination.get_next_link())
+            forward.append(page)
+        backward.append(page)
+        while pagination.get_previous_link() is not None:
+            page, pagination = self.paginate(queryset, pagination.get_previous_link())
+            backward.append(page)
+        return forward, backward[::-1]
+
+    def assertPages(self, queryset, expected):
+        pages = [expected[i:i + self.LIMIT] for i in range(0, len(expected), self.LIMIT)]
+        forward, backward = self.walk(queryset)
+        self.assertEqual(forward, pages)
+        self.assertEqual(backward, pages)
+
+    def test_created_at_ordering(self):
+        self.assertPages(TermModel.objects.order_by('created_at'), [1, 2, 3, 4, 5])
+        self.assertPages(TermModel.objects.order_by('-created_at'), [5, 4, 2, 3, 1])
+        self.assertPages(TermModel.objects.order_by('-created_at', '-id'), [5, 4, 3, 2, 1])
+
+    def test_annotated_ordering(self):
+        queryset = TermModel.objects.annotate(mode=F('specification_mode'))
+        self.assertPages(queryset.order_by('mode', '-created_at'), [5, 3, 1, 4, 2])
+        self.assertPages(queryset.order_by('-mode', 'created_at'), [2, 4, 1, 3, 5])
+
+    def test_cursor_round_trip(self):
+        queryset = TermModel.objects.order_by('created_at')
+        page, pagination = self.paginate(queryset, '/?limit={}'.format(self.LIMIT))
+        position = pagination.next_position
+        request = Request(RequestFactory().get(pagination.encode_cursor(position, True)))
+        decoded, reverse = pagination.decode_cursor(request)
+        self.assertTrue(reverse)
+        self.assertEqual(decoded[0], position[0].isoformat())
+        self.assertEqual(decoded[1:], position[1:])
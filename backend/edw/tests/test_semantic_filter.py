@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import random
+
+from django.db.models import Q
+from django.test import SimpleTestCase
+
+from edw.management.commands.benchmark_semantic_filter import make_tree
+from edw.models.sql.semantic import (
+    TermsPredicate,
+    AndPredicate,
+    OrPredicate,
+    SemanticFilterComplexityError,
+    make_semantic_predicate
+)
+
+
+def evaluate(q, terms):
+    """
+    Evaluate semantic filter Q object for entity with `terms`
+    """
+    results = []
+    for child in q.children:
+        if isinstance(child, Q):
+            results.append(evaluate(child, terms))
+        else:
+            lookup, value = child
+            results.append(bool(terms & set(value)) if lookup.endswith('__in') else value in terms)
+    result = any(results) if q.connector == Q.OR else all(results)
+    return not result if q.negated else result
+
+
+def matches(predicate, terms):
+    """
+    Evaluate semantic predicate for entity with `terms`
+    """
+    if isinstance(predicate, TermsPredicate):
+        return bool(terms & set(predicate.ids))
+    results = [matches(x, terms) for x in predicate.children]
+    return all(results) if isinstance(predicate, AndPredicate) else any(results)
+
+
+class SemanticPredicateTestHandler(SimpleTestCase):
+
+    def test_or_predicate_merges_terms(self):
+        predicate = OrPredicate.make([TermsPredicate([1, 2]), TermsPredicate([2, 3]), None])
+        self.assertIsInstance(predicate, TermsPredicate)
+        self.assertEqual(predicate.ids, [1, 2, 3])
+
+        predicate = OrPredicate.make([
+            TermsPredicate([1]),
+            AndPredicate.make([TermsPredicate([2]), TermsPredicate([3])]),
+            OrPredicate.make([TermsPredicate([4]), AndPredicate([TermsPredicate([5])])])
+        ])
+        self.assertEqual(len(predicate.children), 3)
+        self.assertEqual(predicate.children[0].ids, [1, 4])
+        self.assertEqual(predicate.complexity, 4)
+
+    def test_and_predicate_flattens_nested(self):
+        predicate = AndPredicate.make([
+            TermsPredicate([1]),
+            AndPredicate.make([TermsPredicate([2]), TermsPredicate([3])])
+        ])
+        self.assertEqual([x.ids for x in predicate.children], [[1], [2], [3]])
+        self.assertIsNone(AndPredicate.make([None]))
+
+    def test_complexity_is_linear(self):
+        for branches in range(1, 7):
+            predicate = make_semantic_predicate(make_tree(branches, 3))
+            # термин "ИЛИ" верхнего уровня и по подзапросу на каждую ветку "И", вместо 3 ** branches фильтров КНФ
+            self.assertEqual(predicate.complexity, 1 + branches * 3)
+
+    def test_complexity_limit(self):
+        tree = make_tree(4, 3)
+        self.assertIsNotNone(make_semantic_predicate(tree, 13))
+        self.assertRaises(SemanticFilterComplexityError, make_semantic_predicate, tree, 12)
+
+    def test_predicate_equals_cnf_filters(self):
+        rnd = random.Random(0)
+        for branches in range(1, 5):
+            for width in range(1, 4):
+                tree = make_tree(branches, width)
+                terms_ids = list(tree.keys())
+                entities = dict((pk, set(rnd.sample(terms_ids, rnd.randint(0, len(terms_ids)))))
+                                for pk in range(200))
+                filters = tree.root.term.make_filters(term_info=tree.root, field_name='terms')
+                expected = set(pk for pk, terms in entities.items() if all(evaluate(x, terms) for x in filters))
+                predicate = make_semantic_predicate(tree)
+                self.assertEqual(set(pk for pk, terms in entities.items() if matches(predicate, terms)), expected,
+                                 msg='branches: {}, width: {}'.format(branches, width))
@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
+import pickle
+import warnings
+
 from django.test import TestCase
 
+from edw import settings as edw_settings
 from edw.models.defaults.term import Term
+from edw.models.mptt_info import get_queryset_by_ranges, TermInfo, TermTreeInfo
+from edw.models.mptt_snapshot import MPTTForestSnapshot
 from edw.models.term import TermModel
 
 
@@ -93,3 +99,138 @@ class TermTestHandler(TestCase):
 
     def test_term_decompress_fix_it_true(self):
         self.assertEqual(TermModel.decompress(value=[4, 5], fix_it=True), {1: [[]], 2: []})
+
+    def test_term_decompress_ancestors_query_count(self):
+        # дерево собирается по базе данных: один запрос выбранных терминов и один запрос всех их предков
+        options = edw_settings.TERM_SNAPSHOT
+        enabled = options['enabled']
+        options['enabled'] = False
+        try:
+            with self.assertNumQueries(2):
+                tree = TermModel.decompress(value=[4, 5, 3])
+        finally:
+            options['enabled'] = enabled
+        self.assertEqual(tree, {1: [[[], []]], 2: [[], []], 3: [], 4: [], 5: []})
+        self.assertEqual(tree[4].term.parent.id, 2)
+
+    def test_term_invert_single_query(self):
+        options = edw_settings.TERM_SNAPSHOT
+        enabled = options['enabled']
+        options['enabled'] = False
+        try:
+            tree = TermModel.decompress(value=[4])
+            with self.assertNumQueries(1):
+                inverted_ids = list(tree.invert().values_list('id', flat=True))
+        finally:
+            options['enabled'] = enabled
+        self.assertEqual(inverted_ids, [5])
+
+    def test_term_leaf_filters_without_queries(self):
+        term2 = TermModel.objects.get(pk=2)
+        self.assertEqual(sorted(term2.get_leaf_ids()), [2, 4, 5])
+        # поддерево берется из снимка леса или кэша
+        with self.assertNumQueries(0):
+            filters = term2.make_leaf_filters('terms')
+        self.assertEqual(len(filters), 1)
+
+    def test_snapshot_queryset_by_ids(self):
+        snapshot = MPTTForestSnapshot.load(TermModel, 0)
+        options = edw_settings.TERM_SNAPSHOT
+        threshold = options['ids_join_threshold']
+        try:
+            for value in (0, 1):
+                options['ids_join_threshold'] = value
+                queryset = snapshot.get_queryset([2, 3, 4, 5])
+                self.assertEqual(sorted(queryset.values_list('id', flat=True)), [2, 3, 4, 5])
+                self.assertEqual(list(snapshot.get_queryset([]).values_list('id', flat=True)), [])
+                # во вложенном запросе таблица получает другой псевдоним
+                self.assertEqual(sorted(TermModel.objects.filter(
+                    id__in=queryset.values('id')).values_list('id', flat=True)), [2, 3, 4, 5])
+            # значения lft снимка устаревают после изменения дерева, запрос по id остается корректным
+            Term.objects.filter(id=3).update(tree_id=self.term1.tree_id, lft=100, rght=101)
+            self.assertEqual(sorted(snapshot.get_queryset([2, 3]).values_list('id', flat=True)), [2, 3])
+        finally:
+            options['ids_join_threshold'] = threshold
+
+    def test_snapshot_family_equals_database_family(self):
+        options = edw_settings.TERM_SNAPSHOT
+        enabled = options['enabled']
+        try:
+            options['enabled'] = False
+            tree = TermModel.decompress(value=[2, 3])
+            expected = sorted(tree.get_family().values_list('id', flat=True))
+            options['enabled'] = True
+            MPTTForestSnapshot.invalidate(TermModel)
+            tree = TermModel.decompress(value=[2, 3])
+            self.assertEqual(sorted(tree.get_family().values_list('id', flat=True)), expected)
+        finally:
+            options['enabled'] = enabled
+        self.assertEqual(expected, [1, 2, 3, 4, 5])
+
+    def test_deprecated_buffers_delegate_to_generations(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertIs(TermModel.get_decompress_buffer(), TermModel.get_decompress_generation())
+            self.assertIs(TermModel.get_children_buffer(), TermModel.get_children_generation())
+        self.assertEqual([x.category for x in caught], [DeprecationWarning, DeprecationWarning])
+
+    def test_queryset_by_ranges_join(self):
+        ranges = [(x.tree_id, x.lft, x.lft) for x in TermModel.objects.filter(id__in=[3, 4, 5])]
+        options = edw_settings.MPTT_DESCENDANTS
+        threshold = options['ranges_join_threshold']
+        try:
+            options['ranges_join_threshold'] = 0
+            expected = sorted(get_queryset_by_ranges(TermModel, ranges).values_list('id', flat=True))
+            options['ranges_join_threshold'] = 1
+            queryset = get_queryset_by_ranges(TermModel, ranges, add_to_result=[1])
+            self.assertIn('EXISTS', str(queryset.query))
+            self.assertEqual(sorted(queryset.values_list('id', flat=True)), [1] + expected)
+            # во вложенном запросе таблица получает другой псевдоним
+            subquery = get_queryset_by_ranges(TermModel, ranges).values('id')
+            self.assertEqual(sorted(TermModel.objects.filter(
+                id__in=subquery).values_list('id', flat=True)), expected)
+        finally:
+            options['ranges_join_threshold'] = threshold
+        self.assertEqual(expected, [3, 4, 5])
+
+    def test_tree_expand_copy_on_write(self):
+        tree = TermModel.decompress(value=[1, 3])
+        expanded = {1: [[[], []]], 2: [[], []], 3: [], 4: [], 5: []}
+        self.assertEqual(tree.expand(), expanded)
+        shared = tree.expand(copy_on_write=True)
+        self.assertEqual(shared, expanded)
+        self.assertEqual(shared.root, [[[[], []]], []])
+        # исходное дерево не изменяется, нерасширенные узлы разделяются
+        self.assertEqual(tree, {1: [], 3: []})
+        self.assertEqual(tree.root, [[], []])
+        self.assertIs(shared[3], tree[3])
+        self.assertIsNot(shared[1], tree[1])
+        self.assertEqual(sorted(tree.trim([2]).keys()), [1, 2, 4, 5])
+
+    def test_tree_pickle(self):
+        tree = TermModel.decompress(value=[4, 5])
+        tree[2].attrs['selected'] = True
+        restored = pickle.loads(pickle.dumps(tree))
+        self.assertEqual(restored, tree)
+        self.assertEqual(restored.root, tree.root)
+        self.assertEqual(restored[2].attrs, {'selected': True})
+        self.assertIsNone(restored[4]._attrs)
+
+        # узел, сохраненный в кэше до перехода на __slots__
+        node = TermInfo.__new__(TermInfo)
+        node.__setstate__({'term': self.term3, 'is_leaf': True, 'attrs': {}})
+        self.assertEqual((node.term, node.is_leaf, node.attrs), (self.term3, True, {}))
+
+    def test_deep_tree_without_recursion(self):
+        depth = 5000
+        root = TermInfo(term=TermModel(semantic_rule=TermModel.ROOT_RULE, active=True))
+        tree = TermTreeInfo(root)
+        parent = root
+        for pk in range(1, depth + 1):
+            node = tree[pk] = TermInfo(term=TermModel(id=pk, parent_id=pk - 1 or None), is_leaf=pk == depth)
+            parent.append(node)
+            parent = node
+        self.assertEqual(root.get_descendants_ids(), list(range(1, depth + 1)))
+        copy = tree.deepcopy()
+        self.assertEqual(copy[1].get_descendants_ids(), list(range(2, depth + 1)))
+        self.assertTrue(copy[depth].is_leaf)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+from django.test import TestCase, RequestFactory
+from rest_framework.request import Request
+
+from edw.models.defaults.term import Term
+from edw.models.term import TermModel
+from edw.rest.serializers.term import TermTreeSerializer
+
+
+class TermTreeSerializerTestHandler(TestCase):
+    # (id, parent id, specification mode, active)
+    TERMS = (
+        (1, None, TermModel.EXPANDED_SPECIFICATION, True),
+        (2, 1, TermModel.STANDARD_SPECIFICATION, True),
+        (3, 1, TermModel.EXPANDED_SPECIFICATION, True),
+        (4, 2, TermModel.STANDARD_SPECIFICATION, True),
+        (5, 2, TermModel.STANDARD_SPECIFICATION, True),
+        (6, 3, TermModel.STANDARD_SPECIFICATION, False),
+        (7, 3, TermModel.EXPANDED_SPECIFICATION, True),
+        (8, None, TermModel.STANDARD_SPECIFICATION, True),
+        (9, 8, TermModel.STANDARD_SPECIFICATION, True),
+    )
+
+    def setUp(self):
+        for pk, parent_id, specification_mode, active in self.TERMS:
+            Term.objects.create(id=pk, parent_id=parent_id, name='Term{}'.format(pk), slug='term{}'.format(pk),
+                                semantic_rule=TermModel.OR_RULE, specification_mode=specification_mode,
+                                active=active, description='', attributes=0, system_flags=0)
+        self.request = Request(RequestFactory().get('/'))
+
+    def serialize(self, prefetch, **context):
+        context.update({'request': self.request, 'prefetch': prefetch, 'cached': False})
+        serializer = TermTreeSerializer(TermModel.objects.toplevel(), many=True, context=context)
+        return json.loads(json.dumps(serializer.data))
+
+    def test_prefetch_children_equals_per_node_queries(self):
+        for selected in ([], [4], [9], [6, 7]):
+            for max_depth in (None, 1, 2):
+                for active_only in (True, False):
+                    context = {'selected': selected, 'max_depth': max_depth, 'active_only': active_only}
+                    self.assertEqual(self.serialize(True, **context), self.serialize(False, **context),
+                                     msg='context: {}'.format(context))
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+
+from edw import settings as edw_settings
+from edw.models.terms_index import EntityTermsIndex
+from edw.utils.bitmap import make_bitmap
+
+
+class _Features(object):
+    max_query_params = 999
+
+
+class _Connection(object):
+    features = _Features()
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'edw-test-terms-index',
+    }
+})
+class EntityTermsIndexTestHandler(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.options = edw_settings.ENTITY_TERMS_INDEX
+        self.saved_options = dict(self.options)
+        self.options['enabled'] = True
+
+    def tearDown(self):
+        self.options.clear()
+        self.options.update(self.saved_options)
+        EntityTermsIndex.reset()
+
+    def make_index(self):
+        return EntityTermsIndex({1: make_bitmap([1, 2]), 2: make_bitmap([3])}, EntityTermsIndex.get_sequence())
+
+    def test_bitmap_queries(self):
+        index = self.make_index()
+        index.apply(EntityTermsIndex.ADD, [4], [2, 3])
+        index.apply(EntityTermsIndex.REMOVE, [1], [1])
+
+        self.assertEqual(sorted(index.union([1, 2])), [2, 3, 4])
+        self.assertEqual(sorted(index.union([3, 100500])), [4])
+        self.assertEqual(index.get_related_terms_ids([4], [1, 2, 3]), [2, 3])
+        self.assertEqual(index.get_related_terms_ids([1], [1, 2, 3]), [])
+
+    def test_journal_sync(self):
+        index = self.make_index()
+        EntityTermsIndex.record(EntityTermsIndex.ADD, [5], [1])
+        EntityTermsIndex.record(EntityTermsIndex.REMOVE, [3], [2])
+
+        self.assertTrue(index.sync())
+        self.assertEqual(index.seq, EntityTermsIndex.get_sequence())
+        self.assertEqual(sorted(index.terms[1]), [1, 2, 5])
+        self.assertEqual(sorted(index.terms[2]), [])
+
+    def test_rolled_back_changes_are_not_recorded(self):
+        seq = EntityTermsIndex.get_sequence()
+        try:
+            with transaction.atomic():
+                EntityTermsIndex.record(EntityTermsIndex.ADD, [5], [1])
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(EntityTermsIndex.get_sequence(), seq)
+
+        with transaction.atomic():
+            EntityTermsIndex.record(EntityTermsIndex.ADD, [5], [1])
+            # запись публикуется только после фиксации транзакции
+            self.assertEqual(EntityTermsIndex.get_sequence(), seq)
+        self.assertEqual(EntityTermsIndex.get_sequence(), seq + 1)
+
+    def test_unwritten_record_is_awaited(self):
+        index = self.make_index()
+        # номер записи опубликован, сама запись еще не записана
+        cache.incr(EntityTermsIndex.SEQUENCE_CACHE_KEY)
+        self.assertTrue(index.sync())
+        self.assertEqual(index.seq, EntityTermsIndex.get_sequence() - 1)
+
+        self.options['journal_write_timeout'] = 0
+        self.assertFalse(index.sync())
+
+    def test_lost_journal_disables_index(self):
+        index = self.make_index()
+        EntityTermsIndex.record(EntityTermsIndex.ADD, [5], [1])
+        cache.delete(EntityTermsIndex.JOURNAL_CACHE_KEY_PATTERN.format(seq=EntityTermsIndex.get_sequence()))
+        self.options['journal_write_timeout'] = 0
+        self.assertFalse(index.sync())
+
+    def test_max_ids_bounded_by_query_params(self):
+        self.options['max_ids'] = 10000
+        self.assertEqual(EntityTermsIndex.get_max_ids(_Connection()), 499)
+        self.assertEqual(EntityTermsIndex.get_max_ids(_Connection(), 100), 100)
+
+    def test_terms_counts_of_independent_selections(self):
+        index = self.make_index()
+        # отфильтрованная выборка не является подмножеством начальной
+        self.assertEqual(index.get_terms_counts([1, 2, 100500], [1], [2, 3]), {1: (1, 1), 2: (0, 1)})
+        self.assertEqual(index.get_terms_counts([1, 2], [1, 2], []), {1: (2, 0)})
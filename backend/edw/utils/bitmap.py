@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+try:
+    from pyroaring import BitMap
+except ImportError:
+    BitMap = None
+
+
+#==============================================================================
+# Bitmaps
+#==============================================================================
+# Если установлен пакет `pyroaring` используются сжатые битовые карты (Roaring bitmaps),
+# иначе - множества python. Оба варианта поддерживают операции `&`, `|`, `-`, `len`, `in` и итерацию.
+
+def make_bitmap(values=()):
+    return BitMap(values) if BitMap is not None else set(values)
+
+
+def intersects(a, b):
+    return a.intersect(b) if BitMap is not None else not a.isdisjoint(b)
+
+
+def intersection_len(a, b):
+    return a.intersection_cardinality(b) if BitMap is not None else len(a & b)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+import warnings
+
+from django.core.cache import cache
+
+from edw import settings as edw_settings
+from edw.utils.circular_buffer_in_cache import RingBuffer, empty
+from edw.utils.lru_cache import LRUCache
+
+
+#==============================================================================
+# Cache generation
+#==============================================================================
+class CacheGeneration(object):
+    """
+    Generation (namespace version) of cache keys family.
+
+    Generation number is folded into every key of the family, so clearing the family is one
+    atomic `incr` of the generation counter, stale keys are never read again and expire by timeout.
+    If `max_size` is set, keys are also recorded in RingBuffer and the oldest key is deleted
+    on overflow (bounded size policy).
+    Optional process local LRU tier (`local_cache`) keeps values of the family in memory,
+    it is coherent with the generation since local keys contain generation number too.
+    With the local tier the generation number itself is kept in memory for `generation_ttl` seconds,
+    so a local hit costs no shared cache round trip, other processes see `incr` after this interval.
+    `delete_many` deletes keys from the shared cache and from the local tier of the current process,
+    local tiers of other processes are unreachable and keep deleted values for at most `ttl` seconds.
+    `get_all`, `clear` and `empty` keep the generation compatible with the former RingBuffer key tracking.
+    """
+    GENERATION_CACHE_KEY_PATTERN = 'gen:{key}'
+    KEY_PATTERN = '{key}:g{generation}'
+
+    GENERATION_CACHE_TIMEOUT = None  # never expire
+
+    _registry = {}
+
+    @staticmethod
+    def factory(key, max_size=None, empty=empty):
+        result = CacheGeneration._registry.get(key, None)
+        if result is None:
+            if not edw_settings.CACHE_GENERATIONS['bounded']:
+                max_size = None
+            result = CacheGeneration._registry[key] = CacheGeneration(key, max_size, empty, True)
+        return result
+
+    def __init__(self, key, max_size, empty, from_factory=False):
+        assert from_factory, 'use "factory" method, for instance create'
+        self.key = key
+        self.empty = empty
+        self.generation_cache_key = CacheGeneration.GENERATION_CACHE_KEY_PATTERN.format(key=key)
+        self.buffer = RingBuffer.factory(key, max_size=max_size, empty=empty) if max_size else None
+        options = edw_settings.LOCAL_CACHE
+        if options['enabled']:
+            options = dict(options, **options['families'].get(key, {}))
+            self.local_cache = LRUCache.factory(key, max_size=options['max_size'], ttl=options['ttl'])
+            self.generation_ttl = options['generation_ttl']
+        else:
+            self.local_cache = None
+            self.generation_ttl = 0
+        # (generation, expires_at) кэшированного в памяти процесса номера поколения
+        self._local_generation = None
+
+    @staticmethod
+    def _initial():
+        # начальное значение зависит от времени, чтобы поколения не повторялись после вытеснения счетчика из кэша
+        return int(time.time() * 1000)
+
+    def get(self):
+        """return current generation"""
+        local_generation = self._local_generation
+        if local_generation is not None and local_generation[1] > time.time():
+            return local_generation[0]
+        val = cache.get(self.generation_cache_key, None)
+        if val is None:
+            cache.add(self.generation_cache_key, self._initial(), self.GENERATION_CACHE_TIMEOUT)
+            val = cache.get(self.generation_cache_key, 0)
+        if self.generation_ttl:
+            self._local_generation = (val, time.time() + self.generation_ttl)
+        return val
+
+    def make_key(self, key, generation=None):
+        """fold generation into the key"""
+        return CacheGeneration.KEY_PATTERN.format(
+            key=key, generation=self.get() if generation is None else generation)
+
+    def make_keys(self, keys):
+        generation = self.get()
+        return [self.make_key(key, generation) for key in keys]
+
+    def record(self, key):
+        """apply bounded size policy to the key, return evicted key or `empty`"""
+        if self.buffer is None:
+            return self.empty
+        old_key = self.buffer.record(key)
+        if old_key != self.empty:
+            cache.delete(old_key)
+        return old_key
+
+    def incr(self):
+        """invalidate all keys of the family"""
+        try:
+            cache.incr(self.generation_cache_key)
+        except ValueError:
+            cache.add(self.generation_cache_key, self._initial(), self.GENERATION_CACHE_TIMEOUT)
+        if self.buffer is not None:
+            self.buffer.clear()
+        # текущий процесс видит новое поколение сразу
+        self._local_generation = None
+        if self.local_cache is not None:
+            # ключи прежнего поколения больше не читаются, освобождаем память сразу
+            self.local_cache.clear()
+
+    def delete_many(self, keys):
+        """delete keys of the family from the shared cache and the local tier of the current process"""
+        cache.delete_many(keys)
+        if self.local_cache is not None:
+            for key in keys:
+                self.local_cache.delete(key)
+
+    def get_all(self):
+        """deprecated RingBuffer API, return recorded keys of the bounded family or empty list"""
+        return self.buffer.get_all() if self.buffer is not None else []
+
+    def clear(self):
+        """deprecated RingBuffer API, keys are invalidated by `incr`"""
+        self.incr()
+
+
+def warn_deprecated_buffer(name, replacement):
+    warnings.warn("`{}` is deprecated, use `{}` instead.".format(name, replacement), DeprecationWarning, stacklevel=3)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import OrderedDict
+
+from edw.utils.circular_buffer_in_cache import empty
+
+
+#==============================================================================
+# Process local LRU cache
+#==============================================================================
+class LRUCache(object):
+    """
+    Bounded process local LRU cache with TTL.
+
+    Used as the first tier in front of the shared Django cache, keys must already
+    contain generation number of the keys family, so the family is invalidated
+    by generation change (see `CacheGeneration.incr`), deleted keys expire in other processes by TTL.
+    """
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    @staticmethod
+    def factory(family, max_size=1000, ttl=5):
+        result = LRUCache._registry.get(family, None)
+        if result is None:
+            with LRUCache._registry_lock:
+                result = LRUCache._registry.get(family, None)
+                if result is None:
+                    result = LRUCache._registry[family] = LRUCache(family, max_size, ttl, True)
+        return result
+
+    def __init__(self, family, max_size, ttl, from_factory=False):
+        assert from_factory, 'use "factory" method, for instance create'
+        self.family = family
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=empty):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is not None:
+                expires_at, value = item
+                if expires_at > time.time():
+                    # перемещаем в конец очереди как последний использованный
+                    self._data[key] = item
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + self.ttl, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_stats(self):
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    @staticmethod
+    def get_all_stats():
+        """return stats of all families"""
+        return dict((family, x.get_stats()) for family, x in list(LRUCache._registry.items()))
+
+    @staticmethod
+    def reset_all():
+        for x in list(LRUCache._registry.values()):
+            x.clear()
+            x.hits = x.misses = x.evictions = 0
@@ -23,10 +23,15 @@ from edw.rest.serializers.data_mart import (
 from edw.rest.filters.data_mart import DataMartFilter
 from edw.rest.filters.backends import EDWFilterBackend
 from edw.models.data_mart import DataMartModel
-from edw.rest.viewsets import CustomSerializerViewSetMixin, remove_empty_params_from_request
+from edw.rest.viewsets import (
+    CustomSerializerViewSetMixin,
+    etag_conditional_response,
+    remove_empty_params_from_request
+)
 from edw.rest.pagination import DataMartPagination
 from edw.rest.permissions import IsSuperuserOrReadOnly
 from edw.views.generics import get_object_or_404
+from edw.views.term import get_trees_generations
 
 try:
     # rest_framework 3.3.3
@@ -98,6 +103,7 @@ class DataMartViewSet(CustomSerializerViewSetMixin, BulkModelViewSet):
         return obj
 
     @list_route(filter_backends=())
+    @etag_conditional_response(get_trees_generations)
     def tree(self, request, data_mart_pk=None, *args, **kwargs):
         if data_mart_pk is not None:
             request.GET.setdefault('parent_id', data_mart_pk)
@@ -119,6 +125,7 @@ class DataMartViewSet(CustomSerializerViewSetMixin, BulkModelViewSet):
         serializer = DataMartTreeSerializer(queryset, many=True, context={"request": request})
         return Response(serializer.data)
 
+    @etag_conditional_response(get_trees_generations)
     def list(self, request, data_mart_pk=None, *args, **kwargs):
         if data_mart_pk is not None:
             request.GET.setdefault('parent_id', data_mart_pk)
@@ -2,9 +2,13 @@
 from __future__ import unicode_literals
 
 from django.apps import apps
+from django.http import StreamingHttpResponse
+from django.utils.translation import ugettext_lazy as _
+from rest_framework.exceptions import ValidationError
 from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer, TemplateHTMLRenderer
 from rest_framework.response import Response
 
+from edw import settings as edw_settings
 from edw.models.data_mart import DataMartModel
 from edw.models.entity import EntityModel
 from edw.rest.filters.entity import (
@@ -14,14 +18,21 @@ from edw.rest.filters.entity import (
     EntityGroupByFilter,
     EntityOrderingFilter
 )
+from edw.rest.export import EXPORT_CONTENT_TYPES, EXPORT_RENDERERS, iterate_chunks
 from edw.rest.filters.backends import EDWFilterBackend
-from edw.rest.pagination import EntityPagination
+from edw.rest.pagination import (
+    PAGINATION_CURSOR,
+    EntityPagination,
+    EntityCursorPagination,
+    get_entity_pagination_mode
+)
 from edw.rest.permissions import IsReadOnly
 from edw.rest.serializers.data_mart import DataMartDetailSerializer
 from edw.rest.serializers.entity import (
     EntityCommonSerializer,
     EntityTotalSummarySerializer,
     EntityDetailSerializer,
+    EntityExportSerializer,
     # EntitySummarySerializer
 )
 from edw.rest.viewsets import CustomSerializerViewSetMixin, remove_empty_params_from_request
@@ -31,7 +42,7 @@ from rest_framework_bulk.generics import BulkModelViewSet
 
 try:
     # rest_framework 3.3.3
-    from rest_framework.decorators import detail_route
+    from rest_framework.decorators import detail_route, list_route
 except ImportError:
     # rest_framework 3.10.3
     from rest_framework.decorators import action
@@ -39,12 +50,16 @@ except ImportError:
     def detail_route(methods=None, **kwargs):
         return action(detail=True, **kwargs)
 
+    def list_route(methods=None, **kwargs):
+        return action(detail=False, **kwargs)
+
 
 class EntityViewSet(CustomSerializerViewSetMixin, BulkModelViewSet):
     """
     A simple ViewSet for listing or retrieving entities.
     Additional actions:
         `data_mart` - retrieve data mart for entity. `GET /edw/api/entities/<id>/data-mart/`
+        `export` - stream filtered entities in NDJSON or CSV. `GET /edw/api/entities/export/?export_format=csv`
     """
     queryset = EntityModel.objects.all()
     serializer_class = EntityCommonSerializer
@@ -57,7 +72,8 @@ class EntityViewSet(CustomSerializerViewSetMixin, BulkModelViewSet):
         'bulk_update': EntityDetailSerializer,
         'partial_update': EntityDetailSerializer,
         'partial_bulk_update': EntityDetailSerializer,
-        'bulk_destroy': EntityCommonSerializer
+        'bulk_destroy': EntityCommonSerializer,
+        'export': EntityExportSerializer
     }
 
     # serializer_context = None
@@ -78,6 +94,9 @@ class EntityViewSet(CustomSerializerViewSetMixin, BulkModelViewSet):
     ordering_fields = '__all__'
 
     pagination_class = EntityPagination
+    cursor_pagination_class = EntityCursorPagination
+
+    export_format_query_param = 'export_format'
 
     REQUEST_CACHED_SERIALIZED_DATA_KEY = '_cached_serialized_data'
 
@@ -86,7 +105,7 @@ class EntityViewSet(CustomSerializerViewSetMixin, BulkModelViewSet):
         return super(EntityViewSet, self).initialize_request(*args, **kwargs)
 
     def initial(self, request, data_mart_pk=None, *args, **kwargs):
-        if self.action in ('retrieve', 'list'):
+        if self.action in ('retrieve', 'list', 'export'):
             # Позваляем устанавливать фильтр активности только для персонала и администраторов
             if request.user.is_active and (request.user.is_staff or request.user.is_superuser):
                 request.GET.setdefault('active', True)
@@ -130,15 +149,51 @@ class EntityViewSet(CustomSerializerViewSetMixin, BulkModelViewSet):
             kwargs[self.settings.FORMAT_SUFFIX_KWARG] = self.format
         return super(EntityViewSet, self).get_format_suffix(**kwargs)
 
-    def list(self, request, *args, **kwargs):
+    def set_terms_and_subj(self, request):
         if self.terms is not None:
             request.GET['terms'] = ','.join([str(x) for x in self.terms]) if isinstance(
                 self.terms, (list, tuple)) else str(self.terms)
         if self.subj is not None:
             request.GET['subj'] = ','.join([str(x) for x in self.subj]) if isinstance(
                 self.subj, (list, tuple)) else str(self.subj)
+
+    def list(self, request, *args, **kwargs):
+        self.set_terms_and_subj(request)
         return super(EntityViewSet, self).list(request, *args, **kwargs)
 
+    @list_route(url_path='export')
+    def export(self, request, *args, **kwargs):
+        '''
+        Stream filtered entities without pagination and summary metadata.
+        Entities are fetched by server-side cursor and serialized by chunks, so memory is bounded
+        regardless of the result size.
+        :param request:
+        :return:
+        '''
+        export_format = request.query_params.get(self.export_format_query_param,
+                                                 edw_settings.REST_EXPORT['entity_default_format'])
+        if export_format not in EXPORT_RENDERERS:
+            raise ValidationError({self.export_format_query_param: _("Unsupported export format `{}`").format(
+                export_format)})
+
+        self.set_terms_and_subj(request)
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer_class = self.get_serializer_class()
+        context = self.get_serializer_context()
+        chunk_size = edw_settings.REST_EXPORT['entity_chunk_size']
+
+        def rows():
+            for chunk in iterate_chunks(queryset, chunk_size):
+                for row in serializer_class(chunk, many=True, context=context).data:
+                    yield row
+
+        response = StreamingHttpResponse(EXPORT_RENDERERS[export_format](rows()),
+                                         content_type=EXPORT_CONTENT_TYPES[export_format])
+        data_mart = request.GET['_data_mart']
+        response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(
+            data_mart.slug if data_mart is not None else 'entities', export_format)
+        return response
+
     def get_object(self):
         obj = getattr(self, '_obj', None)
         if obj is None:
@@ -167,7 +222,7 @@ class EntityViewSet(CustomSerializerViewSetMixin, BulkModelViewSet):
         if self.action in ('retrieve', 'update', 'partial_update', 'destroy'):
             obj = self.get_object()
             model_class = obj.__class__
-        elif self.action in ('create', 'list', 'bulk_update', 'partial_bulk_update', 'bulk_destroy'):
+        elif self.action in ('create', 'list', 'export', 'bulk_update', 'partial_bulk_update', 'bulk_destroy'):
             value = self.kwargs.get('data_mart_pk', request.GET.get('data_mart_pk', None))
             if value is not None:
                 key = 'pk'
@@ -241,6 +296,20 @@ class EntityViewSet(CustomSerializerViewSetMixin, BulkModelViewSet):
                 self.check_object_permissions(self.request, obj)
         return result
 
+    @property
+    def paginator(self):
+        """
+        The paginator instance associated with the view, or `None`.
+        Keyset (cursor) pagination is used when the request contains cursor or selected by settings.
+        """
+        if not hasattr(self, '_paginator'):
+            pagination_class = self.pagination_class
+            if (pagination_class is not None and self.cursor_pagination_class is not None and
+                    get_entity_pagination_mode(self.request) == PAGINATION_CURSOR):
+                pagination_class = self.cursor_pagination_class
+            self._paginator = pagination_class() if pagination_class is not None else None
+        return self._paginator
+
     def get_serializer_context(self):
         context = super(EntityViewSet, self).get_serializer_context()
         if hasattr(self, 'serializer_context'):
@@ -269,7 +338,8 @@ class EntityViewSet(CustomSerializerViewSetMixin, BulkModelViewSet):
         return queryset
 
     def finalize_response(self, request, response, *args, **kwargs):
-        request.GET[self.REQUEST_CACHED_SERIALIZED_DATA_KEY] = response.data
+        # потоковый ответ выгрузки не содержит сериализованных данных
+        request.GET[self.REQUEST_CACHED_SERIALIZED_DATA_KEY] = getattr(response, 'data', None)
         return super(EntityViewSet, self).finalize_response(request, response, *args, **kwargs)
 
 
@@ -22,8 +22,13 @@ from edw.rest.serializers.term import (
 )
 from edw.rest.filters.term import TermFilter
 from edw.rest.filters.backends import EDWFilterBackend
+from edw.models.data_mart import DataMartModel
 from edw.models.term import TermModel
-from edw.rest.viewsets import CustomSerializerViewSetMixin, remove_empty_params_from_request
+from edw.rest.viewsets import (
+    CustomSerializerViewSetMixin,
+    etag_conditional_response,
+    remove_empty_params_from_request
+)
 from edw.rest.pagination import TermPagination
 from edw.rest.permissions import IsSuperuserOrReadOnly
 from edw.views.generics import get_object_or_404
@@ -39,6 +44,13 @@ except ImportError:
         return action(detail=False, **kwargs)
 
 
+def get_trees_generations():
+    """
+    RUS: Возвращает поколения деревьев терминов и витрин данных для формирования ETag ответов.
+    """
+    return TermModel.get_tree_generation().get(), DataMartModel.get_tree_generation().get()
+
+
 class TermViewSet(CustomSerializerViewSetMixin, BulkModelViewSet):
     """
     A simple ViewSet for listing or retrieving terms.
@@ -98,6 +110,7 @@ class TermViewSet(CustomSerializerViewSetMixin, BulkModelViewSet):
         return obj
 
     @list_route(filter_backends=())
+    @etag_conditional_response(get_trees_generations)
     def tree(self, request, data_mart_pk=None, term_pk=None, format=None):
         '''
         Retrieve tree action
@@ -140,6 +153,7 @@ class TermViewSet(CustomSerializerViewSetMixin, BulkModelViewSet):
         serializer = TermTreeSerializer(queryset, many=True, context=context)
         return Response(serializer.data)
 
+    @etag_conditional_response(get_trees_generations)
     def list(self, request, data_mart_pk=None, term_pk=None, *args, **kwargs):
         if term_pk is not None:
             request.GET.setdefault('parent_id', term_pk)